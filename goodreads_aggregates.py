@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Aggregates
+
+Precomputed aggregate cube of the consolidated dataset, so the dashboard panels are
+lookups / slices instead of mask-and-nunique scans over the whole table on every rerun.
+
+Dimensions:
+    category: fiction / non-fiction / unknown
+    status: read / in-progress / tbr
+    genre: each genre of genre_list_trf, plus ALL_GENRES for the totals over books
+    year, month: date of the current status (date read, start reading, date added); 0 if unknown
+Measures:
+    books, pages, rated_books, my_rating_sum, average_rating_sum
+
+The cube is built once per data version (file mtime + size) and stored next to the data.
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from goodreads_genres import GenreMatrix
+from goodreads_storage import data_version, read_consolidated
+
+ALL_GENRES = '(all)'
+DIMENSIONS = ['category', 'status', 'genre', 'year', 'month']
+MEASURES = ['books', 'pages', 'rated_books', 'my_rating_sum', 'average_rating_sum']
+CUBE_COLUMNS = ['Book Id', 'Exclusive Shelf', 'is_fiction', 'is_nonfiction', 'genre_list_trf',
+                'date_read', 'start_reading_dt', 'date_added', 'Number of Pages',
+                'My Rating', 'Average Rating']
+
+
+def book_dimensions(df):
+    """ category, status, year and month of each book (one row per book)"""
+    category = pd.Series('unknown', index=df.index)
+    category[df['is_nonfiction'] == 1] = 'non-fiction'
+    category[df['is_fiction'] == 1] = 'fiction'
+
+    read = df['date_read'].notna() | (df['Exclusive Shelf'] == 'read')
+    in_progress = df['start_reading_dt'].notna() & df['date_read'].isna() & ~read
+    status = pd.Series('tbr', index=df.index)
+    status[in_progress] = 'in-progress'
+    status[read] = 'read'
+
+    status_date = df['date_added'].where(status == 'tbr', df['start_reading_dt'].where(status == 'in-progress', df['date_read']))
+    return pd.DataFrame({
+        'category': category,
+        'status': status,
+        'year': status_date.dt.year.fillna(0).astype(int),
+        'month': status_date.dt.month.fillna(0).astype(int),
+    })
+
+
+def build_cube(df):
+    """ Aggregates the consolidated dataset along DIMENSIONS, one pass per genre grain"""
+    books = book_dimensions(df)
+    books['Book Id'] = df['Book Id']
+    books['pages'] = df['Number of Pages'].fillna(0)
+    books['rated_books'] = (df['My Rating'] != 0).astype(int)
+    books['my_rating_sum'] = df['My Rating'].where(df['My Rating'] != 0, 0)
+    books['average_rating_sum'] = df['Average Rating'].fillna(0)
+    books = books.drop_duplicates(subset='Book Id')
+
+    # genre grain from the genre matrix: (book, genre code) pairs, grouped on the codes
+    genre_matrix = GenreMatrix.from_lists(df['genre_list_trf'])
+    in_books = df.index.isin(books.index)[genre_matrix.row_of]
+    by_genre = books.loc[df.index[genre_matrix.row_of[in_books]]]
+    by_genre = by_genre.assign(genre=genre_matrix.indices[in_books].astype(np.int64) + 1)
+    grains = pd.concat([books.assign(genre=0), by_genre], ignore_index=True)
+    grains['books'] = 1
+    cube = grains.groupby(DIMENSIONS, as_index=False)[MEASURES].sum()
+    cube['genre'] = np.r_[[ALL_GENRES], genre_matrix.genres.to_numpy()][cube['genre'].to_numpy()]
+    return cube
+
+
+def load_cube(data_filepath):
+    """ Loads the stored cube of the current data version, builds (and stores) it if missing"""
+    cube_filepath = '{}.cube-{}.parquet'.format(data_filepath, data_version(data_filepath))
+    if os.path.exists(cube_filepath):
+        return pd.read_parquet(cube_filepath)
+
+    df = read_consolidated(data_filepath, columns=CUBE_COLUMNS, parse_lists=True)
+    cube = build_cube(df)
+    for old_filepath in glob.glob('{}.cube-*.parquet'.format(data_filepath)):
+        os.remove(old_filepath)
+    cube.to_parquet(cube_filepath, index=False)
+    return cube
+
+
+def slice_cube(cube, genre=ALL_GENRES, **dims):
+    """ Rows of the cube matching the given dimension values (a value can be a list)"""
+    mask = cube['genre'] == genre
+    for d, v in dims.items():
+        mask &= cube[d].isin(v) if isinstance(v, (list, tuple, set)) else (cube[d] == v)
+    return cube[mask]
+
+
+def cube_total(cube, measure='books', genre=ALL_GENRES, **dims):
+    return slice_cube(cube, genre, **dims)[measure].sum()
+
+
+def cube_pivot(cube, index, columns, measure='books', genre=ALL_GENRES, **dims):
+    """ measure summed by `index` x `columns`, e.g. books by category x status"""
+    return slice_cube(cube, genre, **dims).pivot_table(index=index, columns=columns, values=measure,
+                                                      aggfunc='sum', fill_value=0)
@@ -13,34 +13,41 @@ Metrics:
     4. Reading velocity over the year (what month I read the most, what genre)
     5. Highlights -> cloud of words (to get the vibes of what interest me the most)
     6. My ratings (overall and per month); my rating vs overall rating of the book (is it usually similar, higher, or lower)
-    
+
 Features:
     1. Data visualization using plotly (+ filtering)
     2. Upload data (to enable others if they want to visualize their Goodreads data)
     3. Crawling Goodreads to get the book info (genre, highlights)
     4. Recommend books to read
-    
+
+Sections:
+    The dashboard is split into sections, picked in the sidebar. Only the selected section
+    runs: its data, its modules (plotly, figure factories, time series, recommender, ...)
+    and its figures are loaded on demand, so the first paint only waits for the overview.
+    Figures are cached per data version and filter selection in the data cache.
+
+Crawl:
+    The Crawl section starts the scraping pipeline in a child process and shows its
+    progress (pages done / total, rate, ETA and errors of each crawl, stage results, time
+    spent fetching / parsing / closing popups), read from the telemetry log.
+
 TODO:
     1. Data transformation (make sure date type of date read, date added; numeric and string types)
-    2. Get the highlights of read books (from kindle highlight, need to learn about selenium) -> should be separated from the main streamlit app, since it needs credentials 
+    2. Get the highlights of read books (from kindle highlight, need to learn about selenium) -> should be separated from the main streamlit app, since it needs credentials
     3. Visualisation (create scorecards, bar charts, line charts, pie charts, word cloud)
-    
+
 """
 
-import pandas as pd 
-import numpy as np 
-# import scipy
-import plotly.graph_objects as go
-import plotly.express as px
-import plotly.figure_factory as ff
-from plotly.subplots import make_subplots
 import streamlit as st
-from datetime import datetime
 import json
 import os
+import time
 import warnings
 warnings.filterwarnings('ignore') ## to avoid error with keyerror 'warnings'
 
+from goodreads_datacache import DataCache
+from goodreads_telemetry import MAX_LOG_BYTES, configure, span
+
 ### FUNCTIONS
 def get_dict_from_file(filepath):
     with open(filepath, 'r') as file:
@@ -49,8 +56,11 @@ def get_dict_from_file(filepath):
     json_dict = json.loads(json_str)
     return json_dict
 
-def plot_ratings_vis(df):
-    avg_myrating = df['My Rating'].mean()
+def plot_ratings_vis(df, avg_myrating):
+    import plotly.figure_factory as ff
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
     hist_average_rating = [df['Average Rating'].tolist()]
     group_labels = ['Overall Average Rating']
     fig = make_subplots(rows=2, cols=1, row_heights=[0.2,0.8],
@@ -71,7 +81,7 @@ def plot_ratings_vis(df):
             go.Scatter(dist_rating.data[1]),
             2, 1
         )
-    
+
     return fig
 
 
@@ -79,176 +89,497 @@ def plot_ratings_vis(df):
 working_dir_path = os.environ['CONDA_PREFIX']
 param = get_dict_from_file(os.path.join(working_dir_path,'parameters.json'))
 
-@st.cache
-def load_data(param):
-    """ Loads in 4 dataframes and does light feature engineering"""
-    df = pd.read_csv(param['consolidated_data_filepath'])
-    
-    # Data Preparation
-    date_cols = ['date_read','date_added','add_to_tbr_dt','start_reading_dt','finish_reading_dt']
-    for c in date_cols:
-        df[c] = pd.to_datetime(df[c])
-    
-    df['add_to_tbr_dt'] = df.apply(lambda x: x['date_added'] if pd.isna(x['add_to_tbr_dt']) else x['add_to_tbr_dt'], axis=1)
-    df['wtr_to_start_read'] = (df['start_reading_dt'] - df['add_to_tbr_dt']).dt.days
-    df['start_to_finish_read'] = (df['date_read'] - df['start_reading_dt']).dt.days
+## Telemetry: load_data spans, and the log the crawls started from the dashboard write to
+telemetry_log_filepath = param.get('telemetry_log_filepath') or os.path.join(working_dir_path, 'telemetry.jsonl')
+configure(telemetry_log_filepath, max_log_bytes=MAX_LOG_BYTES)
+
+## Library selection: my library, or an uploaded Goodreads export (one partition per user)
+@st.experimental_singleton
+def get_user_store(root_dir, genre_cache_filepath, workers):
+    """ One user store (and consolidation worker pool) per process, shared across sessions"""
+    from goodreads_users import UserStore
+    return UserStore(root_dir, genre_cache_filepath, workers)
+
+with st.sidebar:
+    library_choice = st.radio("Library", ('My library', 'Uploaded library'))
+    if library_choice == 'Uploaded library':
+        ## the store (and its worker pool) only starts once an uploaded library is asked for
+        user_store = get_user_store(param.get('user_data_dir', os.path.join(working_dir_path, 'goodreads_users')),
+                                    param.get('genre_cache_filepath'),
+                                    param.get('user_workers', 2))
+        from goodreads_users import user_partition
+        user_id = st.text_input("User name")
+        uploaded_export = st.file_uploader("Goodreads library export (CSV)", type='csv')
+        if not user_id:
+            st.stop()
+        try:
+            user_partition(user_store.root_dir, user_id)
+        except ValueError:
+            st.error("User name {!r}: use at least one letter or digit (a-z, 0-9)".format(user_id))
+            st.stop()
+        if uploaded_export is not None and st.button("Upload"):
+            try:
+                user_store.submit_upload(user_id, uploaded_export.getvalue())
+            except RuntimeError as e:
+                st.warning(str(e))
+        user_status = user_store.status(user_id)
+        st.caption("Status: {}".format(user_status['status']))
+        if user_status['status'] != 'ready':
+            if user_status['status'] == 'failed':
+                st.error(user_status['error'])
+            elif user_status['status'] != 'missing':
+                st.button("Refresh")
+            st.stop()
+        param = dict(param, consolidated_data_filepath=user_store.consolidated_filepath(user_id))
+
+## Columns needed by each section, only these are read from the consolidated dataset
+## (column projection when it is stored as Parquet)
+OVERVIEW_COLUMNS = ('Book Id','Exclusive Shelf','is_fiction','is_nonfiction','date_read','start_reading_dt')
+RATING_COLUMNS = ('Book Id','Exclusive Shelf','is_fiction','is_nonfiction','date_read','year_read','genre_list_trf',
+                  'Title','My Rating','Average Rating')
+READING_TIME_COLUMNS = ('date_added','add_to_tbr_dt')
+HIGHLIGHT_COLUMNS = ('Book Id','Title','year_read')
+
+@st.experimental_singleton
+def get_data_cache(max_mb):
+    """ One data cache per process, shared across sessions"""
+    return DataCache(max_bytes=max_mb * 2 ** 20)
+
+data_cache = get_data_cache(param.get('data_cache_max_mb', 512))
+
+def prepare_data(df):
+    """ Light feature engineering, cached together with the loaded frame"""
+    if {'date_added','add_to_tbr_dt','start_reading_dt','date_read'}.issubset(df.columns):
+        df['add_to_tbr_dt'] = df['add_to_tbr_dt'].fillna(df['date_added'])
+        df['wtr_to_start_read'] = (df['start_reading_dt'] - df['add_to_tbr_dt']).dt.days
+        df['start_to_finish_read'] = (df['date_read'] - df['start_reading_dt']).dt.days
     return df
 
-# Data Aggregation
-main_df = load_data(param)
-
-## Conditions
-null_date_read = main_df['date_read'].isna()
-null_date_start = main_df['start_reading_dt'].isna()
-fiction = (main_df['is_fiction'] == 1)
-nonfiction = (main_df['is_nonfiction'] == 1)
-unknown_category = (main_df['is_fiction'] == 0) & (main_df['is_nonfiction'] == 0)
-# read = (main_df['Exclusive Shelf'] == 'read') | (main_df['Read Count'] > 0)
-read = (main_df['Exclusive Shelf'] == 'read')
-have_rating = main_df['My Rating'] != 0
-
-## Overall
-total_books = main_df['Book Id'].nunique()
-total_books_read = main_df[~null_date_read | read]['Book Id'].nunique()
-total_books_inprogress = main_df[(~null_date_start) & (null_date_read)]['Book Id'].nunique()
-
-### Fiction
-total_books_fic = main_df[fiction]['Book Id'].nunique()
-total_books_read_fic = main_df[(~null_date_read | read) & fiction]['Book Id'].nunique()
-total_books_inprogress_fic = main_df[(~null_date_start) & (null_date_read) & fiction]['Book Id'].nunique()
-
-### Non Fiction
-total_books_nonfic = main_df[nonfiction]['Book Id'].nunique()
-total_books_read_nonfic = main_df[(~null_date_read) & nonfiction]['Book Id'].nunique()
-total_books_inprogress_nonfic = main_df[(~null_date_start) & (null_date_read) & nonfiction]['Book Id'].nunique()
-
-### Unknown Category
-total_books_unknown = main_df[unknown_category]['Book Id'].nunique()
-total_books_read_unknown = main_df[(~null_date_read) & unknown_category]['Book Id'].nunique()
-total_books_inprogress_unknown = main_df[(~null_date_start) & (null_date_read) & unknown_category]['Book Id'].nunique()
+def load_data(param, columns=None, filters=None):
+    """ Loads the consolidated dataset (only the given columns and rows), once per version of the file
+
+    The returned frame is shared (not copied): do not modify it in place.
+    """
+    from goodreads_storage import read_consolidated
+
+    filepath = param['consolidated_data_filepath']
+    with span('load_data', cache='hit') as labels:
+        def read():
+            labels['cache'] = 'miss'
+            return prepare_data(read_consolidated(filepath,
+                                                  columns=None if columns is None else list(columns),
+                                                  filters=None if filters is None else list(filters),
+                                                  parse_lists=True))
+
+        return data_cache.get_or_compute(filepath, ('data', columns, filters), read)
+
+def cached(key, compute):
+    """ Object of the current data version (aggregates, filtered frames), computed once"""
+    return data_cache.get_or_compute(param['consolidated_data_filepath'], key, compute)
+
+def cached_figure(key, build, filepath=None):
+    """ Figure per filter selection, cached serialized (the JSON sent to the browser) and rebuilt from it"""
+    import plotly.io as pio
+    fig_json = data_cache.get_or_compute(filepath or param['consolidated_data_filepath'], key, lambda: build().to_json())
+    return pio.from_json(fig_json)
+
+def get_cube():
+    """ Aggregate cube of the current data version (built once, then a lookup)"""
+    from goodreads_aggregates import load_cube
+    return cached(('cube',), lambda: load_cube(param['consolidated_data_filepath']))
+
+
+## Overview
+def render_overview():
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    from goodreads_aggregates import cube_pivot, cube_total
+    from goodreads_genres import load_genre_matrix
+
+    st.markdown("""
+                ## Overview
+                Total number of books on my shelves as per 1 May 2022, how many have been read,
+                and how many still not finish reading.
+                """)
+
+    def build_total_books():
+        cube = get_cube()
+        total_books = cube_total(cube)
+        total_books_read = cube_total(cube, status='read')
+        total_books_inprogress = cube_total(cube, status='in-progress')
+
+        ### By category: fiction, non-fiction, unknown
+        books_by_category = cube_pivot(cube, index='category', columns='status').reindex(
+                                index=['fiction','non-fiction','unknown'], columns=['read','in-progress','tbr'], fill_value=0)
+        labels = books_by_category.index
+        colors = px.colors.qualitative.Pastel
+        fig_total_books = make_subplots(rows=1, cols=3,
+                                        subplot_titles=("Total Books","Read","In Progress"),
+                                        specs=[[{'type':'domain'}, {'type':'domain'}, {'type':'domain'}]],
+
+                                        )
+        fig_total_books.add_trace(go.Pie(labels=labels, values=books_by_category.sum(axis=1).values,
+                                         name="Total Books",
+                                         insidetextorientation='horizontal'
+                                         ),
+                                  1, 1)
+        fig_total_books.add_trace(go.Pie(labels=labels, values=books_by_category['read'].values,
+                                         name="Books Read",
+                                         insidetextorientation='horizontal'
+                                         ),
+                                  1, 2)
+        fig_total_books.add_trace(go.Pie(labels=labels, values=books_by_category['in-progress'].values,
+                                         name="Books In Progress",
+                                         insidetextorientation='horizontal'
+                                         ),
+                                  1, 3)
+        fig_total_books.update_traces(hole=.52,
+                                      hoverinfo="label+percent+value",
+                                      marker=dict(colors=colors[2:5])
+                                      )
+
+        ## Tricks to find the coordinate for center annotations
+        # coord_annot = []
+        # for p in list(np.arange(start=0, stop=1.1, step=0.1)):
+        #     current_step = "{:.1f}".format(p)
+        #     coord_annot.append(dict(text=current_step, x=p, y=0, font_size=15, showarrow=False))
+        #     coord_annot.append(dict(text=current_step, x=0, y=p, font_size=15, showarrow=False))
+
+        # donut_existing_annot += coord_annot
+
+        donut_center_annot = [
+                dict(text=str(total_books), x=0.103, y=0.53, font_size=27, showarrow=False),
+                dict(text="books", x=0.103, y=0.43, font_size=15, showarrow=False),
+                dict(text=str(total_books_read), x=0.5, y=0.53, font_size=27, showarrow=False),
+                dict(text="books", x=0.5, y=0.43, font_size=15, showarrow=False),
+                dict(text=str(total_books_inprogress), x=0.885, y=0.53, font_size=27, showarrow=False),
+                dict(text="books", x=0.895, y=0.43, font_size=15, showarrow=False)
+            ]
+
+        donut_existing_annot = [a.to_plotly_json() for a in fig_total_books["layout"]["annotations"]]
+        donut_existing_annot += donut_center_annot # so the center annot and subplot title not override each other
+
+        fig_total_books.update_layout(
+                annotations=donut_existing_annot,
+                legend=dict(yanchor="middle",y=0.5),
+                margin=dict(l=3, r=3, t=0, b=3),
+                autosize=False,
+                height=250
+            )
+        return fig_total_books
+
+    st.plotly_chart(cached_figure(('fig_total_books',), build_total_books))
+
+    ### Top genres of my shelves (books per genre and shelf, from the genre matrix: integer-coded
+    ### genre membership of the books, rows in the order of the dataset)
+    def build_top_genres(n=15):
+        main_df = load_data(param, OVERVIEW_COLUMNS + READING_TIME_COLUMNS)
+        genre_matrix = cached(('genre_matrix',), lambda: load_genre_matrix(param['consolidated_data_filepath'], 'genre_list_trf'))
+        shelf_counts = genre_matrix.breakdown(main_df['Exclusive Shelf'].to_numpy())
+        shelf_counts = shelf_counts.loc[shelf_counts.sum(axis=1).sort_values(ascending=False, kind='stable').index[:n]]
+        fig = px.bar(shelf_counts.iloc[::-1].reset_index().rename(columns={'index': 'genre'}).melt(
+                        id_vars='genre', var_name='shelf', value_name='books'),
+                     x='books', y='genre', color='shelf', orientation='h',
+                     color_discrete_sequence=px.colors.qualitative.Pastel[2:5])
+        fig.update_layout(margin=dict(l=3, r=3, t=30, b=3), height=28 * n + 60, legend=dict(orientation='h', y=1.05),
+                          yaxis_title=None)
+        return fig
+
+    st.plotly_chart(cached_figure(('fig_top_genres',), build_top_genres))
+
+
+## Reading velocity (metric 4): books and pages read per day, month and year for each genre
+## (dense arrays of the current data version: a date range is a slice, not a group by)
+def render_reading_velocity():
+    from goodreads_charts import plot_reading_periods, plot_reading_velocity
+    from goodreads_timeseries import load_series
+
+    reading_series = cached(('series',), lambda: load_series(param['consolidated_data_filepath']))
+    st.markdown("""
+                ## Yearly
+                How many books and pages I read each year
+                """)
+    if not len(reading_series.days):
+        st.info("No finished book with a read date yet")
+        return
+
+    velocity_genre = st.selectbox("Genre", reading_series.genres.tolist(), key='velocity_genre')
+    fig_yearly = cached_figure(('fig_yearly', velocity_genre),
+                               lambda: plot_reading_periods(reading_series.series('books', velocity_genre, 'Y'),
+                                                            reading_series.series('pages', velocity_genre, 'Y')))
+    st.plotly_chart(fig_yearly)
+
+    st.markdown("""
+                ## Monthly
+                What month I read the most (pages are spread over the days between start and finish)
+                """)
+    month_col, window_col = st.columns([3, 1])
+    with month_col:
+        velocity_range = st.slider("Dates", min_value=reading_series.days[0].item(), max_value=reading_series.days[-1].item(),
+                                   value=(reading_series.days[0].item(), reading_series.days[-1].item()))
+    with window_col:
+        velocity_window = st.number_input("Rolling days", min_value=1, max_value=365, value=30)
+    fig_monthly = cached_figure(('fig_monthly', velocity_genre) + velocity_range,
+                                lambda: plot_reading_periods(reading_series.series('books', velocity_genre, 'M', *velocity_range),
+                                                             reading_series.series('pages', velocity_genre, 'M', *velocity_range),
+                                                             period_format='%b %Y'))
+    st.plotly_chart(fig_monthly)
+    fig_velocity = cached_figure(('fig_velocity', velocity_genre, velocity_window) + velocity_range,
+                                 lambda: plot_reading_velocity(reading_series.series('pages', velocity_genre, 'D', *velocity_range),
+                                                               reading_series.rolling('pages', velocity_genre, velocity_window, *velocity_range),
+                                                               velocity_window))
+    st.plotly_chart(fig_velocity)
 
-overall_by_category = pd.DataFrame(
-                        data={
-                                "category": ['fiction','non-fiction','unknown'],
-                                "total_books": [total_books_fic, total_books_nonfic, total_books_unknown],
-                                "total_books_read": [total_books_read_fic, total_books_read_nonfic, total_books_read_unknown],
-                                "total_books_inprogress": [total_books_inprogress_fic, total_books_inprogress_nonfic, total_books_inprogress_unknown]
-                            }
-    )
-
-
-## Yearly
-
-
-## Monthly
-
-
-# Visualization
-st.title("Goodreads Analytics")
-st.markdown("""
-            ## Overview
-            Total number of books on my shelves as per 1 May 2022, how many have been read,
-            and how many still not finish reading.
-            """)
-labels = overall_by_category['category']
-colors = px.colors.qualitative.Pastel
-fig_total_books = make_subplots(rows=1, cols=3, 
-                                subplot_titles=("Total Books","Read","In Progress"),
-                                specs=[[{'type':'domain'}, {'type':'domain'}, {'type':'domain'}]],
-                                
-                                )
-fig_total_books.add_trace(go.Pie(labels=labels, values=overall_by_category['total_books'], 
-                                 name="Total Books",
-                                 insidetextorientation='horizontal'
-                                 ), 
-                          1, 1)
-fig_total_books.add_trace(go.Pie(labels=labels, values=overall_by_category['total_books_read'], 
-                                 name="Books Read",
-                                 insidetextorientation='horizontal'
-                                 ), 
-                          1, 2)
-fig_total_books.add_trace(go.Pie(labels=labels, values=overall_by_category['total_books_inprogress'], 
-                                 name="Books In Progress",
-                                 insidetextorientation='horizontal'
-                                 ), 
-                          1, 3)
-fig_total_books.update_traces(hole=.52, 
-                              hoverinfo="label+percent+value",
-                              marker=dict(colors=colors[2:5])
-                              )
-
-## Tricks to find the coordinate for center annotations
-# coord_annot = []
-# for p in list(np.arange(start=0, stop=1.1, step=0.1)):
-#     current_step = "{:.1f}".format(p)
-#     coord_annot.append(dict(text=current_step, x=p, y=0, font_size=15, showarrow=False))
-#     coord_annot.append(dict(text=current_step, x=0, y=p, font_size=15, showarrow=False))
-    
-# donut_existing_annot += coord_annot
-
-donut_center_annot = [
-        dict(text=str(total_books), x=0.103, y=0.53, font_size=27, showarrow=False),
-        dict(text="books", x=0.103, y=0.43, font_size=15, showarrow=False),
-        dict(text=str(total_books_read), x=0.5, y=0.53, font_size=27, showarrow=False),
-        dict(text="books", x=0.5, y=0.43, font_size=15, showarrow=False),
-        dict(text=str(total_books_inprogress), x=0.885, y=0.53, font_size=27, showarrow=False),
-        dict(text="books", x=0.895, y=0.43, font_size=15, showarrow=False)
-    ]
-
-donut_existing_annot = [a.to_plotly_json() for a in fig_total_books["layout"]["annotations"]]
-donut_existing_annot += donut_center_annot # so the center annot and subplot title not override each other
-
-fig_total_books.update_layout(
-        annotations=donut_existing_annot,
-        legend=dict(yanchor="middle",y=0.5),
-        margin=dict(l=3, r=3, t=0, b=3),
-        autosize=False,
-        height=250
-    )
-st.plotly_chart(fig_total_books)
 
 ## Overview of My Rating vs Average Rating per books
 ## TODO: improve the readability, change height / implement filter; change color
-st.markdown("""
-            ## Ratings
-            Usually I only pick books with minimum rating 3.5 
-            """)
-
-rating_df = main_df[(~null_date_read | read) & (have_rating)] 
-rating_df['abs_diff_rating'] = rating_df.apply(lambda x: abs(x['My Rating'] - x['Average Rating']), axis=1)
-rating_df.sort_values(by=['My Rating','abs_diff_rating'],ascending=[False,False],inplace=True,ignore_index=True)            
-
-fig_rating = px.scatter(rating_df, x=['Average Rating','My Rating'], y='Title', labels={'variable':'Rating'})
-for i in range(len(rating_df)):
-    fig_rating.add_shape(
-            type='line',
-            x0=rating_df['My Rating'].iloc[i], y0=rating_df['Title'].iloc[i],
-            x1=rating_df['Average Rating'].iloc[i], y1=rating_df['Title'].iloc[i],
-            line_color="#cccccc"
-        )
-fig_rating.update_xaxes(showgrid=True, gridwidth=0.3)
-fig_rating.update_yaxes(showgrid=False)
-st.plotly_chart(fig_rating)
-
-
-radio_col, vis_rating_col = st.columns([1, 3])
-
-with radio_col:
-    category = st.radio(
-         "Category filter",
-         ('All', 'Fiction', 'Non-Fiction'))
-with vis_rating_col:
-    if category == 'All':
-        fig_rating_dist = plot_ratings_vis(rating_df)
-    elif category == 'Fiction':
-        fig_rating_dist = plot_ratings_vis(rating_df[fiction])
-    elif category == 'Non-Fiction':
-        fig_rating_dist = plot_ratings_vis(rating_df[nonfiction])
-    
-    fig_rating_dist.update_layout(
-            margin=dict(l=3, r=3, t=23, b=3),
-            autosize=False,
-            height=450
-        )
-    st.plotly_chart(fig_rating_dist)
+def prepare_rating_df():
+    """ Read and rated books, best rated (and most different from the average) first"""
+    rating_df = load_data(param, RATING_COLUMNS, filters=(('My Rating','!=',0),)) # only rated books
+    rating_df = rating_df[rating_df['date_read'].notna() | (rating_df['Exclusive Shelf'] == 'read')].copy()
+    rating_df['abs_diff_rating'] = (rating_df['My Rating'] - rating_df['Average Rating']).abs()
+    rating_df.sort_values(by=['My Rating','abs_diff_rating'],ascending=[False,False],inplace=True,ignore_index=True)
+    return rating_df
+
+def render_ratings():
+    from goodreads_aggregates import ALL_GENRES, cube_total
+    from goodreads_charts import filter_ratings, paginate, plot_rating_dumbbell
+
+    st.markdown("""
+                ## Ratings
+                Usually I only pick books with minimum rating 3.5
+                """)
+    cube = get_cube()
+    rating_df = cached(('rating_df',), prepare_rating_df)
+    ## e.g. an uploaded library without any rating
+    if rating_df.empty:
+        st.info("No rated read books yet")
+        return
+
+    ## Filter + paginate: only a page of books is drawn, the figure is cached per filter selection
+    genre_col, year_col, page_col = st.columns([2, 1, 1])
+    with genre_col:
+        rating_genres = sorted(cube.loc[(cube['status'] == 'read') & (cube['rated_books'] > 0), 'genre'].unique())
+        rating_genre = st.selectbox("Genre", rating_genres,
+                                    index=rating_genres.index(ALL_GENRES) if ALL_GENRES in rating_genres else 0)
+    with year_col:
+        rating_years = ['All'] + sorted(rating_df['year_read'].dropna().astype(int).unique().tolist(), reverse=True)
+        rating_year = st.selectbox("Year read", rating_years)
+    filtered_rating_df = cached(('rating_df', rating_genre, rating_year),
+                                lambda: filter_ratings(rating_df,
+                                                       None if rating_genre == ALL_GENRES else rating_genre,
+                                                       None if rating_year == 'All' else rating_year))
+    rating_page_size = param.get('rating_chart_page_size', 50)
+    with page_col:
+        rating_n_pages = max(1, -(-len(filtered_rating_df) // rating_page_size))
+        rating_page = st.number_input("Page", min_value=1, max_value=rating_n_pages, value=1) - 1
+
+    fig_rating = cached_figure(('fig_rating', rating_genre, rating_year, rating_page, rating_page_size),
+                               lambda: plot_rating_dumbbell(paginate(filtered_rating_df, rating_page_size, rating_page)[0]))
+    st.plotly_chart(fig_rating)
+
+
+    radio_col, vis_rating_col = st.columns([1, 3])
+
+    with radio_col:
+        category = st.radio(
+             "Category filter",
+             ('All', 'Fiction', 'Non-Fiction'))
+    with vis_rating_col:
+        if category == 'All':
+            rating_category = ['fiction','non-fiction','unknown']
+            fig_rating_df = rating_df
+        elif category == 'Fiction':
+            rating_category = 'fiction'
+            fig_rating_df = rating_df[rating_df['is_fiction'] == 1]
+        elif category == 'Non-Fiction':
+            rating_category = 'non-fiction'
+            fig_rating_df = rating_df[rating_df['is_nonfiction'] == 1]
+        rated_books = cube_total(cube, 'rated_books', status='read', category=rating_category)
+        if rated_books == 0:
+            st.info("No rated {} books yet".format(category.lower()))
+            return
+        avg_myrating = cube_total(cube, 'my_rating_sum', status='read', category=rating_category) / rated_books
+
+        def build_rating_dist():
+            fig_rating_dist = plot_ratings_vis(fig_rating_df, avg_myrating)
+            fig_rating_dist.update_layout(
+                    margin=dict(l=3, r=3, t=23, b=3),
+                    autosize=False,
+                    height=450
+                )
+            return fig_rating_dist
+
+        st.plotly_chart(cached_figure(('fig_rating_dist', category), build_rating_dist))
+
+
+## Highlights: the words I highlight the most (metric 5)
+## the terms are counted once in the highlight index, a filter only sums the counts of its books
+def render_highlights():
+    st.markdown("""
+                ## Highlights
+                The words I highlight the most
+                """)
+    highlight_index_filepath = param.get('highlight_index_filepath')
+    if not (library_choice == 'My library' and highlight_index_filepath and os.path.exists(highlight_index_filepath)):
+        st.info("No highlight index yet (highlight_index_filepath, filled by goodreads_scraper.py)")
+        return
+
+    from goodreads_charts import plot_word_cloud
+    from goodreads_highlights import HighlightIndex
+
+    def load_highlight_index(method):
+        highlight_index = HighlightIndex(highlight_index_filepath)
+        try:
+            return getattr(highlight_index, method)()
+        finally:
+            highlight_index.close()
+
+    term_matrix = data_cache.get_or_compute(highlight_index_filepath, ('term_matrix',),
+                                            lambda: load_highlight_index('term_matrix'))
+    highlight_genre_df = data_cache.get_or_compute(highlight_index_filepath, ('book_genres',),
+                                                   lambda: load_highlight_index('book_genres'))
+    highlight_book_df = load_data(param, HIGHLIGHT_COLUMNS)
+    highlight_book_df = highlight_book_df[highlight_book_df['Book Id'].astype(str).isin(term_matrix.book_ids)]
+
+    hl_genre_col, hl_year_col, hl_book_col = st.columns([1, 1, 2])
+    with hl_genre_col:
+        highlight_genre = st.selectbox("Genre", ['All'] + sorted(highlight_genre_df['genre'].unique()), key='highlight_genre')
+    with hl_year_col:
+        highlight_years = ['All'] + sorted(highlight_book_df['year_read'].dropna().astype(int).unique().tolist(), reverse=True)
+        highlight_year = st.selectbox("Year read", highlight_years, key='highlight_year')
+    with hl_book_col:
+        highlight_books = highlight_book_df.sort_values('Title')
+        highlight_book = st.selectbox("Book", ['All'] + highlight_books['Title'].tolist(), key='highlight_book')
+
+    def build_word_cloud():
+        book_ids = None
+        if highlight_genre != 'All':
+            book_ids = set(highlight_genre_df.loc[highlight_genre_df['genre'] == highlight_genre, 'book_id'])
+        if highlight_year != 'All':
+            year_ids = set(highlight_book_df.loc[highlight_book_df['year_read'] == highlight_year, 'Book Id'].astype(str))
+            book_ids = year_ids if book_ids is None else book_ids & year_ids
+        if highlight_book != 'All':
+            title_ids = set(highlight_books.loc[highlight_books['Title'] == highlight_book, 'Book Id'].astype(str))
+            book_ids = title_ids if book_ids is None else book_ids & title_ids
+        return plot_word_cloud(term_matrix.top_terms(80, None if book_ids is None else sorted(book_ids)))
+
+    fig_word_cloud = cached_figure(('fig_word_cloud', highlight_genre, highlight_year, highlight_book),
+                                   build_word_cloud, highlight_index_filepath)
+    st.plotly_chart(fig_word_cloud)
+
+
+## Recommendations: to-read books closest to my taste profile (feature 4)
+def render_recommendations():
+    from goodreads_recommender import load_recommender
+
+    st.markdown("""
+                ## What to read next
+                Books of my to-read shelf with the genres I rate the highest
+                """)
+    recommender = cached(('recommender',), lambda: load_recommender(param['consolidated_data_filepath']))
+    like_col, count_col = st.columns([3, 1])
+    with like_col:
+        read_books = recommender.books[recommender.books['Exclusive Shelf'] == 'read'].sort_values('Title')
+        like_title = st.selectbox("More like", ['My taste profile'] + read_books['Title'].tolist())
+    with count_col:
+        recommend_k = st.number_input("Books", min_value=5, max_value=100, value=20, step=5)
+    like_book_id = None if like_title == 'My taste profile' else \
+                   int(read_books.loc[read_books['Title'] == like_title, 'Book Id'].iloc[0])
+    st.dataframe(recommender.recommend(recommend_k, like_book_id=like_book_id))
+
+
+## Crawl: the scraping pipeline started from the dashboard, with a live progress / ETA panel
+@st.experimental_singleton
+def get_crawl_runner(log_filepath):
+    """ One crawl runner per process, shared across sessions (one crawl at a time)"""
+    from goodreads_scraper import CrawlRunner
+    return CrawlRunner(log_filepath)
+
+def format_sec(sec):
+    if sec is None:
+        return '-'
+    minutes, sec = divmod(int(sec), 60)
+    return '{}h{:02d}m'.format(*divmod(minutes, 60)) if minutes >= 60 else '{}m{:02d}s'.format(minutes, sec)
+
+def draw_crawl_progress(runner, follower, running):
+    import pandas as pd
+
+    st.caption("Crawl {} ({}), started {} ago".format(
+        'running' if running else 'finished with exit code {}'.format(runner.process.returncode),
+        ', '.join(runner.stages) or 'all stages', format_sec(time.time() - runner.started_at)))
+    ## the whole run first, then each crawl / consolidation loop
+    for task in sorted(follower.progress, key=lambda t: t != 'pipeline'):
+        progress = follower.progress[task]
+        if progress['total']:
+            st.progress(min(progress['done'] / progress['total'], 1.0))
+        st.caption("{}: {} / {} done, {:.2f}/s, ETA {}, {} errors{}".format(
+            task, progress['done'], progress['total'] if progress['total'] is not None else '?',
+            progress['rate'], format_sec(progress['eta_sec']), progress['errors'],
+            ' (finished)' if progress['finished'] else ''))
+    if follower.stages:
+        st.dataframe(pd.DataFrame(list(follower.stages.values())).reindex(columns=['stage', 'status', 'sec', 'error']))
+    if follower.spans:
+        ## where the time goes: fetch / parse / close_popups, consolidation steps, stages
+        spans = pd.DataFrame.from_dict(follower.spans, orient='index')
+        spans['mean_sec'] = spans['sec'] / spans['count']
+        st.dataframe(spans.round(3))
+    with st.expander("Output"):
+        st.code(runner.output_tail())
+
+def render_crawl():
+    from goodreads_scraper import STAGES
+
+    st.markdown("""
+                ## Crawl
+                Runs the scraping and consolidation pipeline in the background (the selected stages,
+                or all of them). Up-to-date stages are skipped.
+                """)
+    runner = get_crawl_runner(telemetry_log_filepath)
+    stage_names = [s.name for s in STAGES]
+    crawl_stages = st.multiselect("Stages", stage_names)
+    force_stages = st.multiselect("Run again even when up to date", stage_names)
+    start_col, stop_col = st.columns(2)
+    with start_col:
+        if st.button("Start crawl", disabled=runner.running):
+            runner.start(crawl_stages, force_stages)
+    with stop_col:
+        if st.button("Stop crawl", disabled=not runner.running):
+            runner.stop()
+    if runner.follower is None:
+        return
+
+    ## redrawn every second while the crawl runs (a widget change interrupts the loop)
+    panel = st.empty()
+    while True:
+        running = runner.running
+        follower = runner.poll()
+        with panel.container():
+            draw_crawl_progress(runner, follower, running)
+        if not running:
+            break
+        time.sleep(1)
+
+
+## Sections of the sidebar: only the selected one is computed and drawn
+SECTIONS = {
+    'Overview': render_overview,
+    'Yearly / Monthly': render_reading_velocity,
+    'Ratings': render_ratings,
+    'Highlights': render_highlights,
+    'What to read next': render_recommendations,
+    'Crawl': render_crawl,
+}
 
+# Visualization
+st.title("Goodreads Analytics")
+section = st.sidebar.radio("Section", list(SECTIONS))
+SECTIONS[section]()
+
+## Data cache status
+with st.sidebar.expander("Data cache"):
+    st.json(data_cache.stats())
+    if st.button("Reload data"):
+        data_cache.invalidate()
+        st.experimental_rerun()
@@ -0,0 +1,1221 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Benchmarks
+
+Benchmarks for the scraping and data pipeline. Run one with:
+    python goodreads_benchmark.py [BENCHMARK] [OPTIONS]
+
+Benchmarks:
+    backends: pages per second and peak RSS of the http vs selenium scraping backends,
+              on book page fixtures served from localhost
+    consolidation: vectorized consolidation vs the row-wise apply version it replaced,
+                   on a synthetic library export
+    consolidation-check: equivalence of the consolidation with book_data_consolidated_fin.csv
+    ingest: peak RSS and throughput of the streaming (chunked) consolidation vs the in-memory
+            one, on synthetic exports of a few million books
+    timeline: single-pass timeline event parser (long event table + pivot) vs the row-wise
+              substring scans it replaced, on a synthetic corpus of ~1M timeline events
+    title-matching: match rate of the timeline title index vs the exact title merge on the
+                    bundled books_timeline.txt, and its build / match time and accuracy on
+                    perturbed synthetic titles
+    suite: the whole pipeline (consolidation, dashboard loads, aggregates built / stored, figures)
+           on synthetic datasets written in the formats of the pipeline files (1k to 10M
+           books), with cProfile (--profile-dir) and tracemalloc (--tracemalloc) hooks; one
+           JSON line per size and step appended to --output
+    compare: step by step ratios between two suite runs (results files, or the last two runs
+             of one file), exits with 1 on a regression above --threshold
+    dashboard-startup: import time (-X importtime) and time-to-first-paint (first chart sent) of
+                       the dashboard in a new process, cold (no stored cube / series yet) and warm;
+                       --script runs another version of the dashboard, for before / after
+    multi-user: time-to-ready of small uploaded libraries while a large one is being
+                consolidated by the user worker pool
+    highlights: build / incremental update throughput of the highlight term index and top-k
+                latency by book, genre and set of books, vs re-tokenizing the highlights
+    recommender: genre vector build / incremental update time and to-read ranking latency
+                 (blocked top-k over the CSR vectors) on a synthetic library
+    timeseries: build time of the daily / monthly / yearly reading series (vectorized interval
+                spreading) and date-range query latency, vs exploding the reading days in pandas
+                and grouping on every query
+    genres: memory of the integer-coded genre matrix vs the list-of-strings genre column, and
+            has-genre / any / all / top-N / breakdown latency vs scanning the lists, at 1M books
+    rating-chart: build time and JSON payload of the rating dumbbell chart (single Scattergl
+                  trace) vs the add_shape per book version it replaced
+    telemetry: cost of a span / counter / progress update, in memory and with the JSONL log,
+               and pages per second of a fixture crawl with and without the telemetry log
+"""
+
+import argparse
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import psutil
+
+from goodreads_cache import PageCache
+from goodreads_aggregates import ALL_GENRES, load_cube
+from goodreads_charts import (filter_ratings, paginate, plot_rating_dumbbell, plot_reading_periods, plot_reading_velocity,
+                              plot_word_cloud)
+from goodreads_consolidation import (EXPORT_DATE_FORMAT, clean_genre_table, consolidate, shorten_title, timeline_events,
+                                     timeline_wide)
+from goodreads_fetcher import Fetcher, http_page_loader, make_http_session, selenium_page_loader, serve_directory
+from goodreads_genres import GenreMatrix, load_genre_matrix
+from goodreads_highlights import HighlightIndex, highlight_book_id, tokenize
+from goodreads_ingest import cache_genre_index, consolidate_stream
+from goodreads_matching import TitleIndex, match_report
+from goodreads_parsers import parse_book_genres
+from goodreads_recommender import GenreVectors, Recommender, load_recommender
+from goodreads_storage import read_consolidated, write_consolidated
+from goodreads_timeseries import ReadingSeries, load_series, reading_intervals
+from goodreads_telemetry import TELEMETRY, Telemetry
+from goodreads_synthetic import (make_genre_lists, make_genre_table, make_highlights, make_library_export, make_timelines,
+                                 part_seed, perturb_titles, write_dataset)
+from goodreads_users import UserStore
+
+
+### FIXTURES
+def write_book_fixtures(genre_dict, fixture_dir, padding_kb=150):
+    """ Writes one book page per {book_id: genres} entry, mimicking the Goodreads markup
+
+    Real book pages are mostly scripts and styles, `padding_kb` of filler markup is
+    added so the parsing cost is in the same ballpark.
+    """
+    padding = '<div class="filler"><span>lorem ipsum</span></div>\n' * (padding_kb * 1024 // 50)
+    book_dir = os.path.join(fixture_dir, 'book', 'show')
+    os.makedirs(book_dir, exist_ok=True)
+    for book_id, genres in genre_dict.items():
+        elements = ''.join(
+            '<div class="elementList "><div class="left"><a class="actionLinkLite bookPageGenreLink" '
+            'href="/genres/{0}">{1}</a></div></div>\n'.format(g.lower().replace(' ', '-'), g)
+            for g in genres
+        )
+        with open(os.path.join(book_dir, '{}.html'.format(book_id)), 'w') as file:
+            file.write('<html><head><title>{0}</title></head><body><h1>{0}</h1>\n{1}{2}</body></html>'.format(
+                book_id, elements, padding))
+    return sorted(genre_dict.keys())
+
+
+def write_synthetic_inputs(data_dir, n_books, seed=0, part_rows=500000, timeline_books=10000):
+    """ Writes a synthetic library export, genre cache and timeline file of `n_books` books
+
+    Generated in parts of `part_rows` books (each with its own seed), so the generator itself
+    does not need the whole library in memory. Timelines only cover the first `timeline_books` books
+    (reviewed books are a small part of a big library).
+    """
+    export_filepath = os.path.join(data_dir, 'goodreads_library_export.csv')
+    page_cache = PageCache(os.path.join(data_dir, 'genre_cache.sqlite'))
+    timeline = dict()
+    for first_book in range(0, n_books, part_rows):
+        rng_seed = part_seed(seed, first_book)
+        part = make_library_export(min(part_rows, n_books - first_book), rng_seed, first_book)
+        part.to_csv(export_filepath, mode='a', header=first_book == 0, index=False)
+        page_cache.import_genre_dict(make_genre_lists(part['Book Id'], rng_seed))
+        if first_book < timeline_books:
+            timeline.update(make_timelines(part.head(timeline_books - first_book), rng_seed))
+    page_cache.close()
+    with open(os.path.join(data_dir, 'books_timeline.txt'), 'w') as file:
+        file.write(json.dumps(timeline))
+    return export_filepath
+
+
+class PeakRSS:
+    """ Samples the RSS of this process and all its children (chromedriver, Chrome)"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        process = psutil.Process()
+        while not self._stop.is_set():
+            rss = 0
+            for p in [process] + process.children(recursive=True):
+                try:
+                    rss += p.memory_info().rss
+                except psutil.Error:
+                    pass
+            self.peak = max(self.peak, rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+### BASELINES
+## Row-wise consolidation, as it was in goodreads_scraper.py before the vectorized rewrite
+def convert_str_list(row_df,str_col):
+    clean_str = row_df[str_col].replace('[','').replace(']','').replace("'","")
+    str_list = clean_str.split(", ")
+    return str_list
+
+def get_timeline_date(row_df,str_col,substr_timeline):
+    current_timelines = row_df[str_col]
+    dt_list = []
+    for t in current_timelines:
+        if substr_timeline in t:
+            dt = t.replace(substr_timeline,'').strip()
+            dt_list.append(dt)
+    return dt_list
+
+def check_is_genre(row_df,str_col,genre_str):
+    current_genre_list = row_df[str_col]
+    if genre_str in current_genre_list:
+        return 1
+    else:
+        return 0
+
+def exclude_genre(row_df,str_col,genre_str):
+    current_genre_list = row_df[str_col]
+    genre = [x for x in current_genre_list if x != genre_str]
+    return genre
+
+def timeline_dates_rowwise(timeline):
+    book_title = [k for k,v in timeline.items()]
+    timelines = [v for k,v in timeline.items()]
+    book_timeline_df = pd.DataFrame(data={'book_title': book_title, 'timelines': timelines})
+    book_timeline_df['add_to_tbr'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','– Shelved as: to-read'), axis=1)
+    book_timeline_df['start_reading'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','–  Started Reading'), axis=1)
+    book_timeline_df['finish_reading'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','–  Finished Reading'), axis=1)
+
+    book_timeline_df['add_to_tbr_dt_len'] = book_timeline_df.apply(lambda x: len(x['add_to_tbr']),axis=1)
+    book_timeline_df['start_reading_dt_len'] = book_timeline_df.apply(lambda x: len(x['start_reading']),axis=1)
+    book_timeline_df['finish_reading_dt_len'] = book_timeline_df.apply(lambda x: len(x['finish_reading']),axis=1)
+
+    book_timeline_df['add_to_tbr_dt'] = book_timeline_df.add_to_tbr.map(lambda x: x[0] if len(x) == 1 else '')
+    book_timeline_df['start_reading_dt'] = book_timeline_df.start_reading.map(lambda x: x[0] if len(x) == 1 else '')
+    book_timeline_df['finish_reading_dt'] = book_timeline_df.finish_reading.map(lambda x: x[0] if len(x) == 1 else '')
+
+    book_timeline_df.drop(columns=['add_to_tbr','start_reading','finish_reading','add_to_tbr_dt_len','start_reading_dt_len','finish_reading_dt_len'],inplace=True)
+    return book_timeline_df
+
+def consolidate_rowwise(goodreads_lib_export, book_genre_df, timeline):
+    consolidate_df = goodreads_lib_export.merge(book_genre_df, how='left', left_on='Book Id', right_on='book_id')
+    consolidate_df.drop(columns=['book_id', 'book_genre'],inplace=True)
+
+    consolidate_df['date_read'] = pd.to_datetime(consolidate_df['Date Read'])
+    consolidate_df['date_added'] = pd.to_datetime(consolidate_df['Date Added'])
+    consolidate_df['Title_shorten'] = consolidate_df.apply(lambda x: x['Title'].split(" (")[0].strip() if x['Title'].endswith(")") else x['Title'].strip(), axis=1)
+
+    book_timeline_df = timeline_dates_rowwise(timeline)
+
+    consolidate_df = consolidate_df.merge(book_timeline_df, how='left', left_on='Title_shorten', right_on='book_title')
+
+    consolidate_df['add_to_tbr_dt'] = pd.to_datetime(consolidate_df['add_to_tbr_dt'], infer_datetime_format=True)
+    consolidate_df['start_reading_dt'] = pd.to_datetime(consolidate_df['start_reading_dt'], infer_datetime_format=True)
+    consolidate_df['finish_reading_dt'] = pd.to_datetime(consolidate_df['finish_reading_dt'], infer_datetime_format=True)
+
+    consolidate_df.dropna(axis=1, how='all', inplace=True)
+
+    consolidate_df['genre_list'] = consolidate_df.apply(lambda x: convert_str_list(x,'clean_genre_list'), axis=1)
+
+    consolidate_df['is_nonfiction'] = consolidate_df.apply(lambda x: check_is_genre(x,'genre_list','Nonfiction'), axis=1)
+    consolidate_df['is_fiction'] = consolidate_df.apply(lambda x: check_is_genre(x,'genre_list','Fiction'), axis=1)
+
+    consolidate_df['genre_list_trf'] = consolidate_df.apply(lambda x: exclude_genre(x,'genre_list','Nonfiction'), axis=1)
+    consolidate_df['genre_list_trf'] = consolidate_df.apply(lambda x: exclude_genre(x,'genre_list_trf','Fiction'), axis=1)
+
+    consolidate_df['year_read'], consolidate_df['month_read'] = consolidate_df['date_read'].dt.year, consolidate_df['date_read'].dt.month
+    consolidate_df['year_added'], consolidate_df['month_added'] = consolidate_df['date_added'].dt.year, consolidate_df['date_added'].dt.month
+    return consolidate_df
+
+## Rating chart with one layout shape per book, as it was in goodreads_analytics.py
+def plot_rating_shapes(rating_df):
+    fig_rating = px.scatter(rating_df, x=['Average Rating','My Rating'], y='Title', labels={'variable':'Rating'})
+    for i in range(len(rating_df)):
+        fig_rating.add_shape(
+                type='line',
+                x0=rating_df['My Rating'].iloc[i], y0=rating_df['Title'].iloc[i],
+                x1=rating_df['Average Rating'].iloc[i], y1=rating_df['Title'].iloc[i],
+                line_color="#cccccc"
+            )
+    fig_rating.update_xaxes(showgrid=True, gridwidth=0.3)
+    fig_rating.update_yaxes(showgrid=False)
+    return fig_rating
+
+
+### BENCHMARKS
+def run_backend(backend, fixture_dir, concurrency=4, chromedriver_path=None):
+    """ Crawls every fixture book page through the given backend, returns the stats"""
+    server, base_url = serve_directory(fixture_dir)
+    book_ids = sorted(f[:-len('.html')] for f in os.listdir(os.path.join(fixture_dir, 'book', 'show')))
+    urls = ['{}/book/show/{}.html'.format(base_url, b) for b in book_ids]
+
+    with PeakRSS() as peak_rss:
+        start = time.perf_counter()
+        if backend == 'selenium':
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            from selenium.webdriver.chrome.service import Service
+            options = Options()
+            options.headless = True
+            drivers = [webdriver.Chrome(service=Service(chromedriver_path), options=options)
+                       for i in range(concurrency)]
+            load_page = selenium_page_loader(drivers, wait_class='elementList')
+        else:
+            drivers = []
+            load_page = http_page_loader(make_http_session(pool_size=concurrency))
+        startup_sec = time.perf_counter() - start
+
+        # no rate limit: the benchmark measures the backend, not the politeness settings
+        fetcher = Fetcher(load_page, workers=concurrency, max_per_host=concurrency,
+                          rate=1e6, burst=concurrency, retries=0)
+        start = time.perf_counter()
+        results, failures = fetcher.fetch_all(urls, parse_book_genres)
+        crawl_sec = time.perf_counter() - start
+        for d in drivers:
+            d.quit()
+    server.shutdown()
+
+    return {
+        'backend': backend,
+        'pages': len(results),
+        'failures': len(failures),
+        'startup_sec': round(startup_sec, 3),
+        'crawl_sec': round(crawl_sec, 3),
+        'pages_per_sec': round(len(results) / crawl_sec, 2),
+        'peak_rss_mb': round(peak_rss.peak / 2 ** 20, 1),
+    }
+
+
+def benchmark_backends(genre_filepath, backends=('http', 'selenium'), concurrency=4,
+                       chromedriver_path=None, padding_kb=150):
+    """ Runs each backend in its own process, so the peak RSS are not mixed up"""
+    with open(genre_filepath, 'r') as file:
+        genre_dict = json.loads(file.read())
+    stats = []
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        write_book_fixtures(genre_dict, fixture_dir, padding_kb)
+        for backend in backends:
+            cmd = [sys.executable, __file__, 'backend-run', '--backend', backend,
+                   '--fixtures', fixture_dir, '--concurrency', str(concurrency)]
+            if chromedriver_path:
+                cmd += ['--chromedriver', chromedriver_path]
+            out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+            stats.append(json.loads(out.strip().splitlines()[-1]))
+    return stats
+
+
+def csv_roundtrip(df):
+    """ Writes and reads back a frame, the way the consolidated CSV is consumed"""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    buffer.seek(0)
+    return pd.read_csv(buffer)
+
+
+def check_consolidation(library_filepath='goodreads_library_export.csv', genre_filepath='book_genre.csv',
+                        timeline_filepath='books_timeline.txt', expected_filepath='book_data_consolidated_fin.csv'):
+    """ Compares the consolidation of the bundled inputs with the bundled consolidated CSV"""
+    with open(timeline_filepath, 'r') as file:
+        timeline = json.loads(file.read())
+    actual = csv_roundtrip(consolidate(pd.read_csv(library_filepath), pd.read_csv(genre_filepath), timeline))
+    expected = pd.read_csv(expected_filepath)
+    pd.testing.assert_frame_equal(actual, expected)
+    return {'rows': len(actual), 'columns': len(actual.columns), 'equal': True}
+
+
+def benchmark_consolidation(n_books=100000, seed=0, baseline=True):
+    """ Times the vectorized consolidation (and the row-wise baseline) on a synthetic library"""
+    library = make_library_export(n_books, seed)
+    genre_df = csv_roundtrip(make_genre_table(library['Book Id'], seed))
+    # no re-reads: the row-wise version drops their dates, the event parser keeps the latest read
+    timeline = make_timelines(library, seed, reread_rate=0 if baseline else 0.02)
+    library = csv_roundtrip(library)
+
+    stats = {'books': n_books}
+    start = time.perf_counter()
+    vectorized = consolidate(library, genre_df, timeline)
+    stats['vectorized_sec'] = round(time.perf_counter() - start, 3)
+    if baseline:
+        start = time.perf_counter()
+        rowwise = consolidate_rowwise(library, genre_df, timeline)
+        stats['rowwise_sec'] = round(time.perf_counter() - start, 3)
+        stats['speedup'] = round(stats['rowwise_sec'] / stats['vectorized_sec'], 1)
+        pd.testing.assert_frame_equal(csv_roundtrip(vectorized), csv_roundtrip(rowwise))
+        stats['equal'] = True
+    return stats
+
+
+def run_ingest(mode, data_dir, chunk_rows=100000):
+    """ Consolidates the synthetic inputs of `data_dir`, streaming or in memory"""
+    export_filepath = os.path.join(data_dir, 'goodreads_library_export.csv')
+    output_filepath = os.path.join(data_dir, 'consolidated-{}.parquet'.format(mode))
+    with open(os.path.join(data_dir, 'books_timeline.txt'), 'r') as file:
+        timeline = json.loads(file.read())
+    page_cache = PageCache(os.path.join(data_dir, 'genre_cache.sqlite'))
+
+    with PeakRSS() as peak_rss:
+        start = time.perf_counter()
+        if mode == 'stream':
+            rows = consolidate_stream(export_filepath, cache_genre_index(page_cache), timeline,
+                                      output_filepath, chunk_rows)
+        else:
+            library = pd.read_csv(export_filepath)
+            consolidate_df = consolidate(library, clean_genre_table(page_cache.genre_dict(library['Book Id'])), timeline)
+            write_consolidated(consolidate_df, output_filepath)
+            rows = len(consolidate_df)
+        sec = time.perf_counter() - start
+    page_cache.close()
+
+    return {
+        'mode': mode,
+        'books': rows,
+        'chunk_rows': chunk_rows if mode == 'stream' else None,
+        'sec': round(sec, 3),
+        'books_per_sec': round(rows / sec),
+        'peak_rss_mb': round(peak_rss.peak / 2 ** 20, 1),
+    }
+
+
+def benchmark_ingest(book_counts=(1000000, 3000000), modes=('stream', 'memory'), chunk_rows=100000, seed=0):
+    """ Runs each mode in its own process on each library size, so the peak RSS are comparable"""
+    stats = []
+    for n_books in book_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_synthetic_inputs(data_dir, n_books, seed)
+            for mode in modes:
+                cmd = [sys.executable, __file__, 'ingest-run', '--mode', mode,
+                       '--data-dir', data_dir, '--chunk-rows', str(chunk_rows)]
+                out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+                stats.append(json.loads(out.strip().splitlines()[-1]))
+    return stats
+
+
+def benchmark_timeline(n_events=1000000, seed=0, baseline=True):
+    """ Parses a synthetic timeline corpus of about `n_events` events"""
+    # about 3.2 events per book with the synthetic shelf mix
+    library = make_library_export(int(n_events / 3.2), seed)
+    timeline = make_timelines(library, seed)
+    stats = {'books': len(timeline), 'events': sum(len(v) for v in timeline.values())}
+
+    start = time.perf_counter()
+    events = timeline_events(timeline)
+    stats['parse_sec'] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    wide = timeline_wide(events, len(timeline))
+    stats['pivot_sec'] = round(time.perf_counter() - start, 3)
+    stats['events_per_sec'] = round(stats['events'] / (stats['parse_sec'] + stats['pivot_sec']))
+    stats['event_types'] = events['event_type'].value_counts().to_dict()
+    stats['reread_books'] = int((events.groupby('book')['read_number'].max() > 1).sum())
+    stats['dated_finish'] = int(wide['finish_reading_dt'].notna().sum())
+
+    if baseline:
+        start = time.perf_counter()
+        rowwise = timeline_dates_rowwise(timeline)
+        stats['rowwise_sec'] = round(time.perf_counter() - start, 3)
+        stats['speedup'] = round(stats['rowwise_sec'] / (stats['parse_sec'] + stats['pivot_sec']), 1)
+        stats['rowwise_dated_finish'] = int((rowwise['finish_reading_dt'] != '').sum())
+    return stats
+
+
+def benchmark_title_matching(book_counts=(10000, 100000), library_filepath='goodreads_library_export.csv',
+                             timeline_filepath='books_timeline.txt', seed=0, book_id_rate=0.5):
+    """ Title index vs the exact merge on Title_shorten (bundled data), then its scaling and
+    accuracy on synthetic libraries whose timeline titles are perturbed, without and with the
+    Book Id of `book_id_rate` of the review pages (book_id tier)
+    """
+    library = pd.read_csv(library_filepath)
+    with open(timeline_filepath, 'r') as file:
+        timeline = json.loads(file.read())
+    title_index = TitleIndex(list(timeline.keys()))
+    report = match_report(title_index.match(library['Title'], library['Book Id']), title_index)
+    report['exact_merge_matched'] = int(shorten_title(library['Title']).isin(timeline.keys()).sum())
+    stats = [dict(report, dataset='bundled')]
+
+    for n_books in book_counts:
+        library = make_library_export(n_books, seed)
+        titles = list(make_timelines(library, seed).keys())
+        perturbed = perturb_titles(titles, seed)
+        start = time.perf_counter()
+        title_index = TitleIndex(perturbed)
+        build_sec = time.perf_counter() - start
+        start = time.perf_counter()
+        matches = title_index.match(library['Title'])
+        match_sec = time.perf_counter() - start
+        matched = matches['book_title'].dropna()
+        truth = dict(zip(perturbed, titles))
+        report = match_report(matches)
+        report.update({
+            'dataset': 'synthetic',
+            'exact_merge_matched': int(shorten_title(library['Title']).isin(set(perturbed)).sum()),
+            'precision': round(float((matched.map(truth) == shorten_title(library['Title'][matched.index])).mean()), 4),
+            'build_sec': round(build_sec, 3),
+            'match_sec': round(match_sec, 3),
+        })
+        stats.append(report)
+
+        ## review pages whose heading link gave the Book Id: joined by the book_id tier
+        library_book_ids = dict(zip(shorten_title(library['Title']), library['Book Id']))
+        has_book_id = np.random.default_rng(seed).random(len(titles)) < book_id_rate
+        title_index = TitleIndex(perturbed, [library_book_ids[t] if k else None for t, k in zip(titles, has_book_id)])
+        matches = title_index.match(library['Title'], library['Book Id'])
+        matched = matches['book_title'].dropna()
+        report = match_report(matches)
+        report.update({
+            'dataset': 'synthetic_book_ids',
+            'book_id_rate': book_id_rate,
+            'precision': round(float((matched.map(truth) == shorten_title(library['Title'][matched.index])).mean()), 4),
+        })
+        stats.append(report)
+    return stats
+
+
+def retokenized_top_terms(highlight_dict, book_ids, k=50):
+    """ Top terms of the given books by tokenizing their highlights again (what the index avoids)"""
+    book_ids = set(book_ids)
+    counts = Counter()
+    for url, texts in highlight_dict.items():
+        if highlight_book_id(url) in book_ids:
+            for text in texts:
+                counts.update(tokenize(text))
+    return counts.most_common(k)
+
+
+def mean_sec(run, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        run(i)
+    return round((time.perf_counter() - start) / repeat, 5)
+
+
+def benchmark_highlights(n_highlights=1000000, n_books=20000, n_new=10000, seed=0, baseline=True):
+    """ Highlight term index on `n_highlights` synthetic highlights over `n_books` books"""
+    rng = np.random.default_rng(seed)
+    book_ids = [str(b) for b in range(1, n_books + 1)]
+    highlight_dict = make_highlights(book_ids, n_highlights, seed)
+    genre_dict = make_genre_lists(book_ids, seed)
+    genres = sorted(set(g for gs in genre_dict.values() for g in gs))
+    stats = {'highlights': n_highlights, 'books': n_books, 'genres': len(genres)}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index_filepath = os.path.join(tmp_dir, 'highlights.sqlite')
+        highlight_index = HighlightIndex(index_filepath)
+        highlight_index.set_book_genres(genre_dict)
+        start = time.perf_counter()
+        highlight_index.add_highlight_dict(highlight_dict)
+        stats['build_sec'] = round(time.perf_counter() - start, 3)
+        stats['build_highlights_per_sec'] = round(n_highlights / stats['build_sec'])
+        stats['index_mb'] = round(os.path.getsize(index_filepath) / 2 ** 20, 1)
+
+        ## a new crawl: the known highlights are skipped, only the new ones are tokenized
+        new_highlights = make_highlights(book_ids, n_new, seed + 1)
+        start = time.perf_counter()
+        stats['incremental_new'] = highlight_index.add_highlight_dict(new_highlights)
+        stats['incremental_sec'] = round(time.perf_counter() - start, 3)
+        start = time.perf_counter()
+        stats['recrawl_new'] = highlight_index.add_highlight_dict(highlight_dict)
+        stats['recrawl_sec'] = round(time.perf_counter() - start, 3)
+
+        sample_books = rng.choice(book_ids, 100).tolist()
+        sample_genres = rng.choice(genres, 20).tolist()
+        stats['top_by_book_sec'] = mean_sec(lambda i: highlight_index.top_terms(50, book_id=sample_books[i]), 100)
+        stats['top_by_genre_sec'] = mean_sec(lambda i: highlight_index.top_terms(50, genre=sample_genres[i]), 20)
+        start = time.perf_counter()
+        term_matrix = highlight_index.term_matrix()
+        stats['term_matrix_sec'] = round(time.perf_counter() - start, 3)
+        stats['term_matrix_mb'] = round(term_matrix.nbytes / 2 ** 20, 1)
+        ## e.g. the books read in a year: a tenth of the library
+        subsets = [rng.choice(book_ids, n_books // 10, replace=False).tolist() for i in range(10)]
+        stats['top_by_books_sec'] = mean_sec(lambda i: term_matrix.top_terms(50, subsets[i]), 10)
+        highlight_index.close()
+
+    if baseline:
+        stats['retokenize_book_sec'] = mean_sec(lambda i: retokenized_top_terms(highlight_dict, [sample_books[i]]), 3)
+        stats['retokenize_books_sec'] = mean_sec(lambda i: retokenized_top_terms(highlight_dict, subsets[i]), 1)
+    return stats
+
+
+def synthetic_recommender_books(n_books, seed=0, first_book=0):
+    books = make_library_export(n_books, seed, first_book)
+    genre_table = make_genre_table(books['Book Id'].astype(str), seed)
+    books['clean_genre_list'] = genre_table['clean_genre_list'].to_numpy()
+    return books[['Book Id', 'Title', 'Author', 'Exclusive Shelf', 'My Rating', 'Average Rating', 'clean_genre_list']]
+
+
+def benchmark_recommender(n_books=100000, changed_rate=0.01, n_profiles=100, seed=0):
+    """ Genre vectors of `n_books` synthetic books: full build, incremental update after
+    `changed_rate` of the books changed (and as many were added), then ranking latency
+    """
+    books = synthetic_recommender_books(n_books, seed)
+    stats = {'books': n_books, 'to_read': int((books['Exclusive Shelf'] == 'to-read').sum())}
+
+    start = time.perf_counter()
+    vectors = GenreVectors.encode(books['Book Id'], books['clean_genre_list'])
+    stats['encode_sec'] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    recommender = Recommender(vectors, books)
+    stats['weighting_sec'] = round(time.perf_counter() - start, 3)
+    stats['genres'] = len(vectors.genres)
+    stats['vectors_mb'] = round(vectors.nbytes / 2 ** 20, 1)
+    stats['dense_matrix_mb'] = round(n_books * len(vectors.genres) * 4 / 2 ** 20, 1)
+
+    n_changed = int(n_books * changed_rate)
+    changed = books.copy()
+    changed.loc[:n_changed - 1, 'clean_genre_list'] = synthetic_recommender_books(n_changed, seed + 1)['clean_genre_list'].to_numpy()
+    changed = pd.concat([changed, synthetic_recommender_books(n_changed, seed + 1, first_book=n_books)], ignore_index=True)
+    start = time.perf_counter()
+    updated, stats['update_encoded'] = vectors.update(changed['Book Id'], changed['clean_genre_list'])
+    stats['update_sec'] = round(time.perf_counter() - start, 3)
+
+    profile = recommender.profile()
+    stats['rank_to_read_ms'] = round(mean_sec(lambda i: recommender.rank(profile, 20), 20) * 1000, 2)
+    stats['rank_all_ms'] = round(mean_sec(lambda i: recommender.rank(profile, 20, shelf=None), 20) * 1000, 2)
+    stats['recommend_ms'] = round(mean_sec(lambda i: recommender.recommend(20), 20) * 1000, 2)
+    ## "more like this" for many books at once: one blocked pass for all the profiles
+    read_rows = np.flatnonzero(books['Exclusive Shelf'].to_numpy() == 'read')[:n_profiles]
+    profiles = np.vstack([recommender.profile([r]) for r in read_rows])
+    start = time.perf_counter()
+    recommender.rank(profiles, 20, shelf=None)
+    stats['rank_all_per_profile_ms'] = round((time.perf_counter() - start) / n_profiles * 1000, 2)
+
+    ## without a stored index every query encodes the library again
+    stats['rebuild_and_rank_ms'] = round((stats['encode_sec'] + stats['weighting_sec']) * 1000 + stats['rank_to_read_ms'], 1)
+    return stats
+
+
+def synthetic_reading_books(n_books, seed=0):
+    """ SERIES_COLUMNS of a synthetic library: read books started 0-60 days before their
+    read date (unknown for a tenth of them)
+    """
+    rng = np.random.default_rng(seed)
+    library = make_library_export(n_books, seed)
+    date_read = pd.to_datetime(library['Date Read'], format=EXPORT_DATE_FORMAT)
+    start = date_read - pd.to_timedelta(rng.integers(0, 60, n_books), unit='D')
+    return pd.DataFrame({
+        'Book Id': library['Book Id'],
+        'genre_list_trf': list(make_genre_lists(library['Book Id'].astype(str), seed, n_genres=100).values()),
+        'date_read': date_read,
+        'start_reading_dt': start.where(rng.random(n_books) > 0.1),
+        'Number of Pages': library['Number of Pages'],
+    })
+
+
+def reading_days_frame(df):
+    """ Baseline: one row per (book, genre, reading day), pages spread over the days"""
+    books, start, finish, pages = reading_intervals(df)
+    n_days = (finish - start).astype(np.int64) + 1
+    days = pd.DataFrame({
+        'book': np.repeat(np.arange(len(books)), n_days),
+        'day': np.repeat(start, n_days) + (np.arange(n_days.sum()) - np.repeat(np.cumsum(n_days) - n_days, n_days)),
+        'pages': np.repeat(pages / n_days, n_days),
+    })
+    genres = books['genre_list_trf'].reset_index(drop=True).explode().dropna().rename('genre')
+    return days.merge(genres, left_on='book', right_index=True).reset_index(drop=True)
+
+
+def benchmark_timeseries(n_books=1000000, n_queries=50, seed=0, baseline=True):
+    """ Reading series of `n_books` synthetic books, then date-range queries by genre"""
+    rng = np.random.default_rng(seed)
+    df = synthetic_reading_books(n_books, seed)
+    stats = {'books': n_books, 'read_books': int(df['date_read'].notna().sum())}
+    start = time.perf_counter()
+    series = ReadingSeries.build(df)
+    stats['build_sec'] = round(time.perf_counter() - start, 3)
+    stats['genres'] = len(series.genres)
+    stats['days'] = len(series.days)
+    stats['series_mb'] = round(series.nbytes / 2 ** 20, 1)
+
+    ## random genre x date range filters, as picked in the dashboard
+    genres = rng.choice(series.genres[1:], n_queries).tolist()
+    firsts = rng.integers(0, len(series.days) - 365, n_queries)
+    ranges = [(series.days[f], series.days[f + rng.integers(30, 365)]) for f in firsts]
+    stats['monthly_query_ms'] = round(mean_sec(lambda i: series.series('pages', genres[i], 'M', *ranges[i]), n_queries) * 1000, 3)
+    stats['total_query_ms'] = round(mean_sec(lambda i: series.total('pages', genres[i], *ranges[i]), n_queries) * 1000, 3)
+    stats['rolling_query_ms'] = round(mean_sec(lambda i: series.rolling('pages', genres[i], 30, *ranges[i]), n_queries) * 1000, 3)
+
+    if baseline:
+        start = time.perf_counter()
+        days = reading_days_frame(df)
+        stats['baseline_expand_sec'] = round(time.perf_counter() - start, 3)
+        stats['baseline_rows'] = len(days)
+
+        def group_query(i):
+            in_range = (days['genre'] == genres[i]) & (days['day'] >= ranges[i][0]) & (days['day'] <= ranges[i][1])
+            selected = days[in_range]
+            return selected.groupby(selected['day'].dt.to_period('M'))['pages'].sum()
+        stats['baseline_monthly_query_ms'] = round(mean_sec(group_query, 5) * 1000, 1)
+        ## the monthly series holds whole months: the first and last ones of a range are partial in the baseline
+        check = group_query(0)
+        sliced = series.series('pages', genres[0], 'M', *ranges[0])
+        stats['baseline_equal'] = bool(np.allclose(check.to_numpy()[1:-1], sliced.to_numpy()[1:-1])
+                                       and np.isclose(check.sum(), series.total('pages', genres[0], *ranges[0])))
+    return stats
+
+
+def list_column_nbytes(genre_lists):
+    """ Memory of a column of genre lists: the lists and every distinct string object in them"""
+    strings = dict((id(g), sys.getsizeof(g)) for genres in genre_lists for g in genres)
+    return int(sum(sys.getsizeof(genres) for genres in genre_lists) + sum(strings.values()) + genre_lists.memory_usage(index=False))
+
+
+def benchmark_genres(n_books=1000000, n_queries=20, seed=0, baseline=True):
+    """ Genre matrix of `n_books` synthetic books: memory vs the list-of-strings column, and
+    has-genre / any / all / top-N / breakdown latency vs scans of the lists
+    """
+    rng = np.random.default_rng(seed)
+    book_ids = pd.Series(np.arange(n_books)).astype(str)
+    genre_lists = pd.Series(list(make_genre_lists(book_ids, seed).values()))
+    shelves = rng.choice(['read', 'currently-reading', 'to-read'], n_books, p=[0.5, 0.05, 0.45])
+    stats = {'books': n_books}
+
+    start = time.perf_counter()
+    matrix = GenreMatrix.from_lists(genre_lists)
+    stats['build_sec'] = round(time.perf_counter() - start, 3)
+    stats['genres'] = len(matrix.genres)
+    stats['matrix_mb'] = round(matrix.nbytes / 2 ** 20, 1)
+    stats['bitset_mb'] = round(n_books * -(-len(matrix.genres) // 8) / 2 ** 20, 1)
+    stats['lists_mb'] = round(list_column_nbytes(genre_lists) / 2 ** 20, 1)
+    ## "A, B" genre strings (genre_strings of the clean genre table) encoded in one pass, as in the consolidation
+    genre_str = genre_lists.map(', '.join)
+    start = time.perf_counter()
+    GenreMatrix.from_strings(genre_str)
+    stats['build_from_strings_sec'] = round(time.perf_counter() - start, 3)
+
+    genres = rng.choice(matrix.genres, (n_queries, 3)).tolist()
+    matrix.has_genre(genres[0][0])  # transposed matrix, built once
+    stats['has_genre_ms'] = round(mean_sec(lambda i: matrix.has_genre(genres[i][0]), n_queries) * 1000, 2)
+    stats['any_of_ms'] = round(mean_sec(lambda i: matrix.any_of(genres[i]), n_queries) * 1000, 2)
+    stats['all_of_ms'] = round(mean_sec(lambda i: matrix.all_of(genres[i][:2]), n_queries) * 1000, 2)
+    stats['fiction_flags_ms'] = round(mean_sec(lambda i: (matrix.has_genre('Fiction'), matrix.has_genre('Nonfiction')), 3) * 1000, 2)
+    read = shelves == 'read'
+    stats['top_genres_ms'] = round(mean_sec(lambda i: matrix.top_genres(10, read), 5) * 1000, 2)
+    stats['breakdown_ms'] = round(mean_sec(lambda i: matrix.breakdown(shelves), 3) * 1000, 2)
+
+    if baseline:
+        stats['baseline_has_genre_ms'] = round(mean_sec(lambda i: genre_lists.map(lambda l: genres[i][0] in l).to_numpy(), 3) * 1000, 2)
+        stats['baseline_any_of_ms'] = round(mean_sec(
+            lambda i: genre_lists.map(lambda l: not set(genres[i]).isdisjoint(l)).to_numpy(), 3) * 1000, 2)
+        stats['baseline_all_of_ms'] = round(mean_sec(
+            lambda i: genre_lists.map(lambda l: set(genres[i][:2]).issubset(l)).to_numpy(), 3) * 1000, 2)
+        stats['baseline_top_genres_ms'] = round(mean_sec(
+            lambda i: genre_lists[read].explode().value_counts().head(10), 1) * 1000, 2)
+        exploded = pd.DataFrame({'genre': genre_lists, 'shelf': shelves}).explode('genre')
+        stats['baseline_breakdown_ms'] = round(mean_sec(
+            lambda i: exploded.groupby(['genre', 'shelf']).size().unstack(fill_value=0), 1) * 1000, 2)
+        stats['baseline_equal'] = bool(
+            (genre_lists.map(lambda l: genres[0][0] in l).to_numpy() == matrix.has_genre(genres[0][0])).all()
+            and (genre_lists.map(lambda l: set(genres[0][:2]).issubset(l)).to_numpy() == matrix.all_of(genres[0][:2])).all()
+            and genre_lists[read].explode().value_counts().sort_index().equals(matrix.top_genres(len(matrix.genres), read).sort_index()))
+    return stats
+
+
+def time_figure(build):
+    """ (build seconds, serialize seconds, JSON payload in KB) of a figure builder"""
+    start = time.perf_counter()
+    fig = build()
+    build_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    payload = fig.to_json()
+    return round(build_sec, 3), round(time.perf_counter() - start, 3), round(len(payload) / 1024, 1)
+
+
+def benchmark_rating_chart(n_books=10000, baseline_books=200, page_size=50, seed=0):
+    """ Rating dumbbell chart on `n_books` rated books; the add_shape baseline is quadratic,
+    so it only runs on the first `baseline_books`
+    """
+    rng = np.random.default_rng(seed)
+    rating_df = pd.DataFrame({
+        'Title': ['Book {}'.format(i) for i in range(n_books)],
+        'My Rating': rng.integers(1, 6, n_books),
+        'Average Rating': np.round(rng.uniform(2.5, 4.8, n_books), 2),
+    })
+    stats = []
+    for label, n, build in [
+        ('dumbbell_all', n_books, lambda: plot_rating_dumbbell(rating_df)),
+        ('dumbbell_page', page_size, lambda: plot_rating_dumbbell(paginate(rating_df, page_size, 0)[0])),
+        ('dumbbell_baseline_size', baseline_books, lambda: plot_rating_dumbbell(rating_df.head(baseline_books))),
+        ('add_shape_baseline', baseline_books, lambda: plot_rating_shapes(rating_df.head(baseline_books))),
+    ]:
+        if n == 0:
+            continue
+        build_sec, serialize_sec, payload_kb = time_figure(build)
+        stats.append({'chart': label, 'books': n, 'build_sec': build_sec,
+                      'serialize_sec': serialize_sec, 'payload_kb': payload_kb})
+    return stats
+
+
+## runs a dashboard script outside of `streamlit run` (bare mode: the widgets keep their
+## default values), recording when the first chart / table is sent
+DASHBOARD_RUN = """
+import runpy, sys, time
+import streamlit as st
+started_at = float(sys.argv[2])
+marks = dict()
+def painted(draw):
+    def paint(*args, **kwargs):
+        marks.setdefault('first_paint_sec', time.time() - started_at)
+        return draw(*args, **kwargs)
+    return paint
+st.plotly_chart, st.dataframe = painted(st.plotly_chart), painted(st.dataframe)
+runpy.run_path(sys.argv[1], run_name='__main__')
+marks['script_sec'] = time.time() - started_at
+print(json.dumps(marks))
+"""
+
+
+def parse_importtime(stderr, top=8):
+    """ (total import seconds, [(module, seconds)] of the slowest top-level imports) of -X importtime"""
+    imports = []
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and not line.startswith('import time: self'):
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            if not name.startswith('  '):
+                imports.append((name.strip(), int(cumulative_us) / 1e6))
+    slowest = sorted(imports, key=lambda i: -i[1])[:top]
+    return sum(sec for name, sec in imports), [(name, round(sec, 3)) for name, sec in slowest]
+
+
+def run_dashboard(script, data_filepath, work_dir):
+    """ Timings of one cold process running the dashboard script on the data"""
+    with open(os.path.join(work_dir, 'parameters.json'), 'w') as file:
+        file.write(json.dumps({'consolidated_data_filepath': data_filepath,
+                               'user_data_dir': os.path.join(work_dir, 'users')}))
+    started_at = time.time()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import json\n' + DASHBOARD_RUN,
+                              os.path.abspath(script), str(started_at)],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+                             env=dict(os.environ, CONDA_PREFIX=work_dir, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))))
+    wall_sec = time.time() - started_at
+    marks = json.loads(process.stdout.strip().splitlines()[-1])
+    import_sec, slowest = parse_importtime(process.stderr)
+    return {'import_sec': round(import_sec, 3), 'first_paint_sec': round(marks.get('first_paint_sec', float('nan')), 3),
+            'script_sec': round(marks['script_sec'], 3), 'process_sec': round(wall_sec, 3), 'slowest_imports': slowest}
+
+
+def benchmark_dashboard_startup(script='goodreads_analytics.py', data_filepath='book_data_consolidated_fin.csv'):
+    """ Import time (-X importtime) and time-to-first-paint of the dashboard, in a new process:
+    cold (no stored cube / series / genre matrix next to the data yet) then warm (stored)
+    """
+    stats = {'script': script, 'data': data_filepath}
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_copy = os.path.join(work_dir, os.path.basename(data_filepath))
+        with open(data_filepath, 'rb') as src, open(data_copy, 'wb') as dst:
+            dst.write(src.read())
+        stats['cold'] = run_dashboard(script, data_copy, work_dir)
+        stats['warm'] = run_dashboard(script, data_copy, work_dir)
+    return stats
+
+
+### SUITE
+## Whole pipeline on synthetic datasets of growing size: consolidation, the dashboard loads,
+## the aggregates (built for a new data version, then read back) and the figures
+## Columns read by the dashboard sections (as in goodreads_analytics)
+DASHBOARD_COLUMNS = {
+    'overview': ['Book Id', 'Exclusive Shelf', 'is_fiction', 'is_nonfiction', 'date_read', 'start_reading_dt',
+                 'date_added', 'add_to_tbr_dt'],
+    'ratings': ['Book Id', 'Exclusive Shelf', 'is_fiction', 'is_nonfiction', 'date_read', 'year_read', 'genre_list_trf',
+                'Title', 'My Rating', 'Average Rating'],
+}
+
+
+def measure(run, profile_filepath=None, trace_memory=False, top_functions=5):
+    """ (result, stats) of run(): seconds, peak memory allocated while it runs (tracemalloc, slows
+    the run down) and cProfile stats (dumped to profile_filepath, with the top functions by own time)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if profile_filepath else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        result = run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sec = time.perf_counter() - start
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    stats = {'sec': round(sec, 4)}
+    if trace_memory:
+        stats['peak_mb'] = round(peak / 2 ** 20, 1)
+    if profiler is not None:
+        profiler.dump_stats(profile_filepath)
+        profile_stats = pstats.Stats(profiler)
+        functions = sorted(profile_stats.stats.items(), key=lambda f: -f[1][2])[:top_functions]
+        stats['profile'] = profile_filepath
+        stats['top_functions'] = [['{}:{}({})'.format(os.path.basename(f[0]), f[1], f[2]), round(v[2], 4)]
+                                  for f, v in functions]
+    return result, stats
+
+
+def remove_sidecars(data_filepath, pattern):
+    for filepath in glob.glob(data_filepath + pattern):
+        os.remove(filepath)
+
+
+def suite_steps(param):
+    """ [(step, setup, run)] of the pipeline on a synthetic dataset (write_dataset parameters),
+    in order. setup runs before each measured run (e.g. removing a stored aggregate), the runs
+    share their results through `state`.
+    """
+    data_filepath = param['consolidated_data_filepath']
+    state = dict()
+
+    def consolidate_files():
+        with open(param['timeline_filepath'], 'r') as file:
+            timeline = json.loads(file.read())
+        with open(param['timeline_book_id_filepath'], 'r') as file:
+            timeline_book_ids = json.loads(file.read())
+        df = consolidate(pd.read_csv(param['gr_library_export_filepath']), pd.read_csv(param['clean_genre_filepath']),
+                         timeline, timeline_book_ids)
+        write_consolidated(df, data_filepath)
+
+    def load_section(section, filters=None):
+        def load():
+            state[section] = read_consolidated(data_filepath, columns=DASHBOARD_COLUMNS[section], filters=filters,
+                                               parse_lists=True)
+        return load
+
+    def keep(key, load):
+        def run():
+            state[key] = load()
+        return run
+
+    def index_highlights():
+        with open(param['highlight_filepath'], 'r') as file:
+            highlight_dict = json.loads(file.read())
+        highlight_index = HighlightIndex(param['highlight_index_filepath'])
+        highlight_index.add_highlight_dict(highlight_dict)
+        state['term_matrix'] = highlight_index.term_matrix()
+        highlight_index.close()
+
+    def rating_page():
+        rating_df = state['ratings']
+        rating_df = rating_df[rating_df['date_read'].notna() | (rating_df['Exclusive Shelf'] == 'read')]
+        return plot_rating_dumbbell(paginate(filter_ratings(rating_df, 'Fiction'), 50, 0)[0]).to_json()
+
+    series = lambda: state['series']
+    no_setup = lambda: None
+    return [
+        ('consolidate', no_setup, consolidate_files),
+        ('load_data:overview', no_setup, load_section('overview')),
+        ('load_data:ratings', no_setup, load_section('ratings', [('My Rating', '!=', 0)])),
+        ('cube:build', lambda: remove_sidecars(data_filepath, '.cube-*'), keep('cube', lambda: load_cube(data_filepath))),
+        ('cube:stored', no_setup, keep('cube', lambda: load_cube(data_filepath))),
+        ('series:build', lambda: remove_sidecars(data_filepath, '.series-*'), keep('series', lambda: load_series(data_filepath))),
+        ('series:stored', no_setup, keep('series', lambda: load_series(data_filepath))),
+        ('genres:build', lambda: remove_sidecars(data_filepath, '.genres-*'),
+         keep('genres', lambda: load_genre_matrix(data_filepath, 'genre_list_trf'))),
+        ('genres:stored', no_setup, keep('genres', lambda: load_genre_matrix(data_filepath, 'genre_list_trf'))),
+        ('genres:shelf_breakdown', no_setup, lambda: state['genres'].breakdown(state['overview']['Exclusive Shelf'].to_numpy())),
+        ('recommender:build', lambda: remove_sidecars(data_filepath, '.recommender.npz'),
+         keep('recommender', lambda: load_recommender(data_filepath))),
+        ('recommender:stored', no_setup, keep('recommender', lambda: load_recommender(data_filepath))),
+        ('recommender:recommend', no_setup, lambda: state['recommender'].recommend(20)),
+        ('highlights:index', lambda: remove_sidecars(param['highlight_index_filepath'], ''), index_highlights),
+        ('figure:rating_page', no_setup, rating_page),
+        ('figure:reading_months', no_setup, lambda: plot_reading_periods(series().series('books', ALL_GENRES, 'M'),
+                                                                         series().series('pages', ALL_GENRES, 'M'),
+                                                                         period_format='%b %Y').to_json()),
+        ('figure:reading_velocity', no_setup, lambda: plot_reading_velocity(series().series('pages', ALL_GENRES, 'D'),
+                                                                            series().rolling('pages', ALL_GENRES, 30), 30).to_json()),
+        ('figure:word_cloud', no_setup, lambda: plot_word_cloud(state['term_matrix'].top_terms(80)).to_json()),
+    ]
+
+
+def run_metadata():
+    """ What a run of the suite is compared on: code version and library versions"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'run_id': '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), os.getpid()), 'commit': commit, 'python': sys.version.split()[0],
+            'pandas': pd.__version__, 'numpy': np.__version__}
+
+
+def benchmark_suite(book_counts=(1000, 10000, 100000), repeat=1, profile_dir=None, trace_memory=False,
+                    output_filepath=None, timeline_books=100000, highlight_books=10000, seed=0):
+    """ Runs the pipeline steps (suite_steps) on a synthetic dataset of each size, `repeat` times
+
+    One result per size and step: best and mean seconds, peak traced memory with trace_memory,
+    cProfile stats of the first run in profile_dir. The results are appended to output_filepath
+    (JSON lines, one per step, with the run metadata) to be compared between runs.
+    """
+    metadata = dict(run_metadata(), repeat=repeat, trace_memory=trace_memory, profiled=bool(profile_dir))
+    results = []
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    for n_books in book_counts:
+        with tempfile.TemporaryDirectory() as data_dir:
+            param, stats = measure(lambda: write_dataset(data_dir, n_books, seed, timeline_books=timeline_books,
+                                                         highlight_books=highlight_books))
+            results.append(dict(metadata, books=n_books, step='generate', **stats))
+            for step, setup, run in suite_steps(param):
+                runs = []
+                for i in range(repeat):
+                    setup()
+                    profile_filepath = os.path.join(profile_dir, '{}-{}-{}.prof'.format(
+                        metadata['run_id'], n_books, step.replace(':', '-'))) if profile_dir and i == 0 else None
+                    runs.append(measure(run, profile_filepath, trace_memory)[1])
+                stats = dict(runs[0], sec=min(r['sec'] for r in runs),
+                             mean_sec=round(sum(r['sec'] for r in runs) / repeat, 4))
+                results.append(dict(metadata, books=n_books, step=step, **stats))
+                print(json.dumps(results[-1]), file=sys.stderr)
+    if output_filepath:
+        with open(output_filepath, 'a') as file:
+            file.write(''.join(json.dumps(r) + '\n' for r in results))
+    return {'run_id': metadata['run_id'], 'commit': metadata['commit'],
+            'steps': dict(('{}:{}'.format(r['books'], r['step']), r['sec']) for r in results)}
+
+
+def read_suite_run(filepath, run_id=None, before=None):
+    """ (run id, {(books, step): result}) of a run of a results file: `run_id`, else the run
+    before the run `before`, else the last one
+    """
+    with open(filepath, 'r') as file:
+        results = [json.loads(line) for line in file if line.strip()]
+    run_ids = list(dict.fromkeys(r['run_id'] for r in results))
+    if run_id is None:
+        if before is not None and run_ids.index(before) == 0:
+            raise ValueError('no run before {} in {}'.format(before, filepath))
+        run_id = run_ids[-1] if before is None else run_ids[run_ids.index(before) - 1]
+    return run_id, dict(((r['books'], r['step']), r) for r in results if r['run_id'] == run_id)
+
+
+def compare_suite_runs(base_filepath, new_filepath, threshold=1.25, min_sec=0.01, base_run=None, new_run=None):
+    """ Step by step ratio of the new run to the base run; regressions: slower by more than
+    `threshold` (and above `min_sec`, to ignore the noise of the fastest steps)
+    """
+    new_run, new = read_suite_run(new_filepath, new_run)
+    ## same file: the new run against the run before it
+    base_run, base = read_suite_run(base_filepath, base_run, new_run if base_filepath == new_filepath else None)
+    steps = []
+    for key in sorted(set(base) & set(new)):
+        base_sec, new_sec = base[key]['sec'], new[key]['sec']
+        steps.append({'books': key[0], 'step': key[1], 'base_sec': base_sec, 'new_sec': new_sec,
+                      'ratio': round(new_sec / base_sec, 2) if base_sec else None})
+    regressions = [s for s in steps if s['ratio'] is not None and s['ratio'] > threshold and s['new_sec'] >= min_sec]
+    ## profiled / traced runs are slower, their timings only compare with runs of the same mode
+    modes = [dict((m, next(iter(run.values())).get(m, False)) for m in ('trace_memory', 'profiled')) if run else {}
+             for run in (base, new)]
+    return {'base_run': base_run, 'new_run': new_run, 'same_mode': modes[0] == modes[1], 'steps': steps,
+            'regressions': regressions}
+
+
+def benchmark_telemetry(n_events=100000, n_pages=200, concurrency=4, padding_kb=150,
+                        genre_filepath='books_genre_20220507.txt'):
+    """ Microseconds per span / counter / progress update, and fixture crawl pages per second"""
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for mode, log_filepath in [('memory', None), ('jsonl', os.path.join(work_dir, 'telemetry.jsonl'))]:
+            telemetry = Telemetry(log_filepath)
+            progress = telemetry.track('benchmark', total=n_events)
+
+            def per_call_us(run):
+                start = time.perf_counter()
+                for i in range(n_events):
+                    run()
+                return round((time.perf_counter() - start) / n_events * 1e6, 3)
+
+            def run_span():
+                with telemetry.span('parse', source='benchmark'):
+                    pass
+
+            results[mode] = {
+                'span_us': per_call_us(run_span),
+                'count_us': per_call_us(lambda: telemetry.count('pages', source='benchmark', status='ok')),
+                'progress_us': per_call_us(progress.advance),
+            }
+
+        with open(genre_filepath, 'r') as file:
+            genre_dict = dict(list(json.loads(file.read()).items())[:n_pages])
+        fixture_dir = os.path.join(work_dir, 'fixtures')
+        write_book_fixtures(genre_dict, fixture_dir, padding_kb)
+        server, base_url = serve_directory(fixture_dir)
+        urls = ['{}/book/show/{}.html'.format(base_url, b) for b in genre_dict]
+        for mode, log_filepath in [('crawl_no_log', None), ('crawl_jsonl', os.path.join(work_dir, 'crawl.jsonl'))]:
+            TELEMETRY.configure(log_filepath)
+            fetcher = Fetcher(http_page_loader(make_http_session(pool_size=concurrency)), workers=concurrency,
+                              max_per_host=concurrency, rate=1e6, burst=concurrency, retries=0, name='benchmark')
+            start = time.perf_counter()
+            pages, failures = fetcher.fetch_all(urls, parse_book_genres)
+            results[mode] = {'pages': len(pages), 'pages_per_sec': round(len(pages) / (time.perf_counter() - start), 2)}
+        TELEMETRY.configure(None)
+        server.shutdown()
+    return results
+
+
+def benchmark_multi_user(large_books=200000, small_books=1000, n_small=4, workers=2, seed=0):
+    """ Uploads one large and `n_small` small synthetic libraries, returns time-to-ready per user"""
+    stats = []
+    with tempfile.TemporaryDirectory() as root_dir:
+        user_store = UserStore(root_dir, workers=workers)
+        uploads = [('large', large_books)] + [('small-{}'.format(i), small_books) for i in range(n_small)]
+        exports = {u: make_library_export(n, seed + i).to_csv(index=False).encode('utf-8')
+                   for i, (u, n) in enumerate(uploads)}
+        submitted_at = dict()
+        for user_id, n in uploads:
+            submitted_at[user_id] = time.time()
+            user_store.submit_upload(user_id, exports[user_id])
+        user_store.wait()
+        for user_id, n in uploads:
+            status = user_store.status(user_id)
+            stats.append({'user': user_id, 'books': n, 'status': status['status'],
+                          'time_to_ready_sec': round(status.get('finished_at', time.time()) - submitted_at[user_id], 3)})
+        user_store.shutdown()
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Goodreads Analytics benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = subparsers.add_parser('backends', help='http vs selenium scraping backends')
+    p.add_argument('--genre-file', default='books_genre_20220506.txt')
+    p.add_argument('--backend', action='append', choices=['http', 'selenium'])
+    p.add_argument('--concurrency', type=int, default=4)
+    p.add_argument('--chromedriver')
+    p.add_argument('--padding-kb', type=int, default=150)
+
+    p = subparsers.add_parser('consolidation', help='vectorized vs row-wise consolidation')
+    p.add_argument('--books', type=int, default=100000)
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--no-baseline', action='store_true')
+
+    subparsers.add_parser('consolidation-check', help='equivalence with book_data_consolidated_fin.csv')
+
+    p = subparsers.add_parser('ingest', help='streaming vs in-memory consolidation of a big export')
+    p.add_argument('--books', type=int, action='append')
+    p.add_argument('--mode', action='append', choices=['stream', 'memory'])
+    p.add_argument('--chunk-rows', type=int, default=100000)
+
+    p = subparsers.add_parser('timeline', help='timeline event parser vs row-wise substring scans')
+    p.add_argument('--events', type=int, default=1000000)
+    p.add_argument('--no-baseline', action='store_true')
+
+    p = subparsers.add_parser('title-matching', help='timeline title index match rate and scaling')
+    p.add_argument('--books', type=int, action='append')
+
+    p = subparsers.add_parser('multi-user', help='uploaded libraries consolidated by the worker pool')
+    p.add_argument('--large-books', type=int, default=200000)
+    p.add_argument('--small-books', type=int, default=1000)
+    p.add_argument('--small-users', type=int, default=4)
+    p.add_argument('--workers', type=int, default=2)
+
+    p = subparsers.add_parser('highlights', help='highlight term index vs re-tokenizing the highlights')
+    p.add_argument('--highlights', type=int, default=1000000)
+    p.add_argument('--books', type=int, default=20000)
+    p.add_argument('--new-highlights', type=int, default=10000)
+    p.add_argument('--no-baseline', action='store_true')
+
+    p = subparsers.add_parser('recommender', help='genre vector recommender build, update and ranking latency')
+    p.add_argument('--books', type=int, default=100000)
+    p.add_argument('--changed-rate', type=float, default=0.01)
+    p.add_argument('--profiles', type=int, default=100)
+
+    p = subparsers.add_parser('timeseries', help='reading velocity series vs grouping the reading days')
+    p.add_argument('--books', type=int, default=1000000)
+    p.add_argument('--queries', type=int, default=50)
+    p.add_argument('--no-baseline', action='store_true')
+
+    p = subparsers.add_parser('genres', help='genre matrix memory and filter latency vs lists of genre strings')
+    p.add_argument('--books', type=int, default=1000000)
+    p.add_argument('--queries', type=int, default=20)
+    p.add_argument('--no-baseline', action='store_true')
+
+    p = subparsers.add_parser('rating-chart', help='rating dumbbell chart payload and build time')
+    p.add_argument('--books', type=int, default=10000)
+    p.add_argument('--baseline-books', type=int, default=200)
+    p.add_argument('--page-size', type=int, default=50)
+
+    p = subparsers.add_parser('dashboard-startup', help='dashboard import time and time-to-first-paint')
+    p.add_argument('--script', default='goodreads_analytics.py')
+    p.add_argument('--data', default='book_data_consolidated_fin.csv')
+
+    p = subparsers.add_parser('telemetry', help='telemetry overhead: spans, counters, progress and a fixture crawl')
+    p.add_argument('--events', type=int, default=100000)
+    p.add_argument('--pages', type=int, default=200)
+    p.add_argument('--concurrency', type=int, default=4)
+
+    p = subparsers.add_parser('suite', help='pipeline steps on synthetic datasets of growing size, results as JSON lines')
+    p.add_argument('--books', type=int, nargs='+', default=[1000, 10000, 100000])
+    p.add_argument('--repeat', type=int, default=1)
+    p.add_argument('--output', help='JSON lines file the results are appended to')
+    p.add_argument('--profile-dir', help='directory of the cProfile stats of each step')
+    p.add_argument('--tracemalloc', action='store_true', help='peak memory of each step (slower runs)')
+    p.add_argument('--timeline-books', type=int, default=100000)
+    p.add_argument('--highlight-books', type=int, default=10000)
+
+    p = subparsers.add_parser('compare', help='regressions between two suite runs')
+    p.add_argument('base')
+    p.add_argument('new', nargs='?', help='results file of the new run (default: the base file)')
+    p.add_argument('--base-run')
+    p.add_argument('--new-run')
+    p.add_argument('--threshold', type=float, default=1.25)
+    p.add_argument('--min-sec', type=float, default=0.01)
+
+    p = subparsers.add_parser('backend-run', help=argparse.SUPPRESS)
+    p.add_argument('--backend', required=True)
+    p.add_argument('--fixtures', required=True)
+    p.add_argument('--concurrency', type=int, default=4)
+    p.add_argument('--chromedriver')
+
+    p = subparsers.add_parser('ingest-run', help=argparse.SUPPRESS)
+    p.add_argument('--mode', required=True)
+    p.add_argument('--data-dir', required=True)
+    p.add_argument('--chunk-rows', type=int, default=100000)
+
+    args = parser.parse_args()
+    if args.benchmark == 'backends':
+        result = benchmark_backends(args.genre_file, args.backend or ('http', 'selenium'),
+                                    args.concurrency, args.chromedriver, args.padding_kb)
+    elif args.benchmark == 'consolidation':
+        result = benchmark_consolidation(args.books, args.seed, not args.no_baseline)
+    elif args.benchmark == 'consolidation-check':
+        result = check_consolidation()
+    elif args.benchmark == 'ingest':
+        result = benchmark_ingest(args.books or (1000000, 3000000), args.mode or ('stream', 'memory'), args.chunk_rows)
+    elif args.benchmark == 'ingest-run':
+        result = run_ingest(args.mode, args.data_dir, args.chunk_rows)
+    elif args.benchmark == 'timeline':
+        result = benchmark_timeline(args.events, baseline=not args.no_baseline)
+    elif args.benchmark == 'title-matching':
+        result = benchmark_title_matching(args.books or (10000, 100000))
+    elif args.benchmark == 'multi-user':
+        result = benchmark_multi_user(args.large_books, args.small_books, args.small_users, args.workers)
+    elif args.benchmark == 'highlights':
+        result = benchmark_highlights(args.highlights, args.books, args.new_highlights, baseline=not args.no_baseline)
+    elif args.benchmark == 'recommender':
+        result = benchmark_recommender(args.books, args.changed_rate, args.profiles)
+    elif args.benchmark == 'timeseries':
+        result = benchmark_timeseries(args.books, args.queries, baseline=not args.no_baseline)
+    elif args.benchmark == 'genres':
+        result = benchmark_genres(args.books, args.queries, baseline=not args.no_baseline)
+    elif args.benchmark == 'rating-chart':
+        result = benchmark_rating_chart(args.books, args.baseline_books, args.page_size)
+    elif args.benchmark == 'dashboard-startup':
+        result = benchmark_dashboard_startup(args.script, args.data)
+    elif args.benchmark == 'telemetry':
+        result = benchmark_telemetry(args.events, args.pages, args.concurrency)
+    elif args.benchmark == 'suite':
+        result = benchmark_suite(args.books, args.repeat, args.profile_dir, args.tracemalloc, args.output,
+                                 args.timeline_books, args.highlight_books)
+    elif args.benchmark == 'compare':
+        result = compare_suite_runs(args.base, args.new or args.base, args.threshold, args.min_sec, args.base_run, args.new_run)
+    elif args.benchmark == 'backend-run':
+        result = run_backend(args.backend, args.fixtures, args.concurrency, args.chromedriver)
+    print(json.dumps(result))
+    if args.benchmark == 'compare' and result['regressions']:
+        sys.exit(1)
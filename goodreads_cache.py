@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Page Cache
+
+Persistent on-disk cache of crawled book pages, keyed by Goodreads Book Id (SQLite).
+
+For each book it stores the raw page (zlib compressed), the parsed genres from the
+`elementList` section and the fetch timestamp. A crawl only needs to fetch the books
+that are new or older than the TTL, and since every page is written as soon as it is
+parsed, an interrupted crawl picks up where it stopped.
+
+Existing genre dumps (books_genre_*.txt) can be imported with:
+    python goodreads_cache.py [CACHE FILE] [GENRE TXT FILE] [GENRE TXT FILE] ...
+"""
+
+import json
+import sqlite3
+import sys
+import time
+import zlib
+
+QUERY_BATCH_SIZE = 900
+
+
+class PageCache:
+    """ Book page + genre cache, entries older than `ttl_days` are considered stale"""
+
+    def __init__(self, filepath, ttl_days=30):
+        self.filepath = filepath
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.conn = sqlite3.connect(filepath)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS book_pages (
+                book_id TEXT PRIMARY KEY,
+                url TEXT,
+                page_source BLOB,
+                genres TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def put(self, book_id, url, page_source, genres, fetched_at=None):
+        self.put_many([(book_id, url, page_source, genres)], fetched_at)
+
+    def put_many(self, entries, fetched_at=None):
+        """ Stores (book_id, url, page_source, genres) entries in one transaction"""
+        if fetched_at is None:
+            fetched_at = time.time()
+        rows = []
+        for book_id, url, page_source, genres in entries:
+            if page_source is not None:
+                page_source = zlib.compress(page_source.encode('utf-8'))
+            rows.append((str(book_id), url, page_source, json.dumps(genres), fetched_at))
+        self.conn.executemany("INSERT OR REPLACE INTO book_pages VALUES (?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+
+    def get_page(self, book_id):
+        row = self.conn.execute(
+            "SELECT page_source FROM book_pages WHERE book_id = ?", (str(book_id),)
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def stale_ids(self, book_ids):
+        """ Returns the book ids (as str) which are not cached yet or older than the TTL"""
+        min_fetched_at = time.time() - self.ttl_seconds
+        fresh = {r[0] for r in self.conn.execute(
+            "SELECT book_id FROM book_pages WHERE fetched_at >= ?", (min_fetched_at,)
+        )}
+        return [str(b) for b in book_ids if str(b) not in fresh]
+
+    def genre_dict(self, book_ids=None):
+        """ Returns {book_id: genres} for the given book ids (all cached books if None)"""
+        if book_ids is None:
+            rows = self.conn.execute("SELECT book_id, genres FROM book_pages")
+            return {r[0]: json.loads(r[1]) for r in rows}
+        # primary key lookups, batched below the SQLite host parameter limit
+        book_ids = [str(b) for b in book_ids]
+        genres = dict()
+        for i in range(0, len(book_ids), QUERY_BATCH_SIZE):
+            batch = book_ids[i:i + QUERY_BATCH_SIZE]
+            rows = self.conn.execute(
+                "SELECT book_id, genres FROM book_pages WHERE book_id IN ({})".format(','.join('?' * len(batch))), batch
+            )
+            genres.update((r[0], json.loads(r[1])) for r in rows)
+        return {b: genres[b] for b in book_ids if b in genres}
+
+    def import_genre_dict(self, genre_dict, fetched_at=None):
+        """ Loads a {book_id: genres} dump (the old books_genre_*.txt format)"""
+        self.put_many([(b, None, None, g) for b, g in genre_dict.items()], fetched_at)
+
+
+if __name__ == '__main__':
+    page_cache = PageCache(sys.argv[1])
+    for filepath in sys.argv[2:]:
+        with open(filepath, 'r') as file:
+            page_cache.import_genre_dict(json.loads(file.read()))
+    print(len(page_cache.genre_dict()))
+    page_cache.close()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Charts
+
+Figure builders for the dashboard which have to scale with the number of books.
+
+The rating dumbbell chart (my rating vs average rating per book) draws every connector
+in a single Scattergl trace, with NaN-separated segments, instead of one layout shape
+per book: the figure JSON grows linearly and stays small, and WebGL keeps the browser
+responsive with thousands of points.
+
+The word cloud of the highlights is a text-only Scatter, laid out on a spiral in Python:
+no extra dependency and the figure only holds the top terms.
+
+The reading velocity charts take the series already sliced from the time-series arrays
+(goodreads_timeseries): one point per period, whatever the number of books.
+"""
+
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from goodreads_genres import GenreMatrix
+
+CONNECTOR_COLOR = '#cccccc'
+
+
+def dumbbell_segments(x0, x1, y):
+    """ x / y arrays of the connectors: x0 -> x1 for every y, separated by NaN (= gap)"""
+    n = len(y)
+    xs = np.full(3 * n, np.nan)
+    xs[0::3] = x0
+    xs[1::3] = x1
+    ys = np.empty(3 * n, dtype=object)
+    ys[0::3] = y
+    ys[1::3] = y
+    ys[2::3] = None
+    return xs, ys
+
+
+def plot_rating_dumbbell(rating_df, title_col='Title', height_per_book=22):
+    """ My Rating vs Average Rating, one row per book, in the order of rating_df"""
+    titles = rating_df[title_col].to_numpy()
+    my_rating = rating_df['My Rating'].to_numpy(dtype=float)
+    avg_rating = rating_df['Average Rating'].to_numpy(dtype=float)
+    xs, ys = dumbbell_segments(my_rating, avg_rating, titles)
+
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', line=dict(color=CONNECTOR_COLOR),
+                               hoverinfo='skip', showlegend=False))
+    fig.add_trace(go.Scattergl(x=avg_rating, y=titles, mode='markers', name='Average Rating'))
+    fig.add_trace(go.Scattergl(x=my_rating, y=titles, mode='markers', name='My Rating'))
+    fig.update_layout(legend_title_text='Rating', height=max(300, height_per_book * len(titles) + 100))
+    # keep the rows in the order of rating_df, first book on top
+    fig.update_yaxes(showgrid=False, categoryorder='array', categoryarray=titles[::-1])
+    fig.update_xaxes(showgrid=True, gridwidth=0.3, title_text='value')
+    return fig
+
+
+def filter_ratings(rating_df, genre=None, year=None):
+    """ Books having `genre` in genre_list_trf and / or read in `year`"""
+    mask = np.ones(len(rating_df), dtype=bool)
+    if genre is not None:
+        mask &= GenreMatrix.from_lists(rating_df['genre_list_trf']).has_genre(genre)
+    if year is not None:
+        mask &= (rating_df['year_read'] == year).to_numpy()
+    return rating_df[mask]
+
+
+def paginate(df, page_size, page):
+    """ Rows of page `page` (0-based) and the number of pages"""
+    n_pages = max(1, -(-len(df) // page_size))
+    page = min(max(page, 0), n_pages - 1)
+    return df.iloc[page * page_size:(page + 1) * page_size], n_pages
+
+
+def word_cloud_layout(words, sizes, width=900, height=450, char_width=0.58):
+    """ Greedy word cloud placement: each word (biggest first) goes to the first point of an
+    Archimedean spiral from the center where its box does not overlap the placed ones
+
+    Returns the x / y (center) of each word, NaN when it does not fit.
+    """
+    theta = np.arange(0, 120, 0.08)
+    spiral_x, spiral_y = theta * np.cos(theta) * width / 240, theta * np.sin(theta) * height / 240
+    xs, ys = np.full(len(words), np.nan), np.full(len(words), np.nan)
+    boxes = np.zeros((0, 4))
+    for i, (word, size) in enumerate(zip(words, sizes)):
+        half_w, half_h = len(word) * size * char_width / 2, size / 2
+        fits = (np.abs(spiral_x) + half_w <= width / 2) & (np.abs(spiral_y) + half_h <= height / 2)
+        x, y = spiral_x[fits], spiral_y[fits]
+        # spiral points x placed boxes, a point is free when its box overlaps none of them
+        overlaps = ((x[:, None] - half_w < boxes[:, 2]) & (x[:, None] + half_w > boxes[:, 0])
+                    & (y[:, None] - half_h < boxes[:, 3]) & (y[:, None] + half_h > boxes[:, 1])).any(axis=1)
+        free = np.flatnonzero(~overlaps)
+        if len(free):
+            xs[i], ys[i] = x[free[0]], y[free[0]]
+            boxes = np.vstack([boxes, [xs[i] - half_w, ys[i] - half_h, xs[i] + half_w, ys[i] + half_h]])
+    return xs, ys
+
+
+def plot_word_cloud(terms_df, min_font=11, max_font=48, width=900, height=450):
+    """ Word cloud of a (term, count) frame, most frequent terms biggest"""
+    counts = terms_df['count'].to_numpy(dtype=float)
+    scale = np.sqrt(counts / counts.max()) if len(counts) else counts
+    sizes = min_font + (max_font - min_font) * scale
+    xs, ys = word_cloud_layout(terms_df['term'].tolist(), sizes, width, height)
+    colors = px.colors.qualitative.Bold
+
+    fig = go.Figure(go.Scatter(
+        x=xs, y=ys, mode='text', text=terms_df['term'],
+        textfont=dict(size=sizes, color=[colors[i % len(colors)] for i in range(len(sizes))]),
+        hovertext=['{}: {}'.format(t, c) for t, c in zip(terms_df['term'], terms_df['count'])],
+        hoverinfo='text',
+    ))
+    fig.update_xaxes(visible=False, range=[-width / 2, width / 2])
+    fig.update_yaxes(visible=False, range=[-height / 2, height / 2])
+    fig.update_layout(width=width, height=height, margin=dict(l=0, r=0, t=0, b=0),
+                      plot_bgcolor='rgba(0,0,0,0)')
+    return fig
+
+
+def plot_reading_periods(books, pages, period_format='%Y'):
+    """ Books (bars) and pages (line, right axis) read per period, from two aligned series"""
+    labels = books.index.strftime(period_format)
+    fig = make_subplots(specs=[[{'secondary_y': True}]])
+    fig.add_trace(go.Bar(x=labels, y=books.to_numpy(), name='Books', marker_color=px.colors.qualitative.Pastel[2]),
+                  secondary_y=False)
+    fig.add_trace(go.Scatter(x=labels, y=pages.round().to_numpy(), name='Pages', mode='lines+markers'),
+                  secondary_y=True)
+    fig.update_yaxes(title_text='books', secondary_y=False)
+    fig.update_yaxes(title_text='pages', showgrid=False, secondary_y=True)
+    fig.update_xaxes(type='category')
+    fig.update_layout(margin=dict(l=3, r=3, t=23, b=3), height=350, legend=dict(orientation='h', y=1.1))
+    return fig
+
+
+def plot_reading_velocity(daily_pages, rolling_pages, window_days):
+    """ Pages read per day and their trailing `window_days` average"""
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(x=daily_pages.index, y=daily_pages.to_numpy(), name='Pages per day',
+                               mode='lines', line=dict(color=CONNECTOR_COLOR)))
+    fig.add_trace(go.Scattergl(x=rolling_pages.index, y=(rolling_pages / window_days).to_numpy(),
+                               name='{}-day average'.format(window_days), mode='lines'))
+    fig.update_layout(margin=dict(l=3, r=3, t=23, b=3), height=350, legend=dict(orientation='h', y=1.1),
+                      yaxis_title='pages per day')
+    return fig
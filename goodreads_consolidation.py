@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Consolidation
+
+Consolidates the Goodreads library export, the crawled genres and the reading timelines
+into the dataset used by the dashboard.
+
+Every step runs as a vectorized pass over the whole table (pandas string accessors,
+explode / str.extract, genre indicator matrix) instead of a row-wise DataFrame.apply.
+Each step is a 'consolidate' span of goodreads_telemetry (label step).
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from goodreads_genres import GenreMatrix
+from goodreads_matching import TitleIndex
+from goodreads_telemetry import span
+
+# "[date –] event [(edition)]", the date is missing on some events and can be partial (e.g. '2021')
+TIMELINE_EVENT_PATTERNS = [
+    ('shelved_as', r'Shelved as:\s*(?P<shelf>[^(]+?)'),
+    ('started_reading', r'Started Reading'),
+    ('finished_reading', r'Finished Reading'),
+    ('shelved', r'Shelved'),
+]
+TIMELINE_EVENT_TYPES = [t for t, p in TIMELINE_EVENT_PATTERNS]
+TIMELINE_PATTERN = re.compile(r'^\s*(?:(?P<date>[^–]*?)\s*–\s*)?(?:{})\s*(?:\((?P<edition>[^)]*)\))?\s*$'.format(
+    '|'.join('(?P<{}>{})'.format(t, p) for t, p in TIMELINE_EVENT_PATTERNS)))
+EXPORT_DATE_FORMAT = '%Y/%m/%d'
+TIMELINE_DATE_FORMAT = '%B %d, %Y'
+CATEGORY_GENRES = {
+    'is_nonfiction': 'Nonfiction',
+    'is_fiction': 'Fiction',
+}
+
+
+def parse_dates(values, date_format):
+    """ pd.to_datetime with a known format, values in any other format are inferred"""
+    dt = pd.to_datetime(values, format=date_format, errors='coerce')
+    leftover = dt.isna() & values.notna() & (values != '')
+    if leftover.any():
+        dt[leftover] = pd.to_datetime(values[leftover], infer_datetime_format=True)
+    return dt
+
+
+def shorten_title(titles):
+    """ Drops the series part, e.g. 'Dune (Dune, #1)' -> 'Dune'"""
+    return titles.str.split(" (", n=1, regex=False).str[0].str.strip().where(
+        titles.str.endswith(")"), titles.str.strip())
+
+
+def timeline_events(timeline):
+    """ {book_title: [timeline text]} -> long event table, one row per timeline event
+
+    Columns: book (position of the book in `timeline`), book_title, position (in the timeline), event_type (one of TIMELINE_EVENT_TYPES or
+    'other'), shelf (of 'shelved_as' events), edition, date_text, date and read_number (1, 2, ...
+    for the reading events, a 'finished_reading' without a start opens a read too; 0 for the
+    shelf events). Every timeline text goes through TIMELINE_PATTERN once.
+    """
+    book_titles = pd.Series(list(timeline.keys()), dtype=object)
+    texts = pd.Series(list(timeline.values()), index=book_titles.index, dtype=object).explode().dropna().astype(str)
+    # the same texts come back over and over (one per day and event type): parse each distinct text once
+    codes, distinct = pd.factorize(texts)
+    parsed = pd.Series(distinct, dtype=object).str.extract(TIMELINE_PATTERN)
+    parsed['date_text'] = parsed['date'].str.strip().replace('', np.nan)
+    parsed['date'] = parse_dates(parsed['date_text'], TIMELINE_DATE_FORMAT)
+    parsed['event_type'] = np.select([parsed[t].notna() for t in TIMELINE_EVENT_TYPES], TIMELINE_EVENT_TYPES, 'other')
+    parsed['shelf'] = parsed['shelf'].str.strip()
+
+    events = parsed[['event_type', 'shelf', 'edition', 'date_text', 'date']].take(codes).set_axis(texts.index)
+    events.insert(0, 'book', texts.index.to_numpy())
+    events.insert(1, 'book_title', book_titles.reindex(texts.index).to_numpy())
+    events.insert(2, 'position', texts.groupby(level=0).cumcount().to_numpy())
+
+    # reads: a start opens a read, a finish closes it (or opens and closes one if not started)
+    is_start = events['event_type'] == 'started_reading'
+    is_finish = events['event_type'] == 'finished_reading'
+    reading = events[is_start | is_finish]
+    previous = reading['event_type'].groupby(level=0).shift()
+    new_read = (reading['event_type'] == 'started_reading') | (previous != 'started_reading')
+    events['read_number'] = 0
+    events.loc[is_start | is_finish, 'read_number'] = new_read.groupby(level=0).cumsum().to_numpy()
+    return events.reset_index(drop=True)
+
+
+def timeline_wide(events, n_books):
+    """ One row per book (0 .. n_books - 1) with the dates derived from its events
+
+        add_to_tbr_dt: first time the book was shelved as to-read
+        start_reading_dt, finish_reading_dt: start and finish of the latest read
+    """
+    to_read = events[(events['event_type'] == 'shelved_as') & (events['shelf'] == 'to-read') & events['date'].notna()]
+    add_to_tbr = to_read.groupby('book')['date'].first()
+
+    reading = events[events['read_number'] > 0]
+    latest = reading[reading['read_number'] == reading.groupby('book')['read_number'].transform('max')]
+    read_dates = latest.pivot_table(index='book', columns='event_type', values='date', aggfunc='last')
+    read_dates = read_dates.reindex(columns=['started_reading', 'finished_reading'])
+
+    wide = pd.DataFrame({
+        'add_to_tbr_dt': add_to_tbr,
+        'start_reading_dt': read_dates['started_reading'],
+        'finish_reading_dt': read_dates['finished_reading'],
+    })
+    return wide.reindex(range(n_books)).astype('datetime64[ns]')
+
+
+def timeline_dates(timeline):
+    """ {book_title: [timeline text]} -> one row per book (book_title, timelines) with the date of each event"""
+    book_timeline_df = pd.DataFrame(data={'book_title': list(timeline.keys()), 'timelines': list(timeline.values())}, dtype=object)
+    dates = timeline_wide(timeline_events(timeline), len(book_timeline_df))
+    return pd.concat([book_timeline_df, dates], axis=1)
+
+
+def genre_strings(clean_genre_str):
+    """ Strips the stringified clean_genre_list column ("['A', 'B']") to 'A, B'"""
+    return clean_genre_str.fillna('').astype(str).str.replace(r"[\[\]']", '', regex=True)
+
+
+def exclude_genres(genre_str, genres):
+    """ Removes whole genres from "A, B" strings, without splitting them into lists"""
+    pattern = '(^|, )({})(?=, |$)'.format('|'.join(map(re.escape, genres)))
+    excluded = genre_str.str.replace(pattern, '', regex=True).str.replace('^, ', '', regex=True)
+    # a book whose only genres were excluded ends up with an empty list (not [''])
+    return excluded.str.split(", ").where((excluded != '') | (genre_str == ''), pd.Series([[]] * len(genre_str), index=genre_str.index))
+
+
+def clean_genre_table(genre_dict):
+    """ {book_id: [genres]} -> clean genre table (book_id, book_genre, clean_genre_list)
+
+    Empty genres and duplicates are dropped, keeping the order. The lists are stringified,
+    the same as when the table is read back from the clean genre CSV.
+    """
+    book_genre = [[x for x in g if x != ''] for g in genre_dict.values()]
+    return pd.DataFrame({
+        'book_id': pd.Series(list(genre_dict.keys()), dtype=str).astype('int64'),
+        'book_genre': [str(g) for g in genre_dict.values()],
+        'clean_genre_list': [str(sorted(set(g), key=g.index)) for g in book_genre],
+    })
+
+
+def timeline_index(book_timeline_df, timeline_book_ids=None):
+    """ Title index of the timelines, with the Book Id of their review page when known"""
+    book_ids = None
+    if timeline_book_ids:
+        book_ids = [timeline_book_ids.get(t) for t in book_timeline_df['book_title']]
+    return TitleIndex(book_timeline_df['book_title'], book_ids)
+
+
+def consolidate_books(goodreads_lib_export, book_genre_df, book_timeline_df, title_index=None):
+    """ Consolidates rows of the library export with the genre table and the timeline dates
+
+    Works on any subset of the export (e.g. one chunk of it), every export column is kept.
+    The timelines are joined through the title index (built from book_timeline_df if not given).
+    """
+    with span('consolidate', step='merge_genres'):
+        consolidate_df = goodreads_lib_export.merge(book_genre_df, how='left', left_on='Book Id', right_on='book_id')
+        consolidate_df.drop(columns=['book_id', 'book_genre'],inplace=True)
+
+    with span('consolidate', step='parse_dates'):
+        consolidate_df['date_read'] = parse_dates(consolidate_df['Date Read'], EXPORT_DATE_FORMAT)
+        consolidate_df['date_added'] = parse_dates(consolidate_df['Date Added'], EXPORT_DATE_FORMAT)
+        consolidate_df['Title_shorten'] = shorten_title(consolidate_df['Title'])
+
+    with span('consolidate', step='merge_timeline'):
+        if title_index is None:
+            title_index = timeline_index(book_timeline_df)
+        consolidate_df['timeline_key'] = title_index.match(consolidate_df['Title'], consolidate_df['Book Id'])['book_title']
+        consolidate_df = consolidate_df.merge(book_timeline_df, how='left', left_on='timeline_key', right_on='book_title')
+        consolidate_df.drop(columns=['timeline_key'], inplace=True)
+
+    with span('consolidate', step='genres'):
+        genre_str = genre_strings(consolidate_df['clean_genre_list'])
+        consolidate_df['genre_list'] = genre_str.str.split(", ")
+
+        genre_matrix = GenreMatrix.from_strings(genre_str)
+        for c, g in CATEGORY_GENRES.items():
+            consolidate_df[c] = genre_matrix.has_genre(g).astype(int)
+
+        consolidate_df['genre_list_trf'] = exclude_genres(genre_str, list(CATEGORY_GENRES.values()))
+
+    consolidate_df['year_read'], consolidate_df['month_read'] = consolidate_df['date_read'].dt.year, consolidate_df['date_read'].dt.month
+    consolidate_df['year_added'], consolidate_df['month_added'] = consolidate_df['date_added'].dt.year, consolidate_df['date_added'].dt.month
+
+    return consolidate_df
+
+
+def consolidate(goodreads_lib_export, book_genre_df, timeline, timeline_book_ids=None):
+    """ Returns the consolidated dataset (one row per book of the library export)
+
+    timeline_book_ids: {book title: Book Id} of the crawled review pages, for an exact join
+    """
+    with span('consolidate', step='timeline_dates'):
+        book_timeline_df = timeline_dates(timeline)
+    consolidate_df = consolidate_books(goodreads_lib_export, book_genre_df, book_timeline_df,
+                                       timeline_index(book_timeline_df, timeline_book_ids))
+    # drop the export columns which only consist of NaN value (the pipeline columns are always kept)
+    consolidate_df.drop(columns=[c for c in goodreads_lib_export.columns if consolidate_df[c].isna().all()], inplace=True)
+    return consolidate_df
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Data Cache
+
+In-process cache of the loaded data frames, keyed on the fingerprint of the data file
+(mtime, size and content hash), so a regenerated consolidated file is picked up on the
+next rerun without restarting the app.
+
+    - frames are returned as is, without copying: treat them as read-only
+    - one cache per process, shared across the Streamlit sessions
+    - least recently used frames are evicted once the cache exceeds `max_bytes`: frames
+      and arrays by their memory usage, plotly figures by the size of their JSON, lists /
+      tuples / dicts by the sum of their items
+    - invalidate() drops the entries of one file (or everything)
+"""
+
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+## {path: (mtime_ns, size, hash)}, only the current version of each file is kept
+_hash_memo = dict()
+
+
+def file_fingerprint(filepath):
+    """ (mtime_ns, size, blake2b of the content); the hash is only recomputed when mtime / size change"""
+    stat = os.stat(filepath)
+    path = os.path.abspath(filepath)
+    memo = _hash_memo.get(path)
+    if memo is None or memo[:2] != (stat.st_mtime_ns, stat.st_size):
+        digest = hashlib.blake2b(digest_size=16)
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        memo = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        _hash_memo[path] = memo
+    return memo
+
+
+def object_size(obj):
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(index=True, deep=True))
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if hasattr(obj, 'to_plotly_json'):
+        # plotly figure: the size of what is sent to the browser
+        return len(obj.to_json())
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(object_size(k) + object_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(object_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class DataCache:
+    """ LRU cache of computed objects (mostly data frames) bounded by their memory size"""
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = dict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def get_or_compute(self, filepath, key, compute):
+        """ Returns compute() for the current version of `filepath`, computed once per version"""
+        full_key = (os.path.abspath(filepath), file_fingerprint(filepath), key)
+        with self.lock:
+            if full_key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(full_key)
+                return self.entries[full_key]
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self._drop_stale(full_key)
+            self.entries[full_key] = value
+            self.sizes[full_key] = object_size(value)
+            self.total_bytes += self.sizes[full_key]
+            self._evict()
+        return value
+
+    def _drop_stale(self, full_key):
+        """ Drops the entries of older versions of the same file"""
+        for k in [k for k in self.entries if k[0] == full_key[0] and k[1] != full_key[1]]:
+            self._remove(k)
+
+    def _remove(self, k):
+        del self.entries[k]
+        self.total_bytes -= self.sizes.pop(k)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, filepath=None):
+        with self.lock:
+            for k in list(self.entries):
+                if filepath is None or k[0] == os.path.abspath(filepath):
+                    self._remove(k)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size_mb': round(self.total_bytes / 2 ** 20, 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Fetcher
+
+Concurrent fetch engine used by the Goodreads crawls (genre and reading timeline).
+
+Pages are fetched by a blocking page loader that runs in a bounded worker pool driven
+by asyncio. Two loader backends are available:
+    - http: pooled keep-alive requests.Session, for static pages (book and review pages)
+    - selenium: pool of Chrome drivers, for pages which need a browser (infinite scroll)
+
+On top of the loader:
+    1. Per-host concurrency limit
+    2. Token-bucket rate limiter (requests per second, with a small burst)
+       Both are shared by every fetcher of the process (host_limits): the crawl stages
+       running in parallel stay within one rate and concurrency per host.
+    3. Retries with exponential backoff and jitter
+    4. Waits that end as soon as the page is ready, instead of a fixed time.sleep
+
+Every page is timed (fetch and parse spans, close_popups for the browser pages) and
+counted (pages ok / failed, retries) in goodreads_telemetry, labelled with the name of
+the fetcher, and each fetch_all reports its progress (pages done / total, ETA).
+
+The engine does not know anything about Goodreads, so it can be exercised against
+a local HTTP stand-in serving saved HTML fixtures (see serve_directory).
+"""
+
+import asyncio
+import functools
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from goodreads_telemetry import TELEMETRY
+
+
+class TokenBucket:
+    """ Token-bucket rate limiter: `rate` tokens per second, at most `capacity` at once
+
+    Thread-safe, it can be shared by the event loops of several fetchers: a token is
+    reserved right away, and the caller waits until its time slot.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self):
+        """ Takes a token, returns the seconds to wait before using it (the reserved ones queue up)"""
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        await asyncio.sleep(self.reserve())
+
+    def wait(self):
+        """ Blocking acquire, for the sequential crawls"""
+        time.sleep(self.reserve())
+
+
+## (host, max_per_host, rate, burst) -> (concurrency semaphore, rate limiter), shared by the fetchers
+_host_limits = dict()
+_host_limits_lock = threading.Lock()
+
+
+def host_limits(url, max_per_host=2, rate=1.0, burst=2):
+    """ Concurrency semaphore (threading) and token bucket of the host of `url`, one per process"""
+    key = (urlparse(url).netloc, max_per_host, rate, burst)
+    with _host_limits_lock:
+        if key not in _host_limits:
+            _host_limits[key] = (threading.BoundedSemaphore(max_per_host), TokenBucket(rate, burst))
+        return _host_limits[key]
+
+
+class Fetcher:
+    """ Fetches many urls concurrently through a blocking `load_page(url) -> page_source`"""
+
+    def __init__(self, load_page, workers=2, max_per_host=2, rate=1.0, burst=2,
+                 retries=3, backoff=2.0, on_result=None, name='fetch'):
+        self.load_page = load_page
+        self.name = name
+        self.workers = workers
+        self.max_per_host = max_per_host
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.on_result = on_result
+        self.progress = None
+
+    def fetch_all(self, urls, parse):
+        """ Returns ({url: parse(page_source)}, {url: error message}) for the given urls"""
+        urls = list(urls)
+        with TELEMETRY.track(self.name, total=len(urls)) as self.progress:
+            return asyncio.run(self._fetch_all(urls, parse))
+
+    async def _fetch_all(self, urls, parse):
+        # tasks of this fetcher waiting for a token or a page: at most max_per_host, so the
+        # fetchers sharing a host take their turns instead of queuing all their urls at once
+        self._in_flight = asyncio.Semaphore(self.max_per_host)
+        results = dict()
+        failures = dict()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            tasks = [self._fetch_one(executor, url, parse, results, failures) for url in urls]
+            await asyncio.gather(*tasks)
+        # keep the input order
+        results = {url: results[url] for url in urls if url in results}
+        return results, failures
+
+    def _load_page(self, host_limit, url):
+        """ load_page in a worker thread, within the (shared) concurrency limit of the host"""
+        with host_limit:
+            return self.load_page(url)
+
+    async def _fetch_one(self, executor, url, parse, results, failures):
+        loop = asyncio.get_running_loop()
+        host_limit, host_bucket = host_limits(url, self.max_per_host, self.rate, self.burst)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                TELEMETRY.count('retries', source=self.name)
+            async with self._in_flight:
+                await host_bucket.acquire()
+                try:
+                    with TELEMETRY.span('fetch', source=self.name):
+                        page_source = await loop.run_in_executor(executor, self._load_page, host_limit, url)
+                    with TELEMETRY.span('parse', source=self.name):
+                        results[url] = parse(page_source)
+                    failures.pop(url, None)
+                    break
+                except Exception as e:
+                    failures[url] = repr(e)
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        TELEMETRY.count('pages', source=self.name, status='ok' if url in results else 'failed')
+        self.progress.advance(errors=int(url not in results))
+        if self.on_result is not None:
+            self.on_result(url, results.get(url), failures.get(url))
+
+
+def close_popup_windows(driver):
+    """ Closes every window except the current one (Goodreads opens sign-in popups)"""
+    with TELEMETRY.span('close_popups'):
+        parent = driver.current_window_handle
+        for win_id in driver.window_handles:
+            if win_id != parent:
+                driver.switch_to.window(win_id)
+                driver.close()
+        driver.switch_to.window(parent)
+
+
+def wait_for_page(driver, by=None, value=None, timeout=10):
+    """ Waits until the document is loaded and (optionally) the element is present
+
+    Returns False when the element did not show up within the timeout, e.g. a book
+    without any genre shelves; the page source is still usable in that case.
+    """
+    wait = WebDriverWait(driver, timeout)
+    try:
+        wait.until(lambda d: d.execute_script("return document.readyState") == "complete")
+        if by is not None:
+            wait.until(EC.presence_of_element_located((by, value)))
+    except TimeoutException:
+        return False
+    return True
+
+
+def scroll_to_end(driver, max_scrolls=15, timeout=4):
+    """ Scrolls an infinite-scroll page until its height stops growing"""
+    height = driver.execute_script("return document.body.scrollHeight")
+    for i in range(max_scrolls):
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        try:
+            WebDriverWait(driver, timeout).until(
+                lambda d: d.execute_script("return document.body.scrollHeight") > height)
+        except TimeoutException:
+            break
+        height = driver.execute_script("return document.body.scrollHeight")
+
+
+def selenium_page_loader(drivers, wait_class=None, timeout=10):
+    """ Builds a thread-safe `load_page(url)` on top of a pool of Selenium drivers"""
+    pool = queue.Queue()
+    for d in drivers:
+        pool.put(d)
+
+    def load_page(url):
+        driver = pool.get()
+        try:
+            driver.get(url)
+            close_popup_windows(driver)
+            if wait_class is None:
+                wait_for_page(driver, timeout=timeout)
+            else:
+                wait_for_page(driver, By.CLASS_NAME, wait_class, timeout)
+            return driver.page_source
+        finally:
+            pool.put(driver)
+
+    return load_page
+
+
+def make_http_session(pool_size=10, headers=None):
+    """ requests.Session with a keep-alive connection pool of `pool_size` per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def http_page_loader(session, timeout=30):
+    """ Builds `load_page(url)` on top of a pooled requests.Session (static pages only)"""
+
+    def load_page(url):
+        response = session.get(url, timeout=timeout)
+        response.raise_for_status()
+        # without a charset in the headers requests decodes text/html as ISO-8859-1
+        if 'charset' not in response.headers.get('Content-Type', ''):
+            response.encoding = 'utf-8'
+        return response.text
+
+    return load_page
+
+
+def serve_directory(directory, port=0):
+    """ Serves saved HTML fixtures on localhost; returns (server, base_url)
+
+    Call server.shutdown() once done.
+    """
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Genres
+
+Compact genre encoding: the genres of the books as integer codes of a sorted vocabulary, in
+a CSR membership matrix (one row per book, in the order of the book table, the codes of a row
+in the order of its genre list). Genre filters and counts are array operations instead of
+scans over lists of strings in DataFrame cells:
+    has_genre / any_of / all_of: boolean masks over the books
+    counts / top_genres: books per genre, of all the books or of a mask
+    breakdown: books per genre x any per-book label (status, year, ...)
+
+has_genre only reads the books of the genre, from the transposed matrix (built on the
+first genre query).
+
+The matrix of a consolidated dataset is built once per data version (file mtime + size) and
+stored next to it ([DATA FILE].genres-[COLUMN]-[VERSION].npz), like the aggregate cube.
+"""
+
+import glob
+import itertools
+import os
+
+import numpy as np
+import pandas as pd
+
+from goodreads_storage import data_version, read_consolidated
+
+
+class GenreMatrix:
+    """ CSR genre membership of the books (rows = book positions)"""
+
+    def __init__(self, genres, indptr, indices):
+        self.genres = pd.Index(genres, dtype=object)
+        self.indptr = indptr
+        self.indices = indices
+        self._row_of = None
+        self._columns = None
+
+    @classmethod
+    def from_lists(cls, genre_lists):
+        """ Matrix of a column of genre lists (NaN / empty list for no genre)"""
+        genre_lists = [g if isinstance(g, (list, tuple, np.ndarray)) else [] for g in genre_lists]
+        lengths = np.fromiter((len(g) for g in genre_lists), dtype=np.int64, count=len(genre_lists))
+        return cls.from_flat(list(itertools.chain.from_iterable(genre_lists)), lengths)
+
+    @classmethod
+    def from_strings(cls, genre_str, sep=', '):
+        """ Matrix of a column of "A, B" genre strings (as from genre_strings()), without
+        splitting row by row: one join and one split of the whole column
+        """
+        genre_str = pd.Series(genre_str, dtype=object).fillna('').astype(str)
+        lengths = np.fromiter((len(g) and g.count(sep) + 1 for g in genre_str), dtype=np.int64, count=len(genre_str))
+        non_empty = genre_str[lengths > 0]
+        return cls.from_flat(sep.join(non_empty).split(sep) if len(non_empty) else [], lengths)
+
+    @classmethod
+    def from_flat(cls, flat_genres, lengths):
+        """ Matrix of the genres of all the books one after the other, `lengths` genres per book"""
+        values = np.empty(len(flat_genres), dtype=object)
+        values[:] = flat_genres
+        codes, genres = pd.factorize(values, sort=True)
+        if len(genres) and genres[0] == '':
+            # e.g. [''] for a book without genre: not a genre ('' sorts first)
+            codes, genres = codes - 1, genres[1:]
+        empty = codes < 0
+        if empty.any():
+            rows = np.repeat(np.arange(len(lengths)), lengths)[~empty]
+            codes, lengths = codes[~empty], np.bincount(rows, minlength=len(lengths))
+        indices = codes.astype(np.int16 if len(genres) < 2 ** 15 else np.int32)
+        return cls(genres, np.r_[0, np.cumsum(lengths)].astype(np.int64), indices)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def nbytes(self):
+        return int(self.indptr.nbytes + self.indices.nbytes + sum(len(g) for g in self.genres))
+
+    @property
+    def row_of(self):
+        """ Book position of each non-zero"""
+        if self._row_of is None:
+            self._row_of = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return self._row_of
+
+    def codes(self, genres):
+        """ Codes of the genres which are in the vocabulary"""
+        codes = self.genres.get_indexer(list(genres))
+        return np.unique(codes[codes >= 0])
+
+    def books_with(self, genre):
+        """ Positions of the books having the genre, from the transposed matrix"""
+        if self._columns is None:
+            order = np.argsort(self.indices, kind='stable')
+            column_ptr = np.r_[0, np.cumsum(np.bincount(self.indices, minlength=len(self.genres)))]
+            self._columns = (column_ptr, self.row_of[order])
+        codes = self.codes([genre])
+        if len(codes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        column_ptr, rows = self._columns
+        return rows[column_ptr[codes[0]]:column_ptr[codes[0] + 1]]
+
+    def has_genre(self, genre):
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.books_with(genre)] = True
+        return mask
+
+    def any_of(self, genres):
+        mask = np.zeros(len(self), dtype=bool)
+        for genre in genres:
+            mask[self.books_with(genre)] = True
+        return mask
+
+    def all_of(self, genres):
+        genres = set(genres)
+        if len(self.codes(genres)) < len(genres):
+            return np.zeros(len(self), dtype=bool)
+        hits = np.zeros(len(self), dtype=np.int64)
+        for genre in genres:
+            hits[self.books_with(genre)] += 1
+        return hits == len(genres)
+
+    def counts(self, mask=None):
+        """ Number of books (of the mask) per genre code"""
+        indices = self.indices if mask is None else self.indices[mask[self.row_of]]
+        return np.bincount(indices, minlength=len(self.genres))
+
+    def top_genres(self, n=10, mask=None, exclude=()):
+        """ n genres with the most books (of the mask), as a Series genre -> books"""
+        counts = pd.Series(self.counts(mask), index=self.genres)
+        counts = counts[(counts > 0) & ~counts.index.isin(list(exclude))]
+        return counts.sort_values(ascending=False, kind='stable').head(n)
+
+    def breakdown(self, labels, mask=None):
+        """ Books per genre x label (one label per book, e.g. its status or year read)"""
+        label_codes, label_values = pd.factorize(pd.Series(labels), sort=True)
+        if mask is not None:
+            label_codes = np.where(mask, label_codes, -1)
+        nonzero_labels = label_codes[self.row_of]
+        keep = nonzero_labels >= 0
+        cells = self.indices[keep].astype(np.int64) * len(label_values) + nonzero_labels[keep]
+        counts = np.bincount(cells, minlength=len(self.genres) * len(label_values))
+        return pd.DataFrame(counts.reshape(len(self.genres), len(label_values)), index=self.genres, columns=label_values)
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as file:
+            np.savez(file, genres=self.genres.to_numpy(dtype=str), indptr=self.indptr, indices=self.indices)
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as npz:
+            return cls(npz['genres'].astype(object), npz['indptr'], npz['indices'])
+
+
+def load_genre_matrix(data_filepath, column='genre_list'):
+    """ Loads the stored genre matrix of the current data version (rows in the order of the
+    consolidated dataset), builds (and stores) it if missing
+    """
+    matrix_filepath = '{}.genres-{}-{}.npz'.format(data_filepath, column, data_version(data_filepath))
+    if os.path.exists(matrix_filepath):
+        return GenreMatrix.load(matrix_filepath)
+
+    df = read_consolidated(data_filepath, columns=[column], parse_lists=True)
+    matrix = GenreMatrix.from_lists(df[column])
+    for old_filepath in glob.glob('{}.genres-{}-*.npz'.format(data_filepath, column)):
+        os.remove(old_filepath)
+    matrix.save(matrix_filepath)
+    return matrix
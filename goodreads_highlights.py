@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Highlights
+
+Term index of the book highlights, for the word cloud of the dashboard (metric 5).
+
+Highlights are tokenized once, when they are added: lowercased words of 3+ letters,
+stopwords dropped. The index is persistent (SQLite) and incremental, a highlight which is
+already indexed is skipped, so a new crawl only tokenizes the new highlights:
+    highlights: highlight_id (hash of book + text), book_id, text
+    book_terms: term counts per book
+    book_genres: genres of each book
+    genre_terms: term counts per genre, kept in sync with book_terms and book_genres
+
+top_terms() answers one book or one genre straight from the index. For any other set of
+books (e.g. read in a given year), term_matrix() loads the book x term counts as a sparse
+matrix, and TermMatrix.top_terms() sums the rows of the books.
+
+Import an existing highlight dump (and the genres of the page cache) with:
+    python goodreads_highlights.py [INDEX FILE] [HIGHLIGHT TXT FILE] [GENRE CACHE FILE]
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from goodreads_cache import QUERY_BATCH_SIZE, PageCache
+
+TOKEN_PATTERN = re.compile(r'[^\W\d_]{3,}')
+BOOK_ID_PATTERN = re.compile(r'/notes/(\d+)')
+STOPWORDS = frozenset("""
+about above after again against all also although among and another any anyone anything are aren
+around because been before being below between both but can cannot could couldn did didn does doesn
+doing don done down during each either else enough even ever every everyone everything few for from
+further get gets getting give given goes going gone got had hadn has hasn have haven having her here
+hers herself him himself his how however into isn its itself just keep know least less let like
+ll made make makes making many may maybe might mine more most much must myself need neither never
+nor not nothing now off often once one ones only onto other others our ours ourselves out over own
+perhaps rather really said same say says see seem seems shall she should shouldn since some someone
+something still such than that the their theirs them themselves then there these they thing things
+this those though through thus too toward under until upon very via was wasn way well were weren
+what whatever when where whether which while who whom whose why will with within without won would
+wouldn yet you your yours yourself yourselves
+""".split())
+
+
+def fix_mojibake(text):
+    """ Undoes UTF-8 text decoded as cp1252 (e.g. 'doesnâ€™t'), as in some of the crawled pages"""
+    if 'â€' not in text and 'Ã' not in text:
+        return text
+    try:
+        return text.encode('cp1252').decode('utf-8')
+    except UnicodeError:
+        return text
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall(fix_mojibake(text).lower()) if t not in STOPWORDS]
+
+
+def highlight_book_id(url):
+    """ Book Id of a highlight page url (https://www.goodreads.com/notes/<book id>-<slug>/...)"""
+    book_id = BOOK_ID_PATTERN.search(url)
+    return book_id.group(1) if book_id else None
+
+
+def highlight_id(book_id, text):
+    return hashlib.blake2b('{}\n{}'.format(book_id, text).encode('utf-8'), digest_size=12).hexdigest()
+
+
+class TermMatrix:
+    """ Book x term counts as a CSR matrix (indptr, indices, data), rows in the order of book_ids"""
+
+    def __init__(self, book_ids, terms, indptr, indices, data):
+        self.book_ids = book_ids
+        self.terms = terms
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.row_of = pd.Series(np.arange(len(book_ids)), index=book_ids)
+
+    @property
+    def nbytes(self):
+        return int(self.indptr.nbytes + self.indices.nbytes + self.data.nbytes
+                   + self.book_ids.nbytes + self.terms.nbytes + sum(len(t) for t in self.terms))
+
+    def top_terms(self, k=50, book_ids=None):
+        """ k most frequent terms over the given books (all books if None)"""
+        if book_ids is None:
+            indices, data = self.indices, self.data
+        else:
+            rows = self.row_of.reindex(pd.Index(book_ids).astype(str).unique()).dropna().to_numpy(dtype=np.int64)
+            starts, ends = self.indptr[rows], self.indptr[rows + 1]
+            # positions of the non-zeros of the selected rows, without a python loop
+            lengths = ends - starts
+            positions = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+            indices, data = self.indices[positions], self.data[positions]
+        counts = np.bincount(indices, weights=data, minlength=len(self.terms))
+        # every term tied with the k-th count is a candidate, ties are broken by the term
+        # (same order as HighlightIndex.top_terms)
+        threshold = -np.partition(-counts, k - 1)[k - 1] if len(counts) > k else 0
+        top = np.flatnonzero((counts >= threshold) & (counts > 0))
+        top = top[np.lexsort((self.terms[top].astype(str), -counts[top]))][:k]
+        return pd.DataFrame({'term': self.terms[top], 'count': counts[top].astype(np.int64)})
+
+
+class HighlightIndex:
+    """ Persistent, incremental term index of the highlights"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.conn = sqlite3.connect(filepath)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS highlights (
+                highlight_id TEXT PRIMARY KEY,
+                book_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                added_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS book_terms (
+                book_id TEXT NOT NULL,
+                term TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (book_id, term)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS book_genres (
+                book_id TEXT NOT NULL,
+                genre TEXT NOT NULL,
+                PRIMARY KEY (book_id, genre)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS genre_terms (
+                genre TEXT NOT NULL,
+                term TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (genre, term)
+            ) WITHOUT ROWID;
+            """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def add_highlights(self, book_id, texts):
+        """ Indexes the highlights of a book which are not indexed yet, returns how many were new"""
+        return self.add_many([(book_id, texts)])
+
+    def add_many(self, entries):
+        """ Indexes (book_id, [highlight text]) entries in one transaction, returns how many were new"""
+        added_at = time.time()
+        entries = [(str(book_id), dict((highlight_id(book_id, t), t) for t in texts)) for book_id, texts in entries]
+        known = self._select_in("SELECT highlight_id FROM highlights WHERE highlight_id IN ({})",
+                                [h_id for book_id, ids in entries for h_id in ids])
+        new_rows = []
+        for book_id, ids in entries:
+            for h_id, text in ids.items():
+                if h_id not in known:
+                    known.add(h_id)
+                    new_rows.append((h_id, book_id, text, added_at))
+        self.conn.executemany("INSERT INTO highlights VALUES (?, ?, ?, ?)", new_rows)
+
+        tokens = [(row[1], t) for row in new_rows for t in tokenize(row[2])]
+        book_terms = pd.DataFrame(tokens, columns=['book_id', 'term']).value_counts().rename('count').reset_index()
+        book_genres = pd.DataFrame(sorted(self._select_in("SELECT book_id, genre FROM book_genres WHERE book_id IN ({})",
+                                                          book_terms['book_id'].unique().tolist())),
+                                   columns=['book_id', 'genre'])
+        genre_terms = book_terms.merge(book_genres, on='book_id').groupby(['genre', 'term'])['count'].sum()
+        self.conn.executemany("""
+            INSERT INTO book_terms VALUES (?, ?, ?)
+            ON CONFLICT (book_id, term) DO UPDATE SET count = count + excluded.count
+            """, zip(*(book_terms[c].tolist() for c in book_terms)))
+        self.conn.executemany("""
+            INSERT INTO genre_terms VALUES (?, ?, ?)
+            ON CONFLICT (genre, term) DO UPDATE SET count = count + excluded.count
+            """, zip(*(genre_terms.reset_index()[c].tolist() for c in ['genre', 'term', 'count'])))
+        self.conn.commit()
+        return len(new_rows)
+
+    def add_highlight_dict(self, highlight_dict, batch_size=1000):
+        """ Indexes a {highlight page url: [highlight text]} dump (highlight_filepath), `batch_size` books
+        per transaction
+        """
+        entries = [(highlight_book_id(url), texts) for url, texts in highlight_dict.items()]
+        entries = [e for e in entries if e[0] is not None]
+        return sum(self.add_many(entries[i:i + batch_size]) for i in range(0, len(entries), batch_size))
+
+    def _select_in(self, query, values):
+        """ Rows of `query` (one IN placeholder) over all the values, QUERY_BATCH_SIZE at a time;
+        single column rows as a set
+        """
+        rows = set()
+        for i in range(0, len(values), QUERY_BATCH_SIZE):
+            batch = values[i:i + QUERY_BATCH_SIZE]
+            for row in self.conn.execute(query.format(','.join('?' * len(batch))), batch):
+                rows.add(row[0] if len(row) == 1 else row)
+        return rows
+
+    def set_book_genres(self, genre_dict):
+        """ Sets the genres of the books of {book_id: [genres]}, the genre counts follow"""
+        for book_id, genres in genre_dict.items():
+            book_id = str(book_id)
+            new = set(g for g in genres if g)
+            old = set(r[0] for r in self.conn.execute("SELECT genre FROM book_genres WHERE book_id = ?", (book_id,)))
+            for genre in old - new:
+                self.conn.execute("""
+                    UPDATE genre_terms SET count = count - (
+                        SELECT b.count FROM book_terms b WHERE b.book_id = ? AND b.term = genre_terms.term)
+                    WHERE genre = ? AND term IN (SELECT term FROM book_terms WHERE book_id = ?)
+                    """, (book_id, genre, book_id))
+                self.conn.execute("DELETE FROM book_genres WHERE book_id = ? AND genre = ?", (book_id, genre))
+            for genre in new - old:
+                self.conn.execute("""
+                    INSERT INTO genre_terms SELECT ?, term, count FROM book_terms WHERE book_id = ?
+                    ON CONFLICT (genre, term) DO UPDATE SET count = count + excluded.count
+                    """, (genre, book_id))
+                self.conn.execute("INSERT INTO book_genres VALUES (?, ?)", (book_id, genre))
+        self.conn.execute("DELETE FROM genre_terms WHERE count <= 0")
+        self.conn.commit()
+
+    def top_terms(self, k=50, book_id=None, genre=None):
+        """ k most frequent terms of one book, one genre, or of every highlight"""
+        if book_id is not None:
+            query, args = "SELECT term, count FROM book_terms WHERE book_id = ?", (str(book_id),)
+        elif genre is not None:
+            query, args = "SELECT term, count FROM genre_terms WHERE genre = ?", (genre,)
+        else:
+            query, args = "SELECT term, SUM(count) FROM book_terms GROUP BY term", ()
+        rows = self.conn.execute(query + " ORDER BY 2 DESC, 1 LIMIT ?", args + (k,)).fetchall()
+        return pd.DataFrame(rows, columns=['term', 'count'])
+
+    def genres(self):
+        return [r[0] for r in self.conn.execute("SELECT DISTINCT genre FROM genre_terms ORDER BY genre")]
+
+    def book_genres(self):
+        """ (book_id, genre) rows of the books which have highlights"""
+        return pd.read_sql_query("""
+            SELECT book_id, genre FROM book_genres WHERE book_id IN (SELECT DISTINCT book_id FROM book_terms)
+            """, self.conn)
+
+    def term_matrix(self):
+        """ Book x term counts of the whole index, as a TermMatrix"""
+        # one row per book (terms and counts concatenated in the same scan), much less
+        # python objects to fetch than one row per (book, term)
+        rows = self.conn.execute("""
+            SELECT book_id, group_concat(term, ' '), group_concat(count, ' ')
+            FROM book_terms GROUP BY book_id ORDER BY book_id
+            """).fetchall()
+        book_ids = np.array([r[0] for r in rows], dtype=object)
+        lengths = np.array([r[1].count(' ') + 1 for r in rows], dtype=np.int64)
+        term_codes, terms = pd.factorize(pd.Series(' '.join(r[1] for r in rows).split(' ') if rows else [], dtype=object))
+        counts = np.array(' '.join(r[2] for r in rows).split(' ') if rows else [], dtype=np.int64)
+        indptr = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+        return TermMatrix(book_ids, np.asarray(terms, dtype=object), indptr, term_codes.astype(np.int32), counts)
+
+if __name__ == '__main__':
+    highlight_index = HighlightIndex(sys.argv[1])
+    with open(sys.argv[2], 'r') as file:
+        print(highlight_index.add_highlight_dict(json.loads(file.read())))
+    if len(sys.argv) > 3 and os.path.exists(sys.argv[3]):
+        page_cache = PageCache(sys.argv[3])
+        highlight_index.set_book_genres(page_cache.genre_dict())
+        page_cache.close()
+    print(highlight_index.top_terms(20))
+    highlight_index.close()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Ingest
+
+Streaming consolidation of the library export, for libraries too big to be read at once.
+
+The export is read in chunks of `chunk_rows` rows with explicit dtypes (the shelf and
+binding columns as categories), each chunk is joined with the genre index and the
+timeline dates, and appended to the output (one Parquet row group or CSV block per
+chunk). Only one chunk is in memory at a time, besides the timeline dates.
+
+Differences with consolidate():
+    - every export column is kept, also the ones without any value (the columns have to
+      be known before the first chunk is written)
+    - Exclusive Shelf, Bookshelves and Binding are categorical (dictionary in Parquet)
+
+Genre index:
+    frame_genre_index(book_genre_df): the clean genre table, indexed by book id
+    cache_genre_index(page_cache): primary key lookups in the page cache, nothing kept in memory
+"""
+
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from goodreads_consolidation import clean_genre_table, consolidate_books, timeline_dates, timeline_index
+from goodreads_storage import consolidated_schema, is_parquet
+from goodreads_telemetry import span, track
+
+CATEGORY_COLUMNS = ['Exclusive Shelf', 'Bookshelves', 'Binding']
+EXPORT_DTYPES = dict(
+    [(c, 'category') for c in CATEGORY_COLUMNS]
+    + [(c, 'int64') for c in ['Book Id', 'My Rating', 'Read Count', 'Owned Copies']]
+    + [(c, 'float64') for c in ['Average Rating', 'Number of Pages', 'Year Published', 'Original Publication Year']]
+    + [(c, 'object') for c in ['Title', 'Author', 'Author l-f', 'Additional Authors', 'ISBN', 'ISBN13',
+                               'Publisher', 'Date Read', 'Date Added', 'Bookshelves with positions',
+                               'My Review', 'Spoiler', 'Private Notes', 'Recommended For', 'Recommended By',
+                               'Original Purchase Date', 'Original Purchase Location', 'Condition',
+                               'Condition Description', 'BCID']]
+)
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def read_export_chunks(export_filepath, chunk_rows=DEFAULT_CHUNK_ROWS, usecols=None):
+    """ Iterator over the library export, `chunk_rows` rows at a time"""
+    return pd.read_csv(export_filepath, dtype=EXPORT_DTYPES, usecols=usecols, chunksize=chunk_rows)
+
+
+def read_book_ids(export_filepath, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """ Book Id column of the library export, without reading the other columns"""
+    return [b for chunk in read_export_chunks(export_filepath, chunk_rows, usecols=['Book Id'])
+            for b in chunk['Book Id'].tolist()]
+
+
+def frame_genre_index(book_genre_df):
+    """ Genre lookup on the clean genre table (book_ids -> genre rows of these books)"""
+    indexed = book_genre_df.set_index('book_id', drop=False)
+    indexed = indexed[~indexed.index.duplicated()]
+
+    def lookup(book_ids):
+        return indexed.loc[indexed.index.intersection(book_ids)].reset_index(drop=True)
+    return lookup
+
+
+def cache_genre_index(page_cache):
+    """ Genre lookup on the page cache (book_ids -> genre rows of these books)"""
+    def lookup(book_ids):
+        return clean_genre_table(page_cache.genre_dict(book_ids))
+    return lookup
+
+
+def stream_schema(df):
+    """ Parquet schema from the first chunk; columns without any value are typed as strings
+    and the categories as dictionaries, so every later chunk fits
+    """
+    schema = consolidated_schema(df)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.string()))
+        elif pa.types.is_dictionary(field.type):
+            schema = schema.set(i, pa.field(field.name, pa.dictionary(pa.int32(), pa.string())))
+    return schema
+
+
+class ConsolidatedWriter:
+    """ Appends consolidated chunks to a Parquet (one row group per chunk) or CSV file"""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.parquet_writer = None
+        self.schema = None
+        self.columns = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+            if os.path.exists(self.filepath):
+                os.remove(self.filepath)
+        df = df[self.columns]
+        if is_parquet(self.filepath):
+            if self.parquet_writer is None:
+                self.schema = stream_schema(df)
+                self.parquet_writer = pq.ParquetWriter(self.filepath, self.schema)
+            # list columns without any value in this chunk come out as all-NaN float
+            empty = [f.name for f in self.schema if pa.types.is_list(f.type) and df[f.name].dtype != object]
+            if empty:
+                df = df.astype(dict((c, object) for c in empty))
+            self.parquet_writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        else:
+            df.to_csv(self.filepath, mode='a', header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def consolidate_stream(export_filepath, genre_index, timeline, output_filepath,
+                       chunk_rows=DEFAULT_CHUNK_ROWS, on_chunk=None, timeline_book_ids=None):
+    """ Consolidates the library export chunk by chunk into `output_filepath`
+
+    genre_index: frame_genre_index / cache_genre_index lookup
+    timeline_book_ids: {book title: Book Id} of the crawled review pages
+    on_chunk(rows_done): called after each chunk is written
+    Returns the number of books written.
+    """
+    with span('consolidate', step='timeline_dates'):
+        book_timeline_df = timeline_dates(timeline)
+        title_index = timeline_index(book_timeline_df, timeline_book_ids)
+    writer = ConsolidatedWriter(output_filepath)
+    progress = track('consolidate_stream')
+    try:
+        for chunk in read_export_chunks(export_filepath, chunk_rows):
+            with span('consolidate', step='genre_lookup'):
+                chunk_genre_df = genre_index(chunk['Book Id'])
+            consolidate_df = consolidate_books(chunk, chunk_genre_df, book_timeline_df, title_index)
+            with span('consolidate', step='write'):
+                writer.write(consolidate_df)
+            progress.advance(len(chunk))
+            if on_chunk is not None:
+                on_chunk(writer.rows)
+    finally:
+        writer.close()
+        progress.finish()
+    return writer.rows
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Title Matching
+
+Index of the reading timeline titles, to find the timeline of each book of the library
+export. Matching runs in tiers, each book takes the first tier that matches:
+    book_id: Book Id captured from the review page at crawl time (exact join)
+    exact: normalized title (case, accents, punctuation, "X's Reviews >" prefix and series part dropped)
+    main_title: normalized title without the subtitle (text before ':'), if unique in the index
+    fuzzy: MinHash / LSH blocking on character 3-grams, then the Jaccard similarity of the
+           best candidate, accepted above `min_similarity`
+
+The LSH buckets keep the fuzzy tier near-linear: a title is only compared with the titles
+sharing at least one band of its MinHash signature (buckets bigger than MAX_BUCKET_SIZE
+are skipped, they only hold generic titles). They are only built on the first title
+which needs the fuzzy tier.
+"""
+
+import numpy as np
+import pandas as pd
+
+MATCH_METHODS = ['book_id', 'exact', 'main_title', 'fuzzy']
+NUM_BANDS = 10
+BAND_ROWS = 3
+MAX_BUCKET_SIZE = 50
+MIN_SIMILARITY = 0.6
+TOP_CANDIDATES = 3
+_rng = np.random.default_rng(20220501)
+HASH_A = _rng.integers(1, 2 ** 63 - 1, NUM_BANDS * BAND_ROWS, dtype=np.uint64) | np.uint64(1)
+HASH_B = _rng.integers(0, 2 ** 63 - 1, NUM_BANDS * BAND_ROWS, dtype=np.uint64)
+
+
+def normalize_title(titles):
+    """ Normalized title keys, e.g. "Jane's Reviews > Dune: Deluxe Edition (Dune, #1)" -> 'dune: deluxe edition'"""
+    s = pd.Series(titles, dtype=object).fillna('').astype(str)
+    s = s.str.replace(r'^.*?Reviews\s*>\s*|\s*\([^()]*\)\s*$', '', regex=True).str.lower()
+    accented = ~s.map(str.isascii)
+    if accented.any():
+        s[accented] = s[accented].str.normalize('NFKD').str.replace('[\u0300-\u036f]', '', regex=True)
+    s = s.str.replace('&', ' and ', regex=False).str.replace("['’]", '', regex=True)
+    return s.str.replace(r'[^\w:]+', ' ', regex=True).str.replace(r'\s*:\s*', ': ', regex=True).str.strip(' :')
+
+
+def main_title(keys):
+    """ Normalized keys without the subtitle"""
+    return keys.str.replace(':.*$', '', regex=True)
+
+
+def title_shingles(keys):
+    """ Character 3-grams of each key as int64 (3 code points of 21 bits)
+
+    Returns (shingles, owners): owners[i] is the position of the key shingles[i] comes from.
+    """
+    keys = [' {} '.format(k.replace(':', '')) for k in keys]
+    lengths = np.array([len(k) for k in keys], dtype=np.int64)
+    codes = np.frombuffer(''.join(keys).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    owners = np.repeat(np.arange(len(keys)), lengths)
+    if len(codes) < 3:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    shingles = (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+    same_key = owners[:-2] == owners[2:]
+    return shingles[same_key], owners[:-2][same_key]
+
+
+def minhash_signatures(shingles, owners, n_keys):
+    """ MinHash signature (NUM_BANDS * BAND_ROWS hashes) of each key, from its shingles"""
+    signatures = np.full((n_keys, len(HASH_A)), np.iinfo(np.uint64).max, dtype=np.uint64)
+    if len(shingles) == 0:
+        return signatures
+    # owners are sorted: one reduceat segment per key which has shingles
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    x = shingles.astype(np.uint64)
+    for p in range(len(HASH_A)):
+        hashed = (x * HASH_A[p] + HASH_B[p]) >> np.uint64(16)
+        signatures[owners[starts], p] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+def band_keys(signatures):
+    """ (n_keys x NUM_BANDS) bucket key of each band of the signatures"""
+    bands = signatures.reshape(len(signatures), NUM_BANDS, BAND_ROWS)
+    keys = np.zeros(bands.shape[:2], dtype=np.uint64)
+    for r in range(BAND_ROWS):
+        keys = keys * np.uint64(1000003) ^ bands[:, :, r]
+    return keys
+
+
+def shingle_set(shingles, starts, i):
+    return set(shingles[starts[i]:starts[i + 1]].tolist())
+
+
+def jaccard(a, b):
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+class TitleIndex:
+    """ Index of the timeline titles (and the Book Id of their review page, when known)"""
+
+    def __init__(self, titles, book_ids=None, min_similarity=MIN_SIMILARITY):
+        self.titles = pd.Series(list(titles), dtype=object)
+        self.min_similarity = min_similarity
+        self.keys = keys = normalize_title(self.titles)
+        self.shingles = None
+        self.by_key = pd.Series(self.titles.index, index=keys)
+        self.by_key = self.by_key[~self.by_key.index.duplicated()]
+        main_keys = main_title(keys)
+        self.by_main_key = pd.Series(self.titles.index, index=main_keys)
+        self.by_main_key = self.by_main_key[~self.by_main_key.index.duplicated(keep=False)]
+        self.by_book_id = pd.Series(dtype=np.int64)
+        if book_ids is not None:
+            book_ids = pd.to_numeric(pd.Series(list(book_ids), dtype=object), errors='coerce')
+            self.by_book_id = pd.Series(self.titles.index[book_ids.notna()], index=book_ids.dropna().astype(np.int64))
+            self.by_book_id = self.by_book_id[~self.by_book_id.index.duplicated()]
+
+    def build_buckets(self):
+        """ Shingles and LSH buckets of the index, built on the first fuzzy lookup"""
+        shingles, owners = title_shingles(self.keys)
+        self.shingles = shingles
+        self.shingle_starts = np.searchsorted(owners, np.arange(len(self.keys) + 1))
+        self.signatures = minhash_signatures(shingles, owners, len(self.keys))
+        buckets = pd.DataFrame({
+            'band': np.tile(np.arange(NUM_BANDS), len(self.keys)),
+            'bucket': band_keys(self.signatures).ravel(),
+            'candidate': np.repeat(np.arange(len(self.keys)), NUM_BANDS),
+        })
+        size = buckets.groupby(['band', 'bucket'])['candidate'].transform('size')
+        self.buckets = buckets[size <= MAX_BUCKET_SIZE]
+
+    def __len__(self):
+        return len(self.titles)
+
+    def fuzzy_match(self, keys, exclude=()):
+        """ (position in keys, timeline position, similarity) of the best fuzzy candidate of each key
+
+        Candidates share a band with the key and are not in `exclude` (timelines already
+        matched exactly); the signature agreement picks the TOP_CANDIDATES whose exact
+        Jaccard similarity is computed.
+        """
+        if self.shingles is None:
+            self.build_buckets()
+        keys = keys.reset_index(drop=True)
+        shingles, owners = title_shingles(keys)
+        signatures = minhash_signatures(shingles, owners, len(keys))
+        queries = pd.DataFrame({
+            'band': np.tile(np.arange(NUM_BANDS), len(keys)),
+            'bucket': band_keys(signatures).ravel(),
+            'query': np.repeat(np.arange(len(keys)), NUM_BANDS),
+        })
+        pairs = queries.merge(self.buckets, on=['band', 'bucket'])[['query', 'candidate']].drop_duplicates()
+        pairs = pairs[~pairs['candidate'].isin(exclude)]
+        if pairs.empty:
+            return pd.DataFrame(columns=['query', 'candidate', 'similarity'])
+
+        q, c = pairs['query'].to_numpy(), pairs['candidate'].to_numpy()
+        pairs['estimate'] = (signatures[q] == self.signatures[c]).mean(axis=1)
+        pairs = pairs.sort_values('estimate', ascending=False, kind='stable').groupby('query').head(TOP_CANDIDATES)
+
+        query_starts = np.searchsorted(owners, np.arange(len(keys) + 1))
+        pairs['similarity'] = [jaccard(shingle_set(shingles, query_starts, q),
+                                       shingle_set(self.shingles, self.shingle_starts, c))
+                               for q, c in zip(pairs['query'].tolist(), pairs['candidate'].tolist())]
+        best = pairs.sort_values('similarity', ascending=False, kind='stable').drop_duplicates('query')
+        return best[best['similarity'] >= self.min_similarity][['query', 'candidate', 'similarity']]
+
+    def match(self, titles, book_ids=None):
+        """ Timeline title matched to each of the given library titles
+
+        Returns a frame indexed like `titles`: book_title (None when unmatched),
+        match_method (one of MATCH_METHODS) and match_score (1 for the exact tiers).
+        """
+        titles = pd.Series(titles)
+        keys = normalize_title(titles).set_axis(titles.index)
+        position = pd.Series(np.nan, index=titles.index)
+        method = pd.Series(None, index=titles.index, dtype=object)
+        score = pd.Series(np.nan, index=titles.index)
+
+        # each tier only looks at the titles left unmatched by the previous ones
+        tiers = [('exact', lambda rows: keys[rows], self.by_key),
+                 ('main_title', lambda rows: main_title(keys[rows]), self.by_main_key)]
+        if book_ids is not None and len(self.by_book_id):
+            book_ids = pd.Series(book_ids).set_axis(titles.index)
+            tiers.insert(0, ('book_id', lambda rows: book_ids[rows], self.by_book_id))
+        for name, values, lookup in tiers:
+            values = values(position.isna())
+            found = values.index[values.isin(lookup.index)]
+            position[found] = lookup.reindex(values[found]).to_numpy()
+            method[found] = name
+            score[found] = 1.0
+
+        unmatched = position.isna() & (keys != '')
+        if unmatched.any() and len(self):
+            best = self.fuzzy_match(keys[unmatched], exclude=position.dropna().astype(np.int64).unique())
+            rows = keys[unmatched].index[best['query'].to_numpy(dtype=np.int64)]
+            position[rows] = best['candidate'].to_numpy(dtype=float)
+            method[rows] = 'fuzzy'
+            score[rows] = best['similarity'].to_numpy(dtype=float)
+
+        matched = position.notna()
+        book_title = pd.Series(None, index=titles.index, dtype=object)
+        book_title[matched] = self.titles.to_numpy()[position[matched].astype(np.int64)]
+        return pd.DataFrame({'book_title': book_title, 'match_method': method, 'match_score': score})
+
+
+def match_report(matches, index=None):
+    """ Match rate of the library books (per tier), and the timeline titles left unmatched"""
+    counts = matches['match_method'].value_counts()
+    report = {
+        'books': len(matches),
+        'matched': int(matches['book_title'].notna().sum()),
+        'match_rate': round(float(matches['book_title'].notna().mean()), 4) if len(matches) else 0.0,
+        'by_method': dict((m, int(counts.get(m, 0))) for m in MATCH_METHODS),
+    }
+    if index is not None:
+        report['timelines'] = len(index)
+        report['unmatched_timelines'] = sorted(set(index.titles) - set(matches['book_title'].dropna()))
+    return report
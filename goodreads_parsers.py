@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Parsers
+
+lxml based parsers for the crawled Goodreads pages. They work on the page source only,
+so the same parser is used whatever backend fetched the page (requests or Selenium).
+"""
+
+import re
+
+import lxml.html
+
+
+def xpath_class(tag_string, class_name):
+    """ XPath matching elements whose class attribute contains the given class"""
+    return '//{}[contains(concat(" ", normalize-space(@class), " "), " {} ")]'.format(tag_string, class_name)
+
+
+def find_all_by_class(page_source, tag_string, class_name):
+    tree = lxml.html.fromstring(page_source)
+    return tree.xpath(xpath_class(tag_string, class_name))
+
+
+def parse_book_genres(page_source):
+    """ Top shelves of a book page (Genre section)"""
+    genre_list = find_all_by_class(page_source, 'div', 'elementList')
+    return [x.find('.//a').text_content() for x in genre_list if x.find('.//a') is not None]
+
+
+def parse_book_timeline(page_source):
+    """ (book title, reading timeline) of a review page"""
+    tree = lxml.html.fromstring(page_source)
+    # the heading is "<user>'s Reviews > <book title>"
+    book_title = re.sub(r'^.*?Reviews\s*>\s*', '', tree.find('.//h1').text_content().strip())
+    book_timeline = tree.xpath(xpath_class('div', 'readingTimeline__text'))
+    book_timeline_list = [x.text_content().strip().replace('\n',' ') for x in book_timeline]
+    return book_title, book_timeline_list
+
+
+def parse_review_book_id(page_source):
+    """ Book Id of the book a review page is about (link of the heading), None if not found
+
+    Only the heading is looked at: the other book links of the page (sidebar,
+    recommendations) are about other books, the title tiers of the matching handle the
+    pages without a heading link.
+    """
+    tree = lxml.html.fromstring(page_source)
+    links = tree.xpath('//h1//a[contains(@href, "/book/show/")]/@href')
+    book_id = re.search(r'/book/show/(\d+)', links[0]) if links else None
+    return book_id.group(1) if book_id else None
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Pipeline
+
+Stage graph runner for the scraping and consolidation pipeline (stages in goodreads_scraper).
+
+Every stage is a function of the parameters which declares what it depends on:
+    inputs: parameters holding the paths of the files it reads
+    outputs: parameters holding the paths of the files it writes
+    params: other parameters it uses (urls, modes, ...)
+    sources: the modules of this repository its result depends on
+    state: optional function of the parameters, for what the result depends on besides
+           files and parameters (e.g. the pages a crawl still has to fetch)
+
+The graph follows from the files: a stage runs after the stages writing its inputs, and the
+stages which do not depend on each other run in parallel (thread pool, the stages are mostly
+waiting on the network or on the disk).
+
+A stage is skipped when its key, the content hash of its input files, source files,
+parameter values and state, is the key of its last successful run and its output files are still the
+ones that run wrote. The keys, the output hashes and the timing of the runs are kept in a
+JSON state file. File hashes are memoized on (size, mtime), unchanged files are not read
+again.
+
+Each stage run is a 'stage' span of goodreads_telemetry, each finished stage is logged as
+a 'stage' event with its record, and a run reports its progress as the 'pipeline' task.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from goodreads_telemetry import TELEMETRY
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+TIMING_HISTORY = 20
+
+
+class Stage:
+    """ A pipeline step: run(param), with its declared inputs, outputs, params, sources and state"""
+
+    def __init__(self, name, run, inputs=(), outputs=(), params=(), sources=(), state=None):
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.params = tuple(params)
+        self.sources = tuple(sources)
+        self.state = state
+
+    def input_files(self, param):
+        """ {parameter: path} of the inputs, the optional ones which are not set are left out"""
+        return dict((p, param[p]) for p in self.inputs if param.get(p))
+
+    def output_files(self, param):
+        return dict((p, param[p]) for p in self.outputs if param.get(p))
+
+
+def file_hash(filepath, chunk_bytes=2 ** 20):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """ Runs the stages in dependency order, skipping the up-to-date ones"""
+
+    def __init__(self, stages, state_filepath):
+        self.stages = dict((s.name, s) for s in stages)
+        self.state_filepath = state_filepath
+        self._lock = threading.Lock()
+        self.state = {'files': {}, 'stages': {}}
+        if os.path.exists(state_filepath):
+            with open(state_filepath, 'r') as file:
+                self.state = json.loads(file.read())
+
+    def save_state(self):
+        tmp_filepath = self.state_filepath + '.tmp'
+        with open(tmp_filepath, 'w') as file:
+            file.write(json.dumps(self.state, indent=1))
+        os.replace(tmp_filepath, self.state_filepath)
+
+    def hash_file(self, filepath):
+        """ Content hash of a file, read again only when its size or mtime changed"""
+        stat = os.stat(filepath)
+        key = os.path.abspath(filepath)
+        with self._lock:
+            memo = self.state['files'].get(key)
+        if memo is not None and memo[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return memo[2]
+        digest = file_hash(filepath)
+        with self._lock:
+            self.state['files'][key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def dependencies(self, param):
+        """ {stage: set of the stages writing its inputs}"""
+        writers = dict()
+        for stage in self.stages.values():
+            for filepath in stage.output_files(param).values():
+                writers[os.path.abspath(filepath)] = stage.name
+        return dict((stage.name, set(writers[os.path.abspath(f)] for f in stage.input_files(param).values()
+                                     if os.path.abspath(f) in writers) - {stage.name})
+                    for stage in self.stages.values())
+
+    def order(self, param):
+        """ Stage names in a dependency order"""
+        dependencies = self.dependencies(param)
+        ordered = []
+        while len(ordered) < len(dependencies):
+            ready = [s for s in self.stages if s not in ordered and dependencies[s].issubset(ordered)]
+            if not ready:
+                raise ValueError('cycle between the stages: {}'.format(sorted(set(self.stages) - set(ordered))))
+            ordered += ready
+        return ordered
+
+    def stage_key(self, stage, param):
+        """ Hash of what the result of the stage depends on"""
+        missing = [p for p, f in stage.input_files(param).items() if not os.path.exists(f)]
+        if missing:
+            raise FileNotFoundError('{}: missing input {} ({}), run the stage writing it first'.format(
+                stage.name, ', '.join(missing), ', '.join(param[p] for p in missing)))
+        key = {
+            'inputs': dict((p, self.hash_file(f)) for p, f in stage.input_files(param).items()),
+            'params': dict((p, param.get(p)) for p in stage.params),
+            'sources': dict((s, self.hash_file(os.path.join(SOURCE_DIR, s))) for s in stage.sources),
+            'state': None if stage.state is None else stage.state(param),
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def is_up_to_date(self, stage, param, key):
+        with self._lock:
+            last_run = self.state['stages'].get(stage.name, {})
+        outputs = last_run.get('outputs', {})
+        return last_run.get('key') == key and all(
+            os.path.exists(f) and outputs.get(p) == self.hash_file(f) for p, f in stage.output_files(param).items())
+
+    def run_stage(self, stage, param, force=False):
+        """ Runs one stage (unless it is up to date), returns its run record"""
+        start = time.perf_counter()
+        key = self.stage_key(stage, param)
+        if not force and self.is_up_to_date(stage, param, key):
+            return {'stage': stage.name, 'status': 'skipped', 'sec': round(time.perf_counter() - start, 3)}
+
+        with TELEMETRY.span('stage', stage=stage.name):
+            stage.run(param)
+        sec = round(time.perf_counter() - start, 3)
+        outputs = dict((p, self.hash_file(f)) for p, f in stage.output_files(param).items() if os.path.exists(f))
+        with self._lock:
+            last_run = self.state['stages'].get(stage.name, {})
+            history = (last_run.get('history', []) + [{'finished_at': time.time(), 'sec': sec}])[-TIMING_HISTORY:]
+            self.state['stages'][stage.name] = {'key': key, 'outputs': outputs, 'history': history}
+            self.save_state()
+        return {'stage': stage.name, 'status': 'ran', 'sec': sec}
+
+    def run(self, param, names=None, force=(), workers=4, on_result=None):
+        """ Runs the stages `names` (all by default), each one after the selected stages it depends on
+
+        The stages which are not selected are not run, their outputs are used as they are.
+        `force`: stages to run even when up to date. A failed stage does not stop the
+        others, the stages depending on it are not run ('blocked').
+        Returns the run record of each stage: status (ran / skipped / failed / blocked), seconds.
+        """
+        names = self.order(param) if names is None else [s for s in self.order(param) if s in set(names)]
+        unknown = set(force).difference(self.stages)
+        if unknown:
+            raise KeyError('unknown stages: {}'.format(sorted(unknown)))
+        dependencies = dict((s, d.intersection(names)) for s, d in self.dependencies(param).items() if s in names)
+        records, running = dict(), dict()
+        progress = TELEMETRY.track('pipeline', total=len(names))
+
+        def finish(record):
+            records[record['stage']] = record
+            TELEMETRY.count('stages', status=record['status'])
+            TELEMETRY.emit(dict(record, type='stage'))
+            TELEMETRY.flush()
+            progress.advance(errors=int(record['status'] in ('failed', 'blocked')))
+            if on_result is not None:
+                on_result(record)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(records) < len(names):
+                for name in names:
+                    if name in records or name in running.values():
+                        continue
+                    if any(records.get(d, {}).get('status') in ('failed', 'blocked') for d in dependencies[name]):
+                        finish({'stage': name, 'status': 'blocked', 'sec': 0.0})
+                    elif all(d in records for d in dependencies[name]):
+                        running[executor.submit(self.run_stage, self.stages[name], param, name in force)] = name
+                if not running:
+                    continue
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        finish(future.result())
+                    except Exception as e:
+                        finish({'stage': name, 'status': 'failed', 'error': '{}: {}'.format(type(e).__name__, e)})
+        with self._lock:
+            self.save_state()
+        progress.finish()
+        return [records[s] for s in names]
+
+    def timings(self):
+        """ {stage: seconds of its last runs}"""
+        return dict((s, [r['sec'] for r in v.get('history', [])]) for s, v in self.state['stages'].items())
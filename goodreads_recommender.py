@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Recommender
+
+Recommends books of the to-read shelf (feature 4): each book is a vector of its genres, my
+taste profile is the sum of the vectors of the books I rated, and the to-read books are
+ranked by their cosine similarity with the profile.
+
+    genre vectors: TF-IDF of the clean genre list. The genres of a book are ordered by the
+                   number of readers who shelved it under them, tf = 1 / log2(position + 2);
+                   idf = log((1 + books) / (1 + books with the genre)) + 1
+    taste profile: vectors of the rated books, weighted by (My Rating - 3) + (My Rating - Average Rating),
+                   so a book I liked more than the other readers counts more, a book I
+                   disliked counts against its genres
+    score: cosine(profile, book) x (Average Rating / 5)
+
+The vectors are a CSR matrix in plain numpy arrays (no scipy, nothing downloaded). Queries
+score the candidates BLOCK_ROWS books at a time and keep a running top k, so several
+profiles (e.g. one per book, for "more like this") can be scored at once in flat memory.
+
+GenreVectors keep the raw term frequencies and a hash of the genre list of each book: when
+the consolidated dataset changes, update() only encodes the new or changed books, the IDF
+and the norms are recomputed from the frequencies (vectorized). The vectors of a dataset
+are stored next to it ([DATA FILE].recommender.npz).
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from goodreads_consolidation import genre_strings
+from goodreads_storage import data_version, read_consolidated
+
+BLOCK_ROWS = 16384
+RECOMMENDER_COLUMNS = ['Book Id', 'Title', 'Author', 'Exclusive Shelf', 'My Rating', 'Average Rating', 'clean_genre_list']
+
+
+def split_genres(clean_genre_list):
+    """ Stringified clean genre lists ("['A', 'B']") -> lists of genres"""
+    genre_str = genre_strings(pd.Series(clean_genre_list, dtype=object))
+    return genre_str.str.split(', ').where(genre_str != '', pd.Series([[]] * len(genre_str), index=genre_str.index))
+
+
+def genre_hashes(clean_genre_list):
+    return pd.util.hash_pandas_object(genre_strings(pd.Series(clean_genre_list, dtype=object)), index=False).to_numpy()
+
+
+def csr_positions(indptr, rows):
+    """ Positions (in indices / data) of the non-zeros of the given rows, row after row"""
+    starts, lengths = indptr[rows], indptr[rows + 1] - indptr[rows]
+    return np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+
+
+class GenreVectors:
+    """ Genre term frequencies of the books (CSR, rows in the order of book_ids)"""
+
+    def __init__(self, book_ids, hashes, genres, indptr, indices, tf, version=''):
+        self.book_ids = book_ids
+        self.hashes = hashes
+        self.genres = genres
+        self.indptr = indptr
+        self.indices = indices
+        self.tf = tf
+        self.version = version
+
+    @classmethod
+    def encode(cls, book_ids, clean_genre_list, genres=None):
+        """ Vectors of the given books; `genres` is the vocabulary to extend (new genres are appended)"""
+        genre_lists = split_genres(clean_genre_list)
+        lengths = genre_lists.str.len().to_numpy(dtype=np.int64)
+        exploded = genre_lists.explode().dropna()
+        vocabulary = pd.Index(genres if genres is not None else [], dtype=object)
+        vocabulary = vocabulary.append(pd.Index(exploded.unique(), dtype=object).difference(vocabulary, sort=False))
+        positions = np.arange(len(exploded)) - np.repeat(np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        return cls(np.asarray(book_ids, dtype=np.int64), genre_hashes(clean_genre_list),
+                   vocabulary.to_numpy(dtype=object),
+                   np.r_[0, np.cumsum(lengths)].astype(np.int64),
+                   vocabulary.get_indexer(exploded).astype(np.int32),
+                   (1 / np.log2(positions + 2)).astype(np.float32))
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    @property
+    def nbytes(self):
+        return int(self.book_ids.nbytes + self.hashes.nbytes + self.indptr.nbytes + self.indices.nbytes
+                   + self.tf.nbytes + sum(len(g) for g in self.genres))
+
+    def take(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        positions = csr_positions(self.indptr, rows)
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        return GenreVectors(self.book_ids[rows], self.hashes[rows], self.genres,
+                            np.r_[0, np.cumsum(lengths)].astype(np.int64),
+                            self.indices[positions], self.tf[positions], self.version)
+
+    def update(self, book_ids, clean_genre_list, version=''):
+        """ Vectors of the given books, only the new books or the ones whose genres changed
+        are encoded. Returns (vectors, number of books encoded)
+        """
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        hashes = genre_hashes(clean_genre_list)
+        rows = pd.Index(self.book_ids).get_indexer(book_ids)
+        unchanged = rows >= 0
+        unchanged[unchanged] = self.hashes[rows[unchanged]] == hashes[unchanged]
+        changed = np.flatnonzero(~unchanged)
+
+        kept = self.take(rows[unchanged])
+        encoded = GenreVectors.encode(book_ids[changed], pd.Series(clean_genre_list, dtype=object).iloc[changed],
+                                      self.genres)
+        # kept rows first, then the encoded ones, reordered like `book_ids`
+        merged = GenreVectors(np.r_[kept.book_ids, encoded.book_ids], np.r_[kept.hashes, encoded.hashes],
+                              encoded.genres, np.r_[kept.indptr[:-1], kept.indptr[-1] + encoded.indptr],
+                              np.r_[kept.indices, encoded.indices], np.r_[kept.tf, encoded.tf], version)
+        order = np.argsort(np.r_[np.flatnonzero(unchanged), changed], kind='stable')
+        return merged.take(order), len(changed)
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as file:
+            np.savez(file, book_ids=self.book_ids, hashes=self.hashes, genres=self.genres.astype(str),
+                     indptr=self.indptr, indices=self.indices, tf=self.tf, version=np.array(self.version))
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as npz:
+            return cls(npz['book_ids'], npz['hashes'], npz['genres'].astype(object), npz['indptr'],
+                       npz['indices'], npz['tf'], str(npz['version']))
+
+    def normalized(self, row_weights=None):
+        """ TF-IDF values, each row of unit norm (times its weight)"""
+        row_of = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        df = np.bincount(self.indices, minlength=len(self.genres))
+        idf = (np.log((1 + len(self)) / (1 + df)) + 1).astype(np.float32)
+        data = self.tf * idf[self.indices]
+        norms = np.sqrt(np.bincount(row_of, weights=data ** 2, minlength=len(self)))
+        scale = np.divide(1, norms, out=np.zeros_like(norms), where=norms > 0)
+        if row_weights is not None:
+            scale = scale * row_weights
+        return (data * scale[row_of]).astype(np.float32)
+
+
+def blocked_top_k(indptr, indices, data, queries, k, candidates=None, block_rows=BLOCK_ROWS):
+    """ k best rows of the CSR matrix for each query (dense queries x columns), by dot product
+
+    The matrix is scored block_rows contiguous rows at a time (slices, no gather of the
+    non-zeros), the best candidates of each block are merged with the running top k.
+    candidates: boolean mask of the rows to rank (all rows if None). Returns (rows, scores),
+    both queries x k (x fewer when there are less than k candidates), best first.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    n_rows = len(indptr) - 1
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    columns = queries.T
+    for start in range(0, n_rows, block_rows):
+        end = min(start + block_rows, n_rows)
+        rows = np.arange(start, end) if candidates is None else start + np.flatnonzero(candidates[start:end])
+        if len(rows) == 0:
+            continue
+        # (non-zeros x queries) products summed per row: one reduceat over the non-empty rows
+        low, high = indptr[start], indptr[end]
+        products = data[low:high, None] * columns[indices[low:high]]
+        lengths = np.diff(indptr[start:end + 1])
+        scores = np.zeros((end - start, len(queries)), dtype=np.float32)
+        if high > low:
+            scores[lengths > 0] = np.add.reduceat(products, indptr[start:end][lengths > 0] - low, axis=0)
+        scores = scores[rows - start]
+        best_rows = np.hstack([best_rows, np.broadcast_to(rows, (len(queries), len(rows)))])
+        best_scores = np.hstack([best_scores, scores.T])
+        if best_rows.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_rows, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+class Recommender:
+    """ Taste profile and ranking of the books of a library (RECOMMENDER_COLUMNS)"""
+
+    def __init__(self, vectors, books):
+        books = books.reset_index(drop=True)
+        rows = pd.Index(vectors.book_ids).get_indexer(books['Book Id'])
+        self.vectors = vectors.take(rows)
+        self.books = books
+        self.data = self.vectors.normalized()
+        average_rating = books['Average Rating'].fillna(0).to_numpy(dtype=np.float32)
+        self.ranking_data = self.vectors.normalized(average_rating / 5)
+        self.shelves = books['Exclusive Shelf'].astype(str).to_numpy()
+        self.taste_profile = None
+
+    @property
+    def nbytes(self):
+        return int(self.vectors.nbytes + self.data.nbytes + self.ranking_data.nbytes
+                   + self.books.memory_usage(index=True, deep=True).sum())
+
+    def profile(self, book_rows=None):
+        """ Unit taste profile (dense, one value per genre) of the rated books, or of the given books"""
+        if book_rows is None:
+            my_rating = self.books['My Rating'].fillna(0).to_numpy(dtype=np.float32)
+            weights = (my_rating - 3) + (my_rating - self.books['Average Rating'].fillna(0).to_numpy(dtype=np.float32))
+            weights[my_rating == 0] = 0
+        else:
+            weights = np.zeros(len(self.books), dtype=np.float32)
+            weights[book_rows] = 1
+        row_of = np.repeat(np.arange(len(self.books)), np.diff(self.vectors.indptr))
+        profile = np.bincount(self.vectors.indices, weights=self.data * weights[row_of],
+                              minlength=len(self.vectors.genres)).astype(np.float32)
+        norm = np.linalg.norm(profile)
+        return profile / norm if norm > 0 else profile
+
+    def top_genres(self, profile, row, n=3):
+        """ Genres of the book that weigh the most in its score"""
+        positions = np.arange(self.vectors.indptr[row], self.vectors.indptr[row + 1])
+        contributions = self.data[positions] * profile[self.vectors.indices[positions]]
+        best = np.argsort(-contributions, kind='stable')[:n]
+        best = best[contributions[best] > 0]
+        return ', '.join(self.vectors.genres[self.vectors.indices[positions[best]]])
+
+    def rank(self, profiles, k=20, shelf='to-read', exclude_rows=None):
+        """ (rows, scores) of the k best books of `shelf` (of any shelf if None) for each profile"""
+        candidates = None if shelf is None else self.shelves == shelf
+        if exclude_rows is not None:
+            candidates = np.ones(len(self.books), dtype=bool) if candidates is None else candidates.copy()
+            candidates[exclude_rows] = False
+        return blocked_top_k(self.vectors.indptr, self.vectors.indices, self.ranking_data, profiles, k, candidates)
+
+    def recommend(self, k=20, shelf='to-read', like_book_id=None):
+        """ k best books of `shelf` for my taste profile, or for one book ("more like this")"""
+        if like_book_id is None:
+            if self.taste_profile is None:
+                self.taste_profile = self.profile()
+            profile = self.taste_profile
+            rows, scores = self.rank(profile, k, shelf)
+        else:
+            book_rows = np.flatnonzero(self.books['Book Id'].to_numpy() == like_book_id)
+            profile = self.profile(book_rows)
+            rows, scores = self.rank(profile, k, shelf, exclude_rows=book_rows)
+        rows, scores = rows[0], scores[0]
+        recommended = self.books.iloc[rows][['Book Id', 'Title', 'Author', 'Average Rating']].reset_index(drop=True)
+        recommended['score'] = np.round(scores, 4)
+        recommended['because_of'] = [self.top_genres(profile, r) for r in rows]
+        return recommended
+
+
+def load_vectors(data_filepath, books):
+    """ Genre vectors of the books of the dataset, from [DATA FILE].recommender.npz: stored as is
+    for the current data version, updated (and stored) for a new one
+    """
+    vectors_filepath = '{}.recommender.npz'.format(data_filepath)
+    version = data_version(data_filepath)
+    vectors = GenreVectors.load(vectors_filepath) if os.path.exists(vectors_filepath) else None
+    if vectors is not None and vectors.version == version:
+        return vectors
+    if vectors is None:
+        vectors = GenreVectors.encode(books['Book Id'], books['clean_genre_list'])
+        vectors.version = version
+    else:
+        vectors, n_encoded = vectors.update(books['Book Id'], books['clean_genre_list'], version)
+    vectors.save(vectors_filepath)
+    return vectors
+
+
+def load_recommender(data_filepath):
+    books = read_consolidated(data_filepath, columns=RECOMMENDER_COLUMNS)
+    return Recommender(load_vectors(data_filepath, books), books)
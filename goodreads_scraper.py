@@ -4,15 +4,42 @@
 Created on Sun May  1 19:50:17 2022
 
 @author: hayyu.hanifah
+
+Scraping and consolidation pipeline, as a graph of stages (see goodreads_pipeline):
+    highlights: public highlights -> highlight_filepath
+    genres: book pages of the library export (new or stale ones) -> genre_cache_filepath
+    genre-clean: genres of the library books -> clean_genre_filepath
+    highlight-index: highlights + genres -> highlight_index_filepath
+    timeline: reading timelines of the reviews -> timeline_filepath, timeline_book_id_filepath
+    consolidate: library export + genres + timelines -> consolidated_data_filepath
+
+Run all the stages, or some of them, with:
+    python goodreads_scraper.py [STAGE ...] [--force STAGE ...] [--workers N]
+
+Up-to-date stages are skipped: changing a consolidation rule only runs consolidate again.
+The crawl stages (highlights, genres, timeline) run in parallel and share one rate limit
+and concurrency limit per host (goodreads_fetcher.host_limits). genres also runs again
+when some books are still to crawl: new in the export, older than genre_cache_ttl_days,
+or failed on the last run. A crawl with failed pages fails its stage (the stages after it
+are not run), so the next run fetches them again. Use --force to crawl again stages whose
+inputs did not change.
+
+Telemetry (goodreads_telemetry): the page fetch / parse / popup closing times, the pages
+and errors of each crawl, the consolidation steps and the stage runs are logged to
+telemetry_log_filepath (JSONL, default telemetry.jsonl in CONDA_PREFIX), with the
+progress and ETA of the crawls. With telemetry_prometheus_port set, they are also served
+on http://127.0.0.1:[PORT]/metrics while the pipeline runs. The Crawl section of the
+dashboard starts the pipeline (CrawlRunner) and follows its progress from that log.
 """
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import argparse
+import hashlib
+import subprocess
+import sys
 import time
 
 from bs4 import BeautifulSoup
@@ -21,22 +48,42 @@ import requests
 import pandas as pd
 import json
 import os
+from urllib.parse import urljoin
+
+from goodreads_cache import PageCache
+from goodreads_consolidation import clean_genre_table, consolidate, timeline_events
+from goodreads_fetcher import (Fetcher, close_popup_windows, host_limits, http_page_loader, make_http_session,
+                               scroll_to_end, selenium_page_loader, wait_for_page)
+from goodreads_highlights import HighlightIndex
+from goodreads_ingest import cache_genre_index, consolidate_stream, read_book_ids
+from goodreads_matching import TitleIndex, match_report
+from goodreads_parsers import parse_book_genres, parse_book_timeline, parse_review_book_id
+from goodreads_pipeline import Pipeline, Stage
+from goodreads_storage import write_consolidated
+from goodreads_telemetry import MAX_LOG_BYTES, LogFollower, configure, count, span, track
 
 def selenium_find_elements(driver, url, by_id, by_value):
-    driver.get(url)
-    time.sleep(10)
-    if by_id == 'class':
-        e_list = driver.find_elements(by=By.CLASS_NAME, value=by_value)
-    # TODO: implement find elements by other identifiers
+    with span('fetch', source='selenium_find_elements'):
+        driver.get(url)
+        if by_id == 'class':
+            wait_for_page(driver, By.CLASS_NAME, by_value)
+    with span('parse', source='selenium_find_elements'):
+        if by_id == 'class':
+            e_list = driver.find_elements(by=By.CLASS_NAME, value=by_value)
+        # TODO: implement find elements by other identifiers
+    count('pages', source='selenium_find_elements', status='ok')
     return e_list
 
-def bs_find_all(url, tag_string, attrs, headers=''):
-    if headers == '':
-        page_source = requests.get(url).content
-    else:
-        page_source = requests.get(url, headers=headers).content
-    page_soup = BeautifulSoup(page_source, "lxml")
-    elements = page_soup.find_all(tag_string, attrs=attrs)
+def bs_find_all(url, tag_string, attrs, headers='', session=requests):
+    with span('fetch', source='bs_find_all'):
+        if headers == '':
+            page_source = session.get(url).content
+        else:
+            page_source = session.get(url, headers=headers).content
+    with span('parse', source='bs_find_all'):
+        page_soup = BeautifulSoup(page_source, "lxml")
+        elements = page_soup.find_all(tag_string, attrs=attrs)
+    count('pages', source='bs_find_all', status='ok')
     return elements
 
 def get_dict_from_file(filepath):
@@ -46,217 +93,332 @@ def get_dict_from_file(filepath):
     json_dict = json.loads(json_str)
     return json_dict
 
-def convert_str_list(row_df,str_col):
-    clean_str = row_df[str_col].replace('[','').replace(']','').replace("'","")
-    str_list = clean_str.split(", ")
-    return str_list
-
-def get_timeline_date(row_df,str_col,substr_timeline):
-    current_timelines = row_df[str_col]
-    dt_list = []
-    for t in current_timelines:
-        if substr_timeline in t:
-            dt = t.replace(substr_timeline,'').strip()
-            dt_list.append(dt)
-    return dt_list
-
-def check_is_genre(row_df,str_col,genre_str):
-    current_genre_list = row_df[str_col]
-    if genre_str in current_genre_list:
-        return 1
+def print_crawl_result(url, result, error):
+    print(url)
+    print(result if error is None else error)
+
+def write_dict_to_file(json_dict, filepath):
+    with open(filepath, 'w') as convert_file:
+          convert_file.write(json.dumps(json_dict))
+
+# Scraping backend
+## http: pooled requests.Session + lxml for static pages, selenium: headless Chrome
+def make_page_loader(param, wait_class, drivers):
+    """ Page loader of the configured backend, the Chrome drivers it starts are added to `drivers`"""
+    crawl_concurrency = param.get('crawl_concurrency', 2)
+    if param.get('scrape_backend', 'http') == 'selenium':
+        options = Options()
+        options.headless = True
+        drivers += [webdriver.Chrome(service=Service(param['chromedriver_path']), options=options)
+                    for i in range(crawl_concurrency)]
+        return selenium_page_loader(drivers, wait_class=wait_class)
+    return http_page_loader(make_http_session(pool_size=crawl_concurrency))
+
+def make_fetcher(param, load_page, on_result, name):
+    crawl_concurrency = param.get('crawl_concurrency', 2)
+    return Fetcher(load_page,
+                   name=name,
+                   workers=crawl_concurrency,
+                   max_per_host=crawl_concurrency,
+                   rate=param.get('crawl_rate_per_sec', 1.0),
+                   retries=param.get('crawl_retries', 3),
+                   on_result=on_result)
+
+def quit_drivers(drivers):
+    for driver in drivers:
+        driver.quit()
+
+# STAGES
+def crawl_highlights(param):
+    """ Get the list of books with public highlights, then the highlighted sentences of each book"""
+    highlight_lp_url = param['highlight_lp_url']
+    http_session = make_http_session(pool_size=param.get('crawl_concurrency', 2))
+    if param.get('scrape_backend', 'http') == 'selenium':
+        options = Options()
+        options.headless = True
+        driver = webdriver.Chrome(service=Service(param['chromedriver_path']), options=options)
+        try:
+            book_list = selenium_find_elements(driver, highlight_lp_url, 'class', 'annotatedBookItem__knhLink')
+            highlight_link_list = [l.get_attribute("href") for l in book_list]
+        finally:
+            driver.quit()
     else:
-        return 0
-    
-def exclude_genre(row_df,str_col,genre_str):
-    current_genre_list = row_df[str_col]
-    genre = [x for x in current_genre_list if x != genre_str]
-    return genre
-
-# LOAD PARAMETERS FILE
-working_dir_path = os.environ['CONDA_PREFIX']
-param = get_dict_from_file(os.path.join(working_dir_path,'parameters.json'))
-
-# Setup Selenium
-s = Service(param['chromedriver_path'])
-driver = webdriver.Chrome(service=s)
-
-# Get the list of books with public highlights
-highlight_lp_url = param['highlight_lp_url']
-book_list = selenium_find_elements(driver, highlight_lp_url, 'class', 'annotatedBookItem__knhLink')
-print(len(book_list))
-
-highlight_dict = dict()
-
-for l in book_list:
-    # For each book, get the list of hightlighted sentences
-    current_h_link = l.get_attribute("href")
-    print(current_h_link)
-    highlight_list = bs_find_all(current_h_link, 'div', attrs={"class":"noteHighlightTextContainer__highlightText"})
-    hl_text_list = []
-    
-    for hl in highlight_list:
-        print(hl.find('span').text)
-        hl_text_list.append(hl.find('span').text)
-    
-    # highlight_dict[current_h_link] = hl_text_list
-    highlight_dict[l] = hl_text_list
-    
-print(highlight_dict)
-with open(param['highlight_filepath'], 'w') as convert_file:
-      convert_file.write(json.dumps(highlight_dict))
-
-# Get the top shelves of each book from Genre section
-options = Options()
-options.headless = True
-book_driver = webdriver.Chrome(service=s,options=options)
-executor_url = book_driver.command_executor._url
-session_id = book_driver.session_id
-
-print(session_id)
-print(executor_url)
-
-book_df = pd.read_csv(param['gr_library_export_filepath'])
-book_id_list = book_df['Book Id'].tolist()
-url_prefix = 'https://www.goodreads.com/book/show/'
-
-books_dict = dict()
-for bid in book_id_list[100:312]:  ## crawl the genre in batches
-    print(bid)
-    current_href = url_prefix + str(bid)
-    book_driver.get(current_href)
-    time.sleep(7)
-    parent = book_driver.current_window_handle
-    uselessWindows = book_driver.window_handles
-    for winId in uselessWindows:
-        if winId != parent: 
-            book_driver.switch_to.window(winId)
-            book_driver.close()
-            
-    book_soup = BeautifulSoup(book_driver.page_source, "html.parser")
-    genre_list = book_soup.find_all('div',attrs={'class':'elementList'})
-    print([x.find('a').text for x in genre_list])
-    books_dict[str(bid)] = [x.find('a').text for x in genre_list]
-
-with open(param['genre_filepath_3'], 'w') as convert_file:
-      convert_file.write(json.dumps(books_dict))
-
-# Concat book genre files
-genre_1 = get_dict_from_file(param['genre_filepath_1'])
-genre_2 = get_dict_from_file(param['genre_filepath_2'])
-genre_3 = get_dict_from_file(param['genre_filepath_3'])
-
-genre_1.update(genre_2) # it is safe since there are no overlap keys between 2 dicts
-genre_1.update(genre_3)
-
-print(len(genre_1))
-print(genre_1)
-
-book_id_list = [k for k,v in genre_1.items()]
-book_genre_list = [v for k,v in genre_1.items()]
-
-genre_df = pd.DataFrame.from_dict({'book_id': book_id_list, 'book_genre': book_genre_list})
-
-def clean_genre_list(row_df, genre_col):
-    raw_list = [x for x in row_df[genre_col] if x != '']
-    return sorted(set(raw_list), key=raw_list.index)
-
-genre_df['clean_genre_list'] = genre_df.apply(lambda r: clean_genre_list(r, 'book_genre'), axis=1)
-    
-genre_df.to_csv(param['clean_genre_filepath'],index=False)
-
-# Get book timeline details 
-## Get review list, to get the link to review detail pages
-review_driver = webdriver.Chrome(service=s)
-review_driver.get(param['review_lp_url'])
-time.sleep(7)
-parent = book_driver.current_window_handle
-uselessWindows = book_driver.window_handles
-for winId in uselessWindows:
-    if winId != parent: 
-        book_driver.switch_to.window(winId)
-        book_driver.close()
-for i in range(15): # simulate scroll, to load all the review items
-    review_driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-    time.sleep(4)
-
-review_soup = BeautifulSoup(review_driver.page_source, "html.parser")
-review_list = review_soup.find_all('td',attrs={'class':'field actions'})
-review_link_list = [x.find('a').attrs['href'] for x in review_list]
-
-print(review_link_list)
-
-review_url_prefix = 'https://www.goodreads.com'
-timeline_dict = dict()
-for r in review_link_list:
-    book_driver.get(review_url_prefix+r)
-    time.sleep(7)
-    parent = book_driver.current_window_handle
-    uselessWindows = book_driver.window_handles
-    for winId in uselessWindows:
-        if winId != parent: 
-            book_driver.switch_to.window(winId)
-            book_driver.close()
-    
-    book_soup = BeautifulSoup(book_driver.page_source, "html.parser")
-    book_title = book_soup.find('h1').text.replace("Hayyu Hanifah's Reviews > ","")
-    book_timeline = book_soup.find_all('div', attrs={'class':'readingTimeline__text'})
-    book_timeline_list = [x.text.strip().replace('\n',' ') for x in book_timeline]
-    timeline_dict[book_title] = book_timeline_list
-    
-print(timeline_dict)
-with open(param['timeline_filepath'], 'w') as convert_file:
-      convert_file.write(json.dumps(timeline_dict))
-
-### CONSOLIDATE ALL DATASET
-goodreads_lib_export = pd.read_csv(param['gr_library_export_filepath'])
-book_genre_df = pd.read_csv(param['clean_genre_filepath'])
-timeline = get_dict_from_file(param['timeline_filepath'])
-
-consolidate_df = goodreads_lib_export.merge(book_genre_df, how='left', left_on='Book Id', right_on='book_id')
-consolidate_df.drop(columns=['book_id', 'book_genre'],inplace=True)
-
-consolidate_df['date_read'] = pd.to_datetime(consolidate_df['Date Read'])
-consolidate_df['date_added'] = pd.to_datetime(consolidate_df['Date Added'])
-consolidate_df['Title_shorten'] = consolidate_df.apply(lambda x: x['Title'].split(" (")[0].strip() if x['Title'].endswith(")") else x['Title'].strip(), axis=1)
-
-book_title = [k for k,v in timeline.items()]
-timelines = [v for k,v in timeline.items()]
-book_timeline_df = pd.DataFrame(data={'book_title': book_title, 'timelines': timelines})
-book_timeline_df['add_to_tbr'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','– Shelved as: to-read'), axis=1)
-book_timeline_df['start_reading'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','–  Started Reading'), axis=1)
-book_timeline_df['finish_reading'] = book_timeline_df.apply(lambda x: get_timeline_date(x,'timelines','–  Finished Reading'), axis=1)
-
-book_timeline_df['add_to_tbr_dt_len'] = book_timeline_df.apply(lambda x: len(x['add_to_tbr']),axis=1)
-book_timeline_df['start_reading_dt_len'] = book_timeline_df.apply(lambda x: len(x['start_reading']),axis=1)
-book_timeline_df['finish_reading_dt_len'] = book_timeline_df.apply(lambda x: len(x['finish_reading']),axis=1)
-
-book_timeline_df[book_timeline_df['finish_reading_dt_len'] > 1]
-
-# df.A.map(lambda x: x[0])
-book_timeline_df['add_to_tbr_dt'] = book_timeline_df.add_to_tbr.map(lambda x: x[0] if len(x) == 1 else '')
-book_timeline_df['start_reading_dt'] = book_timeline_df.start_reading.map(lambda x: x[0] if len(x) == 1 else '')
-book_timeline_df['finish_reading_dt'] = book_timeline_df.finish_reading.map(lambda x: x[0] if len(x) == 1 else '')
-
-book_timeline_df.drop(columns=['add_to_tbr','start_reading','finish_reading','add_to_tbr_dt_len','start_reading_dt_len','finish_reading_dt_len'],inplace=True)
-
-consolidate_df = consolidate_df.merge(book_timeline_df, how='left', left_on='Title_shorten', right_on='book_title')
-
-consolidate_df['add_to_tbr_dt'] = pd.to_datetime(consolidate_df['add_to_tbr_dt'], infer_datetime_format=True)
-consolidate_df['start_reading_dt'] = pd.to_datetime(consolidate_df['start_reading_dt'], infer_datetime_format=True)
-consolidate_df['finish_reading_dt'] = pd.to_datetime(consolidate_df['finish_reading_dt'], infer_datetime_format=True)
-
-consolidate_df.dropna(axis=1, how='all', inplace=True) # drop all columns which only consist of NaN value
-
-consolidate_df['genre_list'] = consolidate_df.apply(lambda x: convert_str_list(x,'clean_genre_list'), axis=1)
-
-consolidate_df['is_nonfiction'] = consolidate_df.apply(lambda x: check_is_genre(x,'genre_list','Nonfiction'), axis=1)
-consolidate_df['is_fiction'] = consolidate_df.apply(lambda x: check_is_genre(x,'genre_list','Fiction'), axis=1)
-
-consolidate_df['genre_list_trf'] = consolidate_df.apply(lambda x: exclude_genre(x,'genre_list','Nonfiction'), axis=1)
-consolidate_df['genre_list_trf'] = consolidate_df.apply(lambda x: exclude_genre(x,'genre_list_trf','Fiction'), axis=1)
-
-consolidate_df['year_read'], consolidate_df['month_read'] = consolidate_df['date_read'].dt.year, consolidate_df['date_read'].dt.month
-consolidate_df['year_added'], consolidate_df['month_added'] = consolidate_df['date_added'].dt.year, consolidate_df['date_added'].dt.month
-
-consolidate_df.to_csv(param['consolidated_data_filepath'], index=False)
-
+        book_list = bs_find_all(highlight_lp_url, 'a', attrs={"class":"annotatedBookItem__knhLink"}, session=http_session)
+        highlight_link_list = [urljoin(highlight_lp_url, l.attrs['href']) for l in book_list]
+    print(len(highlight_link_list))
+
+    highlight_dict = dict()
+    with track('highlights', total=len(highlight_link_list)) as progress:
+        for current_h_link in highlight_link_list:
+            # For each book, get the list of hightlighted sentences
+            print(current_h_link)
+            ## same per-host limits as the genre / timeline crawls running next to this one
+            host_limit, host_bucket = host_limits(current_h_link, param.get('crawl_concurrency', 2),
+                                                  param.get('crawl_rate_per_sec', 1.0))
+            with host_limit:
+                host_bucket.wait()
+                highlight_list = bs_find_all(current_h_link, 'div', attrs={"class":"noteHighlightTextContainer__highlightText"}, session=http_session)
+            hl_text_list = []
+
+            for hl in highlight_list:
+                print(hl.find('span').text)
+                hl_text_list.append(hl.find('span').text)
+
+            highlight_dict[current_h_link] = hl_text_list
+            progress.advance()
+
+    print(highlight_dict)
+    write_dict_to_file(highlight_dict, param['highlight_filepath'])
+
+def crawl_genres(param):
+    """ Get the top shelves of each book from Genre section, only for the books which are new or stale
+
+    Every page is cached as soon as it is parsed.
+    """
+    book_id_list = read_book_ids(param['gr_library_export_filepath'])
+    url_prefix = 'https://www.goodreads.com/book/show/'
+    page_cache = PageCache(param['genre_cache_filepath'], ttl_days=param.get('genre_cache_ttl_days', 30))
+    book_urls = {url_prefix + bid: bid for bid in page_cache.stale_ids(book_id_list)}
+    print(len(book_urls))
+
+    def cache_book_page(url, result, error):
+        print_crawl_result(url, None if result is None else result[1], error)
+        if error is None:
+            page_cache.put(book_urls[url], url, result[0], result[1])
+
+    drivers = []
+    try:
+        book_fetcher = make_fetcher(param, make_page_loader(param, 'elementList', drivers), cache_book_page, 'genres')
+        book_genres, failed_urls = book_fetcher.fetch_all(book_urls.keys(), lambda p: (p, parse_book_genres(p)))
+        print(failed_urls)
+    finally:
+        quit_drivers(drivers)
+        page_cache.close()
+    ## the fetched pages are cached already, only the failed ones are crawled on the next run
+    raise_failed_urls(failed_urls)
+
+def genre_crawl_state(param):
+    """ Key state of the genres stage: the books still to crawl (new, past the TTL, or failed)"""
+    if not os.path.exists(param['genre_cache_filepath']):
+        return None
+    page_cache = PageCache(param['genre_cache_filepath'], ttl_days=param.get('genre_cache_ttl_days', 30))
+    try:
+        stale_ids = page_cache.stale_ids(read_book_ids(param['gr_library_export_filepath']))
+    finally:
+        page_cache.close()
+    return hashlib.sha256(json.dumps(sorted(str(b) for b in stale_ids)).encode()).hexdigest()
+
+def raise_failed_urls(failed_urls):
+    """ Fails the stage when some pages could not be fetched, so the next run crawls them again"""
+    if failed_urls:
+        raise RuntimeError('{} pages failed, e.g. {}'.format(
+            len(failed_urls), '; '.join('{}: {}'.format(u, e) for u, e in list(failed_urls.items())[:3])))
+
+def clean_genres(param):
+    """ Clean genre table of the books of the library export, from the page cache"""
+    page_cache = PageCache(param['genre_cache_filepath'], ttl_days=param.get('genre_cache_ttl_days', 30))
+    genre_dict = page_cache.genre_dict(read_book_ids(param['gr_library_export_filepath']))
+    page_cache.close()
+    print(len(genre_dict))
+
+    genre_df = clean_genre_table(genre_dict)
+    genre_df.to_csv(param['clean_genre_filepath'],index=False)
+
+def index_highlights(param):
+    """ Highlight term index: only the highlights which are not indexed yet are tokenized"""
+    highlight_index = HighlightIndex(param['highlight_index_filepath'])
+    try:
+        print(highlight_index.add_highlight_dict(get_dict_from_file(param['highlight_filepath'])))
+        page_cache = PageCache(param['genre_cache_filepath'], ttl_days=param.get('genre_cache_ttl_days', 30))
+        highlight_index.set_book_genres(page_cache.genre_dict(read_book_ids(param['gr_library_export_filepath'])))
+        page_cache.close()
+    finally:
+        highlight_index.close()
+
+def crawl_timeline(param):
+    """ Get book timeline details
+
+    Get review list, to get the link to review detail pages. The list is an infinite-scroll
+    page, so it always needs a browser.
+    """
+    review_driver = webdriver.Chrome(service=Service(param['chromedriver_path']))
+    try:
+        with span('fetch', source='review_list'):
+            review_driver.get(param['review_lp_url'])
+            wait_for_page(review_driver, By.CLASS_NAME, 'field')
+            close_popup_windows(review_driver)
+            scroll_to_end(review_driver) # simulate scroll, to load all the review items
+            review_page_source = review_driver.page_source
+    finally:
+        review_driver.quit()
+    with span('parse', source='review_list'):
+        review_soup = BeautifulSoup(review_page_source, "html.parser")
+        review_list = review_soup.find_all('td',attrs={'class':'field actions'})
+        review_link_list = [x.find('a').attrs['href'] for x in review_list]
+
+    print(review_link_list)
+
+    review_url_prefix = 'https://www.goodreads.com'
+    drivers = []
+    try:
+        review_fetcher = make_fetcher(param, make_page_loader(param, 'readingTimeline__text', drivers), print_crawl_result,
+                                      'timeline')
+        ## the Book Id of the review page is kept as well, so the timeline joins the library on it
+        review_timelines, failed_urls = review_fetcher.fetch_all([review_url_prefix + r for r in review_link_list],
+                                                                 lambda p: parse_book_timeline(p) + (parse_review_book_id(p),))
+    finally:
+        quit_drivers(drivers)
+    timeline_dict = {title: timeline for title, timeline, book_id in review_timelines.values()}
+    timeline_book_id_dict = {title: book_id for title, timeline, book_id in review_timelines.values() if book_id}
+    print(failed_urls)
+
+    print(timeline_dict)
+    write_dict_to_file(timeline_dict, param['timeline_filepath'])
+    write_dict_to_file(timeline_book_id_dict, param['timeline_book_id_filepath'])
+    raise_failed_urls(failed_urls)
+
+def consolidate_data(param):
+    """ CONSOLIDATE ALL DATASET"""
+    timeline = get_dict_from_file(param['timeline_filepath'])
+    timeline_book_ids = get_dict_from_file(param['timeline_book_id_filepath'])
+
+    ## long event table (every shelf event and every read, also the re-reads)
+    if param.get('timeline_events_filepath'):
+        with span('consolidate', step='timeline_events'):
+            timeline_events(timeline).to_parquet(param['timeline_events_filepath'], index=False)
+
+    ## how many books get their timeline, and through which matching tier
+    with span('consolidate', step='match_report'):
+        title_index = TitleIndex(list(timeline.keys()), [timeline_book_ids.get(t) for t in timeline])
+        library_titles = pd.read_csv(param['gr_library_export_filepath'], usecols=['Book Id', 'Title'])
+        print(match_report(title_index.match(library_titles['Title'], library_titles['Book Id']), title_index))
+
+    if param.get('ingest_chunk_rows'):
+        ## streaming mode for very large libraries: the export is consolidated chunk by chunk,
+        ## with the genres looked up in the page cache, so the memory stays flat
+        page_cache = PageCache(param['genre_cache_filepath'], ttl_days=param.get('genre_cache_ttl_days', 30))
+        consolidate_stream(param['gr_library_export_filepath'], cache_genre_index(page_cache), timeline,
+                           param['consolidated_data_filepath'], chunk_rows=param['ingest_chunk_rows'],
+                           timeline_book_ids=timeline_book_ids)
+        page_cache.close()
+    else:
+        with span('consolidate', step='read'):
+            goodreads_lib_export = pd.read_csv(param['gr_library_export_filepath'])
+            book_genre_df = pd.read_csv(param['clean_genre_filepath'])
+
+        consolidate_df = consolidate(goodreads_lib_export, book_genre_df, timeline, timeline_book_ids)
+        with span('consolidate', step='write'):
+            write_consolidated(consolidate_df, param['consolidated_data_filepath']) # .parquet keeps the column types
+
+## Inputs / outputs are the parameters holding the file paths, the graph follows from them
+CRAWL_PARAMS = ('scrape_backend', 'crawl_concurrency')
+STAGES = [
+    Stage('highlights', crawl_highlights, outputs=['highlight_filepath'],
+          params=('highlight_lp_url',) + CRAWL_PARAMS),
+    Stage('genres', crawl_genres, inputs=['gr_library_export_filepath'], outputs=['genre_cache_filepath'],
+          params=CRAWL_PARAMS + ('genre_cache_ttl_days',), state=genre_crawl_state),
+    Stage('genre-clean', clean_genres, inputs=['gr_library_export_filepath', 'genre_cache_filepath'],
+          outputs=['clean_genre_filepath'], sources=['goodreads_cache.py', 'goodreads_consolidation.py']),
+    Stage('highlight-index', index_highlights,
+          inputs=['highlight_filepath', 'gr_library_export_filepath', 'genre_cache_filepath'],
+          outputs=['highlight_index_filepath'], sources=['goodreads_highlights.py']),
+    Stage('timeline', crawl_timeline, outputs=['timeline_filepath', 'timeline_book_id_filepath'],
+          params=('review_lp_url',) + CRAWL_PARAMS),
+    Stage('consolidate', consolidate_data,
+          inputs=['gr_library_export_filepath', 'clean_genre_filepath', 'genre_cache_filepath',
+                  'timeline_filepath', 'timeline_book_id_filepath'],
+          outputs=['consolidated_data_filepath', 'timeline_events_filepath'],
+          params=['ingest_chunk_rows'],
+          sources=['goodreads_consolidation.py', 'goodreads_ingest.py', 'goodreads_matching.py',
+                   'goodreads_parsers.py', 'goodreads_storage.py']),
+]
+
+def telemetry_log_filepath(param, working_dir_path):
+    return param.get('telemetry_log_filepath') or os.path.join(working_dir_path, 'telemetry.jsonl')
+
+## Crawl started from the dashboard
+class CrawlRunner:
+    """ Runs the pipeline in a child process, one run at a time, followed through its telemetry log
+
+    The output of the child process (prints, errors) goes to [TELEMETRY LOG].crawl.out.
+    """
+
+    def __init__(self, log_filepath):
+        self.log_filepath = log_filepath
+        self.output_filepath = log_filepath + '.crawl.out'
+        self.process = None
+        self.follower = None
+        self.stages = []
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self, stages=(), force=()):
+        """ Starts `python goodreads_scraper.py [STAGE ...] [--force STAGE ...]`"""
+        if self.running:
+            raise RuntimeError('a crawl is already running (pid {})'.format(self.process.pid))
+        offset = os.path.getsize(self.log_filepath) if os.path.exists(self.log_filepath) else 0
+        cmd = [sys.executable, os.path.abspath(__file__)] + list(stages) + ['--telemetry-log', self.log_filepath]
+        if force:
+            cmd += ['--force'] + list(force)
+        with open(self.output_filepath, 'w') as output:
+            self.process = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                            stdout=output, stderr=subprocess.STDOUT)
+        self.follower = LogFollower(self.log_filepath, offset, pid=self.process.pid)
+        self.stages = list(stages)
+        self.started_at = time.time()
+
+    def stop(self):
+        if self.running:
+            self.process.terminate()
+
+    def poll(self):
+        """ Follower of the current (or last) run, with the events logged since the last poll"""
+        return None if self.follower is None else self.follower.poll()
+
+    def output_tail(self, lines=20):
+        if not os.path.exists(self.output_filepath):
+            return ''
+        with open(self.output_filepath, 'r', errors='replace') as file:
+            return ''.join(file.readlines()[-lines:])
+
+def main():
+    parser = argparse.ArgumentParser(description='Goodreads scraping and consolidation pipeline')
+    parser.add_argument('stages', nargs='*', help='stages to run (all by default): {}'.format(
+                            ', '.join(s.name for s in STAGES)))
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help='run these stages even when up to date')
+    parser.add_argument('--workers', type=int, default=3, help='stages running at the same time')
+    parser.add_argument('--list', action='store_true', help='print the stages, their dependencies and last timings')
+    parser.add_argument('--telemetry-log', help='telemetry JSONL log (default: telemetry_log_filepath)')
+    args = parser.parse_args()
+
+    # LOAD PARAMETERS FILE
+    working_dir_path = os.environ['CONDA_PREFIX']
+    param = get_dict_from_file(os.path.join(working_dir_path,'parameters.json'))
+    ## a crawl started by the dashboard (--telemetry-log) writes to the log the dashboard rotates
+    configure(args.telemetry_log or telemetry_log_filepath(param, working_dir_path),
+              param.get('telemetry_prometheus_port'),
+              max_log_bytes=None if args.telemetry_log else MAX_LOG_BYTES)
+    ## highlight-index runs only when its file is set
+    stages = [s for s in STAGES if s.name != 'highlight-index' or param.get('highlight_index_filepath')]
+    pipeline = Pipeline(stages, param.get('pipeline_state_filepath') or os.path.join(working_dir_path, 'pipeline_state.json'))
+
+    if args.list:
+        dependencies = pipeline.dependencies(param)
+        timings = pipeline.timings()
+        for name in pipeline.order(param):
+            print(json.dumps({'stage': name, 'after': sorted(dependencies[name]), 'last_sec': timings.get(name, [])[-5:]}))
+        return
+    unknown = set(args.stages + args.force).difference(s.name for s in stages)
+    if unknown:
+        parser.error('unknown stages: {}'.format(', '.join(sorted(unknown))))
+
+    records = pipeline.run(param, args.stages or None, force=args.force, workers=args.workers,
+                           on_result=lambda r: print(json.dumps(r), flush=True))
+    if any(r['status'] in ('failed', 'blocked') for r in records):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Storage
+
+Read / write the consolidated dataset, as CSV (the original format) or as Parquet.
+
+Parquet keeps the column types: native datetime columns and list<string> columns for the
+genre lists and timelines, so nothing has to be re-parsed on load. Reads support column
+projection and predicate pushdown (pyarrow filters, e.g. [('is_fiction', '==', 1)]);
+the same filters are applied in memory for CSV files.
+
+Migrate an existing consolidated CSV with:
+    python goodreads_storage.py migrate [CONSOLIDATED CSV] [CONSOLIDATED PARQUET]
+"""
+
+import ast
+import operator
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DATE_COLUMNS = ['date_read', 'date_added', 'add_to_tbr_dt', 'start_reading_dt', 'finish_reading_dt']
+LIST_COLUMNS = ['genre_list', 'genre_list_trf', 'timelines']
+SCHEMA_OVERRIDES = dict(
+    [(c, pa.timestamp('ns')) for c in DATE_COLUMNS]
+    + [(c, pa.list_(pa.string())) for c in LIST_COLUMNS]
+    + [('Book Id', pa.int64()), ('is_fiction', pa.int8()), ('is_nonfiction', pa.int8())]
+)
+FILTER_OPS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'in': lambda s, v: s.isin(v), 'not in': lambda s, v: ~s.isin(v),
+}
+
+
+def is_parquet(filepath):
+    return str(filepath).endswith(('.parquet', '.pq'))
+
+
+def data_version(filepath):
+    """ Version of a data file (mtime + size), the key of everything derived from it"""
+    stat = os.stat(filepath)
+    return '{}-{}'.format(stat.st_mtime_ns, stat.st_size)
+
+
+def consolidated_schema(df):
+    """ Arrow schema of the consolidated dataset: inferred, with the known columns typed"""
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for c, t in SCHEMA_OVERRIDES.items():
+        if c in schema.names:
+            schema = schema.set(schema.get_field_index(c), pa.field(c, t))
+    return schema
+
+
+def write_consolidated(df, filepath):
+    if is_parquet(filepath):
+        # a list column without any value (e.g. no timelines) comes out as all-NaN float
+        empty_lists = [c for c in LIST_COLUMNS if c in df.columns and df[c].dtype != object]
+        if empty_lists:
+            df = df.astype(dict((c, object) for c in empty_lists))
+        table = pa.Table.from_pandas(df, schema=consolidated_schema(df), preserve_index=False)
+        pq.write_table(table, filepath)
+    else:
+        df.to_csv(filepath, index=False)
+
+
+def filter_columns(filters):
+    if not isinstance(filters[0], list):
+        filters = [filters]
+    return [c for conjunction in filters for c, op, v in conjunction]
+
+
+def apply_filters(df, filters):
+    """ In-memory version of the pyarrow filters: list of (column, op, value), AND-ed
+
+    A list of such lists is OR-ed (disjunctive normal form, as in pyarrow).
+    """
+    if not filters:
+        return df
+    if not isinstance(filters[0], list):
+        filters = [filters]
+    mask = pd.Series(False, index=df.index)
+    for conjunction in filters:
+        conj_mask = pd.Series(True, index=df.index)
+        for c, op, v in conjunction:
+            conj_mask &= FILTER_OPS[op](df[c], v)
+        mask |= conj_mask
+    return df[mask]
+
+
+def parse_list_column(values):
+    """ Stringified python lists ("['A', 'B']", as written to CSV) back to lists"""
+    return values.map(lambda x: ast.literal_eval(x) if isinstance(x, str) else None)
+
+
+def read_consolidated(filepath, columns=None, filters=None, parse_lists=False):
+    """ Loads the consolidated dataset, only the given columns and rows matching the filters"""
+    if is_parquet(filepath):
+        return pd.read_parquet(filepath, engine='pyarrow', columns=columns, filters=filters)
+
+    usecols = columns
+    if columns is not None and filters:
+        usecols = list(dict.fromkeys(list(columns) + filter_columns(filters)))
+    df = pd.read_csv(filepath, usecols=usecols)
+    for c in DATE_COLUMNS:
+        if c in df.columns:
+            df[c] = pd.to_datetime(df[c])
+    if parse_lists:
+        for c in LIST_COLUMNS:
+            if c in df.columns:
+                df[c] = parse_list_column(df[c])
+    df = apply_filters(df, filters)
+    if columns is not None:
+        df = df[list(columns)]
+    return df.reset_index(drop=True)
+
+
+def migrate_csv_to_parquet(csv_filepath, parquet_filepath):
+    df = read_consolidated(csv_filepath, parse_lists=True)
+    write_consolidated(df, parquet_filepath)
+    return df
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'migrate':
+        print(__doc__)
+        sys.exit(1)
+    migrated_df = migrate_csv_to_parquet(sys.argv[2], sys.argv[3])
+    print(pq.read_schema(sys.argv[3]))
+    print(len(migrated_df))
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Synthetic Data
+
+Generates synthetic Goodreads data in the same shape as the real pipeline inputs, to
+benchmark the pipeline on libraries much bigger than the bundled one:
+    - library export (goodreads_library_export.csv columns)
+    - crawled genres ({book_id: [genres]}, as books_genre_*.txt)
+    - clean genre table (book_id, book_genre, clean_genre_list as stringified lists)
+    - reading timelines ({book title: [timeline text]})
+    - highlights ({highlight page url: [highlight text]})
+
+write_dataset writes all of them to files, in the formats of the pipeline files, in parts
+(1k to 10M books without holding the whole library in memory), with a parameters.json
+pointing to them:
+    python goodreads_synthetic.py [DATA DIR] --books 1000000
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+EXPORT_COLUMNS = ['Book Id', 'Title', 'Author', 'Author l-f', 'Additional Authors', 'ISBN', 'ISBN13',
+                  'My Rating', 'Average Rating', 'Publisher', 'Binding', 'Number of Pages',
+                  'Year Published', 'Original Publication Year', 'Date Read', 'Date Added',
+                  'Bookshelves', 'Bookshelves with positions', 'Exclusive Shelf', 'My Review',
+                  'Spoiler', 'Private Notes', 'Read Count', 'Recommended For', 'Recommended By',
+                  'Owned Copies', 'Original Purchase Date', 'Original Purchase Location',
+                  'Condition', 'Condition Description', 'BCID']
+BINDINGS = ['Paperback', 'Hardcover', 'Kindle Edition', 'ebook', 'Audiobook', 'Mass Market Paperback']
+SHELVES = ['read', 'to-read', 'currently-reading']
+SHELF_PROBS = [0.5, 0.45, 0.05]
+GENRES = ['Fantasy', 'Romance', 'Mystery', 'Thriller', 'Science Fiction', 'Historical Fiction',
+          'Contemporary', 'Literary Fiction', 'Young Adult', 'Classics', 'Horror', 'Poetry',
+          'Self Help', 'Psychology', 'Business', 'Productivity', 'History', 'Science', 'Philosophy',
+          'Biography', 'Memoir', 'Economics', 'Education', 'Leadership', 'Audiobook', 'Travel']
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+          'September', 'October', 'November', 'December']
+
+
+def make_library_export(n_books, seed=0, first_book=0):
+    """ Library export with `n_books` rows (one per book), starting at book number `first_book`
+    (a big export can be generated in parts)
+    """
+    rng = np.random.default_rng(seed)
+    book_id = np.arange(first_book + 1, first_book + n_books + 1) * 7 + 1000
+    title = pd.Series(book_id).astype(str).radd('Book ')
+    in_series = rng.random(n_books) < 0.3
+    title = title.where(~in_series, title + ' (Series ' + pd.Series(rng.integers(1, 500, n_books)).astype(str)
+                        + ', #' + pd.Series(rng.integers(1, 8, n_books)).astype(str) + ')')
+    author = 'Author ' + pd.Series(rng.integers(1, max(n_books // 5, 2), n_books)).astype(str)
+
+    shelf = rng.choice(SHELVES, size=n_books, p=SHELF_PROBS)
+    date_added = pd.Timestamp('2012-01-01') + pd.to_timedelta(rng.integers(0, 3650, n_books), unit='D')
+    date_read = date_added + pd.to_timedelta(rng.integers(1, 400, n_books), unit='D')
+    date_read = pd.Series(date_read.strftime('%Y/%m/%d')).where(shelf == 'read')
+    pages = rng.integers(80, 900, n_books).astype(float)
+    pages[rng.random(n_books) < 0.02] = np.nan
+    year_published = rng.integers(1900, 2023, n_books).astype(float)
+
+    df = pd.DataFrame({
+        'Book Id': book_id,
+        'Title': title,
+        'Author': author,
+        'Author l-f': author,
+        'ISBN': '="' + pd.Series(book_id).astype(str).str.zfill(10) + '"',
+        'ISBN13': '="978' + pd.Series(book_id).astype(str).str.zfill(10) + '"',
+        'My Rating': np.where(shelf == 'read', rng.integers(0, 6, n_books), 0),
+        'Average Rating': np.round(rng.uniform(2.5, 4.8, n_books), 2),
+        'Publisher': 'Publisher ' + pd.Series(rng.integers(1, 200, n_books)).astype(str),
+        'Binding': rng.choice(BINDINGS, size=n_books),
+        'Number of Pages': pages,
+        'Year Published': year_published,
+        'Original Publication Year': year_published,
+        'Date Read': date_read,
+        'Date Added': pd.Series(date_added.strftime('%Y/%m/%d')),
+        'Bookshelves': shelf,
+        'Bookshelves with positions': pd.Series(shelf) + ' (#' + pd.Series(np.arange(first_book + 1, first_book + n_books + 1)).astype(str) + ')',
+        'Exclusive Shelf': shelf,
+        'Read Count': (shelf == 'read').astype(int),
+        'Owned Copies': 0,
+    })
+    return df.reindex(columns=EXPORT_COLUMNS)
+
+
+def genre_vocabulary(n_genres=300):
+    return GENRES + ['Genre {}'.format(i) for i in range(max(n_genres - len(GENRES), 0))]
+
+
+def make_genre_lists(book_ids, seed=0, n_genres=300):
+    """ {book_id (str): [genres]}, like the crawled genre dumps"""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(genre_vocabulary(n_genres))
+    # skewed popularity, a handful of genres are on most of the books
+    popularity = 1 / np.arange(1, len(vocab) + 1)
+    popularity /= popularity.sum()
+    n = len(book_ids)
+    category = rng.choice(['Fiction', 'Nonfiction', ''], size=n, p=[0.55, 0.4, 0.05])
+    n_per_book = rng.integers(4, 10, n)
+    picks = rng.choice(len(vocab), size=(n, 9), p=popularity)
+    genre_lists = dict()
+    for i, book_id in enumerate(book_ids):
+        genres = list(vocab[picks[i, :n_per_book[i]]])
+        if category[i]:
+            genres.insert(0, category[i])
+        genre_lists[str(book_id)] = genres
+    return genre_lists
+
+
+def make_genre_table(book_ids, seed=0, n_genres=300):
+    """ Clean genre table as read back from the clean genre CSV (stringified lists)"""
+    return genre_table(book_ids, make_genre_lists(book_ids, seed, n_genres).values())
+
+
+def genre_table(book_ids, genre_lists):
+    """ Clean genre table of the genre lists of the books, as clean_genre_table() writes it"""
+    book_genre = [str(g) for g in genre_lists]
+    clean_genre = [str(sorted(set(g), key=g.index)) for g in genre_lists]
+    return pd.DataFrame({'book_id': np.asarray(book_ids), 'book_genre': book_genre, 'clean_genre_list': clean_genre})
+
+
+def timeline_date(dt):
+    """ Goodreads timeline date format, e.g. 'March  2, 2022'"""
+    return '{} {:>2}, {}'.format(MONTHS[dt.month - 1], dt.day, dt.year)
+
+
+def make_timelines(library_export, seed=0, reread_rate=0.02):
+    """ {short title: [timeline text]} for every book of the library export"""
+    rng = np.random.default_rng(seed)
+    titles = library_export['Title'].str.split(' (', n=1, regex=False).str[0].tolist()
+    date_added = pd.to_datetime(library_export['Date Added']).tolist()
+    date_read = pd.to_datetime(library_export['Date Read']).tolist()
+    shelves = library_export['Exclusive Shelf'].tolist()
+    reading_days = rng.integers(1, 60, len(titles))
+    rereads = rng.random(len(titles)) < reread_rate
+
+    timelines = dict()
+    for i, title in enumerate(titles):
+        added = timeline_date(date_added[i])
+        events = [added + ' – Shelved', added + ' – Shelved as: to-read']
+        if shelves[i] in ('read', 'currently-reading'):
+            finish = date_read[i] if shelves[i] == 'read' else date_added[i] + pd.Timedelta(days=int(reading_days[i]))
+            start = finish - pd.Timedelta(days=int(reading_days[i]))
+            events.append(timeline_date(start) + ' –  Started Reading')
+            if shelves[i] == 'read':
+                events.append(timeline_date(finish) + ' –  Finished Reading')
+                if rereads[i]:
+                    events.append(timeline_date(finish + pd.Timedelta(days=30)) + ' –  Started Reading')
+                    events.append(timeline_date(finish + pd.Timedelta(days=40)) + ' –  Finished Reading')
+        timelines[title] = events
+    return timelines
+
+
+def perturb_titles(titles, seed=0):
+    """ Timeline titles as they can differ from the library titles: review heading prefix,
+    case and punctuation, subtitle, typo (and unchanged for a fifth of them)
+    """
+    rng = np.random.default_rng(seed)
+    perturbations = [
+        lambda t: "Jane Doe's Reviews > " + t,
+        lambda t: t.upper() + '!',
+        lambda t: t + ': A Novel',
+        lambda t: t.replace('Book', 'Bok', 1),
+        lambda t: t,
+    ]
+    return [perturbations[k](t) for t, k in zip(titles, rng.integers(0, len(perturbations), len(titles)))]
+
+
+def make_vocabulary(n_words, seed=0):
+    """ Pronounceable pseudo words (letters only, so they survive the highlight tokenizer)"""
+    rng = np.random.default_rng(seed)
+    syllables = np.array([c + v for c in 'bcdfghklmnprstvz' for v in 'aeiou'])
+    n_syllables = rng.integers(2, 5, n_words)
+    picks = rng.integers(0, len(syllables), (n_words, 4))
+    words = {''.join(syllables[picks[i, :n_syllables[i]]]) for i in range(n_words)}
+    return sorted(words)
+
+
+def make_highlights(book_ids, n_highlights, seed=0, vocab_size=20000, stopword_rate=0.4):
+    """ {highlight page url: [highlight text]} with `n_highlights` highlights over the books
+
+    Words follow a Zipf-like popularity, mixed with common stopwords.
+    """
+    rng = np.random.default_rng(seed)
+    vocab = np.array(make_vocabulary(vocab_size, seed) + ['the', 'and', 'that', 'with', 'you', 'this', 'from'])
+    n_content = len(vocab) - 7
+    popularity = 1 / np.arange(1, n_content + 1) ** 1.1
+    popularity /= popularity.sum()
+    lengths = rng.integers(8, 30, n_highlights)
+    words = rng.choice(n_content, size=lengths.sum(), p=popularity)
+    stop = rng.random(lengths.sum()) < stopword_rate
+    words[stop] = n_content + rng.integers(0, 7, stop.sum())
+    tokens = vocab[words].tolist()
+    owners = rng.choice(np.asarray(book_ids), size=n_highlights)
+
+    highlights = dict()
+    ends = np.cumsum(lengths)
+    for i, book_id in enumerate(owners.tolist()):
+        url = 'https://www.goodreads.com/notes/{0}-book-{0}/1-reader?ref=abp'.format(book_id)
+        highlights.setdefault(url, []).append(' '.join(tokens[ends[i] - lengths[i]:ends[i]]).capitalize() + '.')
+    return highlights
+
+
+def write_json_parts(filepath, parts):
+    """ Writes the dicts of `parts` one after the other as a single JSON object, one part in
+    memory at a time
+    """
+    with open(filepath, 'w') as file:
+        file.write('{')
+        separator = ''
+        for part in parts:
+            if part:
+                file.write(separator + json.dumps(part)[1:-1])
+                separator = ', '
+        file.write('}')
+
+
+def part_seed(seed, first_book):
+    """ Seed of the part starting at book `first_book`: the parts of a big dataset do not repeat
+    each other, and the first part (a dataset of one part) stays the one of `seed`
+    """
+    return seed if first_book == 0 else [seed, first_book]
+
+
+def write_dataset(data_dir, n_books, seed=0, part_rows=100000, timeline_books=100000,
+                  highlight_books=10000, highlights_per_book=5):
+    """ Writes a synthetic library of `n_books` books to `data_dir`, in the formats of the pipeline files:
+        goodreads_library_export.csv: library export
+        books_genre.txt: crawled genres
+        book_genre.csv: clean genre table
+        books_timeline.txt, books_timeline_book_id.txt: timelines of the first `timeline_books`
+            books, and the Book Id of each timeline
+        highlights.txt: `highlights_per_book` highlights on average for the first `highlight_books`
+            read books
+        parameters.json: the parameters of these files (goodreads_scraper.py, goodreads_analytics.py)
+
+    Generated in parts of `part_rows` books, each with its own seed (part_seed). Returns the parameters.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    param = {
+        'gr_library_export_filepath': os.path.join(data_dir, 'goodreads_library_export.csv'),
+        'genre_filepath': os.path.join(data_dir, 'books_genre.txt'),
+        'clean_genre_filepath': os.path.join(data_dir, 'book_genre.csv'),
+        'timeline_filepath': os.path.join(data_dir, 'books_timeline.txt'),
+        'timeline_book_id_filepath': os.path.join(data_dir, 'books_timeline_book_id.txt'),
+        'highlight_filepath': os.path.join(data_dir, 'highlights.txt'),
+        'highlight_index_filepath': os.path.join(data_dir, 'highlights.sqlite'),
+        'consolidated_data_filepath': os.path.join(data_dir, 'book_data_consolidated.parquet'),
+    }
+    timelines, timeline_book_ids, highlight_ids = dict(), dict(), []
+
+    def genre_parts():
+        for first_book in range(0, n_books, part_rows):
+            rng_seed = part_seed(seed, first_book)
+            part = make_library_export(min(part_rows, n_books - first_book), rng_seed, first_book)
+            part.to_csv(param['gr_library_export_filepath'], mode='w' if first_book == 0 else 'a',
+                        header=first_book == 0, index=False)
+            genre_lists = make_genre_lists(part['Book Id'], rng_seed)
+            genre_table(part['Book Id'], list(genre_lists.values())).to_csv(
+                param['clean_genre_filepath'], mode='w' if first_book == 0 else 'a', header=first_book == 0, index=False)
+            if first_book < timeline_books:
+                reviewed = part.head(timeline_books - first_book)
+                part_timelines = make_timelines(reviewed, rng_seed)
+                timelines.update(part_timelines)
+                timeline_book_ids.update(zip(part_timelines, reviewed['Book Id'].astype(str)))
+            if len(highlight_ids) < highlight_books:
+                read_ids = part.loc[part['Exclusive Shelf'] == 'read', 'Book Id']
+                highlight_ids.extend(read_ids.head(highlight_books - len(highlight_ids)).tolist())
+            yield genre_lists
+
+    write_json_parts(param['genre_filepath'], genre_parts())
+    write_json_parts(param['timeline_filepath'], [timelines])
+    write_json_parts(param['timeline_book_id_filepath'], [timeline_book_ids])
+    write_json_parts(param['highlight_filepath'],
+                     [make_highlights(highlight_ids, len(highlight_ids) * highlights_per_book, seed) if highlight_ids else {}])
+    with open(os.path.join(data_dir, 'parameters.json'), 'w') as file:
+        file.write(json.dumps(param, indent=4))
+    return param
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a synthetic Goodreads dataset in the formats of the pipeline files')
+    parser.add_argument('data_dir')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--part-rows', type=int, default=100000)
+    parser.add_argument('--timeline-books', type=int, default=100000)
+    parser.add_argument('--highlight-books', type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(write_dataset(args.data_dir, args.books, args.seed, args.part_rows, args.timeline_books,
+                                   args.highlight_books)))
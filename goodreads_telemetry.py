@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Telemetry
+
+Metrics of the crawls, the consolidation and the dashboard loads:
+    counters: events counted per name and labels (pages fetched / failed, retries, errors)
+    histograms: seconds per name and labels, in fixed buckets (fetch, parse, close_popups,
+                consolidate steps, stages, load_data)
+    spans: timed blocks, `with span('parse', source='genres'):`, observed in the histogram
+           of their name; a span ending with an exception also counts an error
+    progress: done / total of a running loop (pages of a crawl, stages of a run), with its
+              rate and ETA
+
+Every span, progress update (at most one per second and task) and stage record is
+appended to a JSONL log (telemetry_log_filepath), one event per line with its time and
+process id, so a crawl can be followed from another process (the Crawl section of the
+dashboard, LogFollower). Counters and histograms are written as a 'metrics' snapshot on
+flush() and at exit. Without a log file the metrics are only kept in memory.
+
+With telemetry_prometheus_port set, the metrics of the process are also served in the
+Prometheus text format on http://127.0.0.1:[PORT]/metrics.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+## seconds, from a parsed page to a long crawl stage
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+PROGRESS_INTERVAL = 1.0
+MAX_LOG_BYTES = 64 * 2 ** 20
+METRIC_PREFIX = 'goodreads_'
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Histogram:
+    """ Counts of the observed values per bucket (upper bounds), with their sum"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': round(self.sum, 6),
+                'count': self.count}
+
+
+class Progress:
+    """ done / total of a running loop, logged at most every `interval` seconds and when finished"""
+
+    def __init__(self, telemetry, task, total=None, interval=PROGRESS_INTERVAL):
+        self.telemetry = telemetry
+        self.task = task
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.finished = False
+        self.started_at = time.monotonic()
+        self.logged_at = 0.0
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started_at
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = round(max(self.total - self.done, 0) / rate, 1)
+        return {'task': self.task, 'done': self.done, 'total': self.total, 'errors': self.errors,
+                'elapsed_sec': round(elapsed, 3), 'rate': round(rate, 3), 'eta_sec': eta,
+                'finished': self.finished}
+
+    def advance(self, n=1, errors=0):
+        with self._lock:
+            self.done += n
+            self.errors += errors
+            now = time.monotonic()
+            if now - self.logged_at < self.interval and self.done != self.total:
+                return
+            self.logged_at = now
+        self.telemetry.emit(dict(self.snapshot(), type='progress'))
+
+    def finish(self):
+        self.finished = True
+        self.telemetry.emit(dict(self.snapshot(), type='progress'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+class Telemetry:
+    """ Counters, histograms and progress of the process, with their JSONL log"""
+
+    def __init__(self, log_filepath=None):
+        self.log_filepath = log_filepath
+        self.counters = dict()
+        self.histograms = dict()
+        self.tasks = dict()
+        self.server = None
+        self._log = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def configure(self, log_filepath=None, prometheus_port=None, max_log_bytes=None):
+        """ Sets the log file and starts the endpoint, if any
+
+        max_log_bytes: rotate the log to [LOG].1 above this size; only for the process owning
+        the log (not a crawl started by the dashboard, which is followed from an offset).
+        """
+        with self._lock:
+            if log_filepath != self.log_filepath:
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+                if max_log_bytes and log_filepath and os.path.exists(log_filepath) \
+                        and os.path.getsize(log_filepath) > max_log_bytes:
+                    os.replace(log_filepath, log_filepath + '.1')
+                self.log_filepath = log_filepath
+        if prometheus_port and self.server is None:
+            self.server = serve_metrics(self, prometheus_port)
+
+    def emit(self, event):
+        """ Appends one event to the log (one write per line, the processes can share the file)"""
+        if not self.log_filepath:
+            return
+        line = json.dumps(dict(event, ts=round(time.time(), 3), pid=os.getpid())) + '\n'
+        with self._lock:
+            if self._log is None:
+                self._log = open(self.log_filepath, 'a', buffering=1)
+            self._log.write(line)
+
+    def count(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def span(self, name, **labels):
+        """ Times the block into the `name` histogram; the yielded labels can be set inside the block"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield labels
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            sec = time.perf_counter() - start
+            self.observe(name, sec, **labels)
+            event = {'type': 'span', 'name': name, 'sec': round(sec, 6), 'labels': labels}
+            if error is not None:
+                self.count('errors', span=name, error=error, **labels)
+                event['error'] = error
+            self.emit(event)
+
+    def track(self, task, total=None):
+        """ Progress of a loop, also served as gauges while the process runs"""
+        progress = Progress(self, task, total)
+        with self._lock:
+            self.tasks[task] = progress
+        return progress
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in self.counters.items()],
+                'histograms': [dict(h.to_dict(), name=n, labels=dict(l)) for (n, l), h in self.histograms.items()],
+            }
+
+    def flush(self):
+        """ Writes the counters and histograms as a 'metrics' event"""
+        if self.counters or self.histograms:
+            self.emit(dict(self.snapshot(), type='metrics'))
+
+    def reset(self):
+        with self._lock:
+            self.counters, self.histograms, self.tasks = dict(), dict(), dict()
+
+
+def metric_name(name):
+    return METRIC_PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels) + '}'
+
+
+def prometheus_text(telemetry):
+    """ Counters, histograms (seconds) and progress gauges in the Prometheus text format"""
+    with telemetry._lock:
+        counters = sorted(telemetry.counters.items())
+        histograms = sorted((k, h.to_dict()) for k, h in telemetry.histograms.items())
+        tasks = [p.snapshot() for p in telemetry.tasks.values()]
+    lines, typed = [], set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for (name, labels), value in counters:
+        declare(metric_name(name) + '_total', 'counter')
+        lines.append('{}_total{} {}'.format(metric_name(name), format_labels(labels), value))
+    for (name, labels), histogram in histograms:
+        base = metric_name(name) + '_seconds'
+        declare(base, 'histogram')
+        cumulative = 0
+        for bound, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(base, format_labels(labels + (('le', bound),)), cumulative))
+        lines.append('{}_sum{} {}'.format(base, format_labels(labels), histogram['sum']))
+        lines.append('{}_count{} {}'.format(base, format_labels(labels), histogram['count']))
+    for field in ['done', 'total', 'errors', 'rate', 'eta_sec']:
+        for task in tasks:
+            if task[field] is not None:
+                declare(metric_name('progress_' + field), 'gauge')
+                lines.append('{} {}'.format(metric_name('progress_' + field) + format_labels((('task', task['task']),)),
+                                            task[field]))
+    return '\n'.join(lines) + '\n'
+
+
+def serve_metrics(telemetry, port=0):
+    """ Serves /metrics of the telemetry on localhost, in a daemon thread; returns the server"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = prometheus_text(telemetry).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+class LogFollower:
+    """ Follows a telemetry log from a byte offset, keeping the state of one process (pid)
+
+    The log is read again from its start when it was rotated or truncated (new inode, or
+    smaller than the offset). poll() only reads the lines written since the last call: latest progress of each task,
+    stage records, and count / seconds / errors of each span, per name and label values
+    ('fetch (genres)', 'consolidate (merge_timeline)', ...).
+    """
+
+    def __init__(self, log_filepath, offset=0, pid=None):
+        self.log_filepath = log_filepath
+        self.offset = offset
+        self.pid = pid
+        self.inode = os.stat(log_filepath).st_ino if os.path.exists(log_filepath) else None
+        self.progress = dict()
+        self.stages = dict()
+        self.spans = dict()
+
+    def poll(self):
+        if not os.path.exists(self.log_filepath):
+            return self
+        with open(self.log_filepath, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self.inode, self.offset = stat.st_ino, 0
+            file.seek(self.offset)
+            data = file.read()
+        # a line being written is read on the next poll
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if self.pid is not None and event.get('pid') != self.pid:
+                continue
+            if event['type'] == 'progress':
+                self.progress[event['task']] = event
+            elif event['type'] == 'stage':
+                self.stages[event['stage']] = event
+            elif event['type'] == 'span':
+                key = event['name']
+                if event['labels']:
+                    key += ' ({})'.format(', '.join(str(v) for k, v in sorted(event['labels'].items())))
+                span = self.spans.setdefault(key, {'count': 0, 'sec': 0.0, 'errors': 0})
+                span['count'] += 1
+                span['sec'] += event['sec']
+                span['errors'] += 'error' in event
+        return self
+
+
+## Telemetry of the process, configured once by the entry points (scraper, dashboard)
+TELEMETRY = Telemetry()
+configure = TELEMETRY.configure
+count = TELEMETRY.count
+span = TELEMETRY.span
+track = TELEMETRY.track
+emit = TELEMETRY.emit
+flush = TELEMETRY.flush
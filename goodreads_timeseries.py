@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Time Series
+
+Reading velocity (metric 4): books and pages read per day, month and year, per genre.
+
+Each read book (date_read set) counts as read on its finish day. Its pages are spread evenly
+over its reading days, from start_reading_dt to date_read (the finish day only when the
+start is unknown), so overlapping reads share the days they overlap. The spreading is a
+difference array: +pages/day on the start day and -pages/day after the finish day for every
+book at once (one bincount), then a cumulative sum over the days.
+
+The series are dense numpy arrays (genres x days, ALL_GENRES first), with their prefix sums:
+a date range is an index range, its total is two lookups and a rolling window is a
+difference of shifted prefix sums, whatever the filter. Monthly and yearly series are
+materialized with reduceat on the period boundaries.
+
+The series are built once per data version (file mtime + size) and stored next to the data
+([DATA FILE].series-[VERSION].npz).
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from goodreads_aggregates import ALL_GENRES
+from goodreads_genres import GenreMatrix
+from goodreads_storage import data_version, read_consolidated
+
+MEASURES = ['books', 'pages']
+SERIES_COLUMNS = ['Book Id', 'genre_list_trf', 'date_read', 'start_reading_dt', 'Number of Pages']
+
+
+def reading_intervals(df):
+    """ (start day, finish day, pages) of each read book, days as datetime64[D]"""
+    books = df[df['date_read'].notna()].drop_duplicates(subset='Book Id')
+    finish = books['date_read'].to_numpy(dtype='datetime64[D]')
+    start = books['start_reading_dt'].to_numpy(dtype='datetime64[D]')
+    # unknown start, or a start after the finish (inconsistent dates): read on the finish day
+    start = np.where(np.isnat(start) | (start > finish), finish, start)
+    return books, start, finish, books['Number of Pages'].fillna(0).to_numpy(dtype=np.float64)
+
+
+def book_genre_rows(genre_matrix):
+    """ (book position, genre row) pairs: every book in ALL_GENRES (row 0), and in each of its
+    genres (row 1 + genre code)
+    """
+    return (np.r_[np.arange(len(genre_matrix)), genre_matrix.row_of],
+            np.r_[np.zeros(len(genre_matrix), dtype=np.int64), genre_matrix.indices.astype(np.int64) + 1])
+
+
+def period_starts(days, freq):
+    """ Positions of the first day of each month ('M') or year ('Y') of the days"""
+    periods = days.astype('datetime64[{}]'.format(freq))
+    return np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]]), np.unique(periods)
+
+
+class ReadingSeries:
+    """ Daily books / pages read per genre as dense arrays, with monthly and yearly rollups"""
+
+    def __init__(self, first_day, genres, daily):
+        self.first_day = np.datetime64(first_day, 'D')
+        self.genres = pd.Index(genres, dtype=object)
+        self.daily = daily
+        n_days = daily['books'].shape[1]
+        self.days = self.first_day + np.arange(n_days)
+        self.cumulative = dict((m, np.concatenate([np.zeros((len(self.genres), 1)), np.cumsum(a, axis=1)], axis=1))
+                               for m, a in daily.items())
+        self.periods = dict()
+        self.rollups = dict()
+        for freq in ['M', 'Y']:
+            starts, self.periods[freq] = period_starts(self.days, freq)
+            self.rollups[freq] = dict((m, np.add.reduceat(a, starts, axis=1) if n_days else a)
+                                      for m, a in daily.items())
+
+    @classmethod
+    def build(cls, df):
+        """ Series of the consolidated dataset (SERIES_COLUMNS)"""
+        books, start, finish, pages = reading_intervals(df)
+        genre_matrix = GenreMatrix.from_lists(books['genre_list_trf'])
+        genres = pd.Index([ALL_GENRES] + genre_matrix.genres.tolist(), dtype=object)
+        if len(books) == 0:
+            return cls(np.datetime64('today', 'D'), genres, dict((m, np.zeros((len(genres), 0))) for m in MEASURES))
+
+        first_day = start.min()
+        n_days = int((finish.max() - first_day).astype(np.int64)) + 1
+        start_pos = (start - first_day).astype(np.int64)
+        finish_pos = (finish - first_day).astype(np.int64)
+        pages_per_day = pages / (finish_pos - start_pos + 1)
+        book_positions, genre_rows = book_genre_rows(genre_matrix)
+
+        # one row of n_days + 1 per genre (room for the -pages/day after the last day)
+        width = n_days + 1
+        size = len(genres) * width
+        book_counts = np.bincount(genre_rows * width + finish_pos[book_positions], minlength=size)
+        page_deltas = np.bincount(genre_rows * width + start_pos[book_positions],
+                                  weights=pages_per_day[book_positions], minlength=size) \
+            - np.bincount(genre_rows * width + finish_pos[book_positions] + 1,
+                          weights=pages_per_day[book_positions], minlength=size)
+        daily = {
+            'books': book_counts.reshape(len(genres), width)[:, :n_days].astype(np.float64),
+            'pages': np.cumsum(page_deltas.reshape(len(genres), width), axis=1)[:, :n_days],
+        }
+        return cls(first_day, genres, daily)
+
+    @property
+    def nbytes(self):
+        arrays = list(self.daily.values()) + list(self.cumulative.values()) \
+            + [a for rollup in self.rollups.values() for a in rollup.values()]
+        return int(sum(a.nbytes for a in arrays))
+
+    def day_position(self, day):
+        return int(np.clip((np.datetime64(day, 'D') - self.first_day).astype(np.int64), 0, len(self.days)))
+
+    def day_range(self, start=None, end=None):
+        """ (first, last + 1) day positions of the start and end days (included), None for no bound"""
+        first = 0 if start is None else self.day_position(start)
+        last = len(self.days) if end is None else self.day_position(np.datetime64(end, 'D') + 1)
+        return first, max(first, last)
+
+    def genre_row(self, genre):
+        row = self.genres.get_indexer([genre])[0]
+        if row < 0:
+            raise KeyError(genre)
+        return row
+
+    def total(self, measure='books', genre=ALL_GENRES, start=None, end=None):
+        """ measure between the start and end days (included), from the prefix sums"""
+        first, last = self.day_range(start, end)
+        cumulative = self.cumulative[measure][self.genre_row(genre)]
+        return float(cumulative[last] - cumulative[first])
+
+    def series(self, measure='books', genre=ALL_GENRES, freq='D', start=None, end=None):
+        """ measure per day ('D'), month ('M') or year ('Y') between the start and end days (included)"""
+        row = self.genre_row(genre)
+        if freq == 'D':
+            first, last = self.day_range(start, end)
+            return pd.Series(self.daily[measure][row, first:last], index=pd.DatetimeIndex(self.days[first:last]))
+        periods = self.periods[freq]
+        first = 0 if start is None else np.searchsorted(periods, np.datetime64(start, freq))
+        last = len(periods) if end is None else np.searchsorted(periods, np.datetime64(end, freq), side='right')
+        return pd.Series(self.rollups[freq][measure][row, first:last],
+                         index=pd.DatetimeIndex(periods[first:last].astype('datetime64[D]')))
+
+    def rolling(self, measure='pages', genre=ALL_GENRES, window_days=30, start=None, end=None):
+        """ measure summed over the `window_days` days up to each day (a trailing window)"""
+        cumulative = self.cumulative[measure][self.genre_row(genre)]
+        first, last = self.day_range(start, end)
+        ends = np.arange(first, last) + 1
+        values = cumulative[ends] - cumulative[np.maximum(ends - window_days, 0)]
+        return pd.Series(values, index=pd.DatetimeIndex(self.days[first:last]))
+
+    def save(self, filepath):
+        with open(filepath, 'wb') as file:
+            np.savez(file, first_day=self.first_day, genres=self.genres.to_numpy(dtype=str),
+                     **dict(('daily_' + m, a) for m, a in self.daily.items()))
+
+    @classmethod
+    def load(cls, filepath):
+        with np.load(filepath) as npz:
+            return cls(npz['first_day'], npz['genres'].astype(object), dict((m, npz['daily_' + m]) for m in MEASURES))
+
+
+def load_series(data_filepath):
+    """ Loads the stored series of the current data version, builds (and stores) them if missing"""
+    series_filepath = '{}.series-{}.npz'.format(data_filepath, data_version(data_filepath))
+    if os.path.exists(series_filepath):
+        return ReadingSeries.load(series_filepath)
+
+    df = read_consolidated(data_filepath, columns=SERIES_COLUMNS, parse_lists=True)
+    series = ReadingSeries.build(df)
+    for old_filepath in glob.glob('{}.series-*.npz'.format(data_filepath)):
+        os.remove(old_filepath)
+    series.save(series_filepath)
+    return series
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Goodreads Users
+
+Multi-library mode: every uploaded Goodreads library export is stored in its own user
+partition, and consolidated (+ aggregated) by a background worker pool, so a large upload
+does not block the other sessions.
+
+Partition layout (one directory per user under `root_dir`, named after the user id and a
+short hash of it, so ids reduced to the same name do not share a partition):
+    library_export.csv: the uploaded export
+    consolidated.parquet: the consolidated dataset, what the dashboard loads
+    consolidated.parquet.cube-*.parquet: the aggregate cube
+    status.json: pending / running / ready / failed, with timestamps and the error if any
+
+Genres come from the shared page cache (keyed by Book Id, so books crawled for one user
+are reused by all), reading timelines are not available for uploaded libraries.
+Loaded frames are bounded by the dashboard data cache (LRU on memory size).
+An upload is refused while the previous upload of the same user is still pending or
+running.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from goodreads_aggregates import load_cube
+from goodreads_cache import PageCache
+from goodreads_consolidation import clean_genre_table, consolidate
+from goodreads_storage import write_consolidated
+
+EXPORT_FILENAME = 'library_export.csv'
+CONSOLIDATED_FILENAME = 'consolidated.parquet'
+STATUS_FILENAME = 'status.json'
+
+
+def user_partition(root_dir, user_id):
+    """ Partition directory of a user: the id reduced to a safe directory name, plus a hash of the id"""
+    safe_id = re.sub(r'[^a-z0-9_-]+', '-', str(user_id).strip().lower()).strip('-')
+    if not safe_id:
+        raise ValueError('invalid user id: {!r}'.format(user_id))
+    return os.path.join(root_dir, '{}-{}'.format(safe_id, hashlib.sha256(str(user_id).encode()).hexdigest()[:10]))
+
+
+def write_status(partition_dir, status, **details):
+    details.update({'status': status, 'updated_at': time.time()})
+    tmp_filepath = os.path.join(partition_dir, STATUS_FILENAME + '.tmp')
+    with open(tmp_filepath, 'w') as file:
+        file.write(json.dumps(details))
+    os.replace(tmp_filepath, os.path.join(partition_dir, STATUS_FILENAME))
+
+
+def read_status(partition_dir):
+    filepath = os.path.join(partition_dir, STATUS_FILENAME)
+    if not os.path.exists(filepath):
+        return {'status': 'missing'}
+    with open(filepath, 'r') as file:
+        return json.loads(file.read())
+
+
+def process_library(partition_dir, genre_cache_filepath=None):
+    """ Consolidates and aggregates one user partition (runs in a worker process)"""
+    start = time.time()
+    write_status(partition_dir, 'running', started_at=start)
+    try:
+        library = pd.read_csv(os.path.join(partition_dir, EXPORT_FILENAME))
+        genre_dict = dict()
+        if genre_cache_filepath and os.path.exists(genre_cache_filepath):
+            page_cache = PageCache(genre_cache_filepath)
+            genre_dict = page_cache.genre_dict(library['Book Id'])
+            page_cache.close()
+
+        consolidate_df = consolidate(library, clean_genre_table(genre_dict), dict())
+        consolidated_filepath = os.path.join(partition_dir, CONSOLIDATED_FILENAME)
+        write_consolidated(consolidate_df, consolidated_filepath)
+        load_cube(consolidated_filepath)
+    except Exception as e:
+        write_status(partition_dir, 'failed', started_at=start, error=repr(e), traceback=traceback.format_exc())
+        raise
+    write_status(partition_dir, 'ready', started_at=start, finished_at=time.time(),
+                 books=len(consolidate_df), books_with_genre=len(genre_dict))
+    return consolidated_filepath
+
+
+class UserStore:
+    """ Per-user partitioned storage + background consolidation worker pool"""
+
+    def __init__(self, root_dir, genre_cache_filepath=None, workers=2):
+        self.root_dir = root_dir
+        self.genre_cache_filepath = genre_cache_filepath
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.jobs = dict()
+        os.makedirs(root_dir, exist_ok=True)
+
+    def submit_upload(self, user_id, export_bytes):
+        """ Stores an uploaded library export and queues its consolidation
+
+        Raises RuntimeError while the previous upload of the user is not processed yet (its
+        worker still reads the export and writes the partition).
+        """
+        partition_dir = user_partition(self.root_dir, user_id)
+        job = self.jobs.get(partition_dir)
+        if job is not None and not job.done():
+            raise RuntimeError('the previous upload of {} is still being processed'.format(user_id))
+        os.makedirs(partition_dir, exist_ok=True)
+        with open(os.path.join(partition_dir, EXPORT_FILENAME), 'wb') as file:
+            file.write(export_bytes)
+        write_status(partition_dir, 'pending', submitted_at=time.time())
+        self.jobs[partition_dir] = self.executor.submit(process_library, partition_dir, self.genre_cache_filepath)
+        return partition_dir
+
+    def status(self, user_id):
+        return read_status(user_partition(self.root_dir, user_id))
+
+    def consolidated_filepath(self, user_id):
+        """ Consolidated dataset of the user, None while it is not ready"""
+        if self.status(user_id)['status'] != 'ready':
+            return None
+        return os.path.join(user_partition(self.root_dir, user_id), CONSOLIDATED_FILENAME)
+
+    def users(self):
+        return sorted(d for d in os.listdir(self.root_dir) if os.path.isdir(os.path.join(self.root_dir, d)))
+
+    def wait(self, timeout=None):
+        """ Waits for every submitted job (used by the benchmark)"""
+        for job in list(self.jobs.values()):
+            try:
+                job.result(timeout=timeout)
+            except Exception:
+                pass
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
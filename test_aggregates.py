@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the aggregate cube against direct groupbys of the consolidated dataset
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from goodreads_aggregates import ALL_GENRES, CUBE_COLUMNS, build_cube, cube_pivot, cube_total
+from goodreads_storage import read_consolidated
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(scope='module')
+def books():
+    return read_consolidated(os.path.join(REPO_DIR, 'book_data_consolidated_fin.csv'), columns=CUBE_COLUMNS,
+                             parse_lists=True)
+
+
+def book_status(df):
+    """ read (a date read or the 'read' shelf), else in-progress (a start date), else tbr"""
+    read = df['date_read'].notna() | (df['Exclusive Shelf'] == 'read')
+    return pd.Series('tbr', index=df.index).mask(df['start_reading_dt'].notna(), 'in-progress').mask(read, 'read')
+
+
+def book_category(df):
+    return pd.Series('unknown', index=df.index).mask(df['is_nonfiction'] == 1, 'non-fiction').mask(df['is_fiction'] == 1,
+                                                                                                   'fiction')
+
+
+def test_totals_match_groupby(books):
+    cube = build_cube(books)
+    expected = books.assign(status=book_status(books), category=book_category(books)) \
+                    .groupby(['category', 'status']).agg(books=('Book Id', 'nunique'), pages=('Number of Pages', 'sum'))
+    for (category, status), row in expected.iterrows():
+        assert cube_total(cube, 'books', category=category, status=status) == row['books']
+        assert cube_total(cube, 'pages', category=category, status=status) == pytest.approx(row['pages'])
+    assert cube_total(cube) == books['Book Id'].nunique()
+    assert cube_pivot(cube, 'category', 'status').to_numpy().sum() == books['Book Id'].nunique()
+
+    # the row-wise panels also counted the books of the 'read' shelf without a date read as in progress
+    started = books[books['start_reading_dt'].notna() & books['date_read'].isna()]
+    reclassified = started['Exclusive Shelf'] == 'read'
+    assert reclassified.sum() == 3
+    assert cube_total(cube, status='in-progress') == started.loc[~reclassified, 'Book Id'].nunique()
+
+
+def test_genre_totals_match_groupby(books):
+    cube = build_cube(books)
+    read = books[book_status(books) == 'read']
+    # books without genre have an empty genre in their list
+    genres = read.explode('genre_list_trf')
+    expected = genres[genres['genre_list_trf'].fillna('') != ''].groupby('genre_list_trf')['Book Id'].nunique()
+    read_cube = cube[(cube['status'] == 'read') & (cube['genre'] != ALL_GENRES)]
+    pd.testing.assert_series_equal(read_cube.groupby('genre')['books'].sum(), expected, check_names=False)
+    rated = read[read['My Rating'] != 0]
+    assert cube_total(cube, 'my_rating_sum', status='read') == rated['My Rating'].sum()
+    assert cube_total(cube, 'rated_books', status='read') == len(rated)
+
+
+def test_read_shelf_without_date_read_is_read():
+    # the row-wise panels counted such a book as read and as in progress, the cube only as read
+    df = pd.DataFrame({
+        'Book Id': [1, 2, 3, 4],
+        'Exclusive Shelf': ['read', 'currently-reading', 'to-read', 'read'],
+        'is_fiction': [1, 1, 0, 0],
+        'is_nonfiction': [0, 0, 1, 0],
+        'genre_list_trf': [['Fantasy'], ['Fantasy'], ['History'], []],
+        'date_read': pd.to_datetime([None, None, None, '2022-03-01']),
+        'start_reading_dt': pd.to_datetime(['2022-01-01', '2022-02-01', None, None]),
+        'date_added': pd.to_datetime(['2021-12-01', '2022-01-15', '2022-04-01', '2022-02-01']),
+        'Number of Pages': [100.0, 200.0, None, 50.0],
+        'My Rating': [4, 0, 0, 5],
+        'Average Rating': [4.1, 3.9, 4.0, 3.5],
+    })
+    cube = build_cube(df)
+    assert cube_total(cube, status='read') == 2
+    assert cube_total(cube, status='in-progress') == 1
+    assert cube_total(cube, status='tbr') == 1
+    assert cube_total(cube, status='read', category='fiction') == 1
+    assert cube_total(cube, status='read', category='unknown') == 1
+    # read from the shelf only: no date of the status, year and month unknown
+    assert cube_total(cube, status='read', category='fiction', year=0, month=0) == 1
+    assert cube_total(cube, genre='Fantasy') == 2
+    assert cube_total(cube, 'pages', status='read') == 150
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the page cache: stale books of an incremental crawl, genre lookups
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from goodreads_cache import QUERY_BATCH_SIZE, PageCache
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def page_cache(tmp_path):
+    page_cache = PageCache(str(tmp_path / 'pages.sqlite'), ttl_days=30)
+    yield page_cache
+    page_cache.close()
+
+
+def test_stale_ids(page_cache):
+    now = time.time()
+    page_cache.put(1, 'url/1', '<html>1</html>', ['Fiction'], fetched_at=now)
+    page_cache.put(2, 'url/2', '<html>2</html>', ['History'], fetched_at=now - 31 * 24 * 3600)
+    # new, stale and fresh books, in the order of the export
+    assert page_cache.stale_ids([3, 2, 1, '4']) == ['3', '2', '4']
+    page_cache.put(2, 'url/2', '<html>2</html>', ['History'])
+    assert page_cache.stale_ids([3, 2, 1]) == ['3']
+
+
+def test_pages_and_genres(page_cache):
+    page_cache.put_many([(1, 'url/1', 'Fantasy – ü', ['Fiction', 'Fantasy']), (2, 'url/2', None, [])])
+    assert page_cache.get_page(1) == 'Fantasy – ü'
+    assert page_cache.get_page(2) is None
+    assert page_cache.get_page(3) is None
+    assert page_cache.genre_dict([2, 3, 1]) == {'2': [], '1': ['Fiction', 'Fantasy']}
+
+
+def test_reopened_cache_resumes(tmp_path):
+    filepath = str(tmp_path / 'pages.sqlite')
+    page_cache = PageCache(filepath)
+    page_cache.put(1, 'url/1', '<html>1</html>', ['Fiction'])
+    page_cache.close()
+    # an interrupted crawl: the parsed pages are kept
+    page_cache = PageCache(filepath)
+    assert page_cache.stale_ids([1, 2]) == ['2']
+    page_cache.close()
+
+
+def test_import_genre_dump(page_cache):
+    with open(os.path.join(REPO_DIR, 'books_genre_20220507.txt'), 'r') as file:
+        genre_dict = json.loads(file.read())
+    page_cache.import_genre_dict(genre_dict)
+    assert page_cache.genre_dict() == genre_dict
+    # more ids than one batch of the lookup query
+    book_ids = list(genre_dict)[::-1] + ['missing-{}'.format(i) for i in range(QUERY_BATCH_SIZE)]
+    assert page_cache.genre_dict(book_ids) == dict((b, genre_dict[b]) for b in book_ids if b in genre_dict)
+    assert list(page_cache.genre_dict(book_ids)) == [b for b in book_ids if b in genre_dict]
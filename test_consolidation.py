@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the vectorized consolidation against the row-wise version it replaced
+(goodreads_benchmark baselines) and the bundled consolidated dataset
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from goodreads_benchmark import check_consolidation, consolidate_rowwise, csv_roundtrip
+from goodreads_consolidation import consolidate, exclude_genres
+from goodreads_synthetic import make_genre_table, make_library_export, make_timelines
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def bundled_inputs():
+    with open(os.path.join(REPO_DIR, 'books_timeline.txt'), 'r') as file:
+        timeline = json.loads(file.read())
+    return (pd.read_csv(os.path.join(REPO_DIR, 'goodreads_library_export.csv')),
+            pd.read_csv(os.path.join(REPO_DIR, 'book_genre.csv')),
+            timeline)
+
+
+def test_bundled_matches_consolidated_csv():
+    result = check_consolidation(*[os.path.join(REPO_DIR, f) for f in [
+        'goodreads_library_export.csv', 'book_genre.csv', 'books_timeline.txt', 'book_data_consolidated_fin.csv']])
+    assert result['equal']
+
+
+def test_bundled_matches_rowwise():
+    library, genre_df, timeline = bundled_inputs()
+    pd.testing.assert_frame_equal(csv_roundtrip(consolidate(library, genre_df, timeline)),
+                                  csv_roundtrip(consolidate_rowwise(library, genre_df, timeline)))
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_synthetic_matches_rowwise(seed):
+    library = make_library_export(2000, seed)
+    genre_df = csv_roundtrip(make_genre_table(library['Book Id'], seed))
+    # no re-reads: the row-wise version drops their dates, the event parser keeps the latest read
+    timeline = make_timelines(library, seed, reread_rate=0)
+    library = csv_roundtrip(library)
+    pd.testing.assert_frame_equal(csv_roundtrip(consolidate(library, genre_df, timeline)),
+                                  csv_roundtrip(consolidate_rowwise(library, genre_df, timeline)))
+
+
+@pytest.mark.parametrize('excluded', [['Fiction', 'Nonfiction'], ['Sci-Fi (Classic)', 'C++', 'Self.Help']])
+def test_exclude_genres_matches_list_filter(excluded):
+    genre_str = pd.Series(['Sci-Fi (Classic), Fantasy, C++', 'Self.Help', 'SelfXHelp, Sci-Fi Classic, C', 'Fiction, C++, Nonfiction',
+                           'Nonfiction, Self.Help, History', ''])
+    expected = [[g for g in s.split(', ') if g not in excluded] for s in genre_str]
+    assert exclude_genres(genre_str, excluded).tolist() == expected
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the dashboard startup: the modules imported at its top level do not load the
+plotting and consolidation modules, the sections import them when they are opened
+"""
+
+import subprocess
+import sys
+
+DEFERRED_MODULES = ['plotly', 'wordcloud', 'matplotlib', 'goodreads_consolidation', 'goodreads_recommender',
+                    'goodreads_highlights']
+
+
+def test_startup_imports_are_light():
+    code = ('import sys, streamlit, goodreads_datacache, goodreads_telemetry; '
+            'print(",".join(m for m in {!r} if m in sys.modules))'.format(DEFERRED_MODULES))
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == ''
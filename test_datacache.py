@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the data cache: versions of the data file, LRU eviction on memory size
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import goodreads_datacache
+from goodreads_datacache import DataCache, file_fingerprint, object_size
+
+
+@pytest.fixture
+def data_filepath(tmp_path):
+    filepath = str(tmp_path / 'data.csv')
+    pd.DataFrame({'a': [1, 2, 3]}).to_csv(filepath, index=False)
+    return filepath
+
+
+def read_counter(filepath, calls):
+    def read():
+        calls.append(1)
+        return pd.read_csv(filepath)
+    return read
+
+
+def test_computed_once_per_version(data_filepath):
+    cache, calls = DataCache(), []
+    first = cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))
+    assert cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls)) is first
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_invalidated_on_mtime_change(data_filepath):
+    cache, calls = DataCache(), []
+    cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))
+    # same content and size, newer mtime (the file was written again)
+    stat = os.stat(data_filepath)
+    os.utime(data_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))
+    assert len(calls) == 2
+    # the entry of the previous version is dropped
+    assert cache.stats()['entries'] == 1
+
+
+def test_invalidated_on_size_change(data_filepath):
+    cache, calls = DataCache(), []
+    stat = os.stat(data_filepath)
+    assert len(cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))) == 3
+    with open(data_filepath, 'a') as file:
+        file.write('4\n')
+    # even with the mtime of the previous version
+    os.utime(data_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert len(cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))) == 4
+    assert len(calls) == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_invalidate(data_filepath, tmp_path):
+    other_filepath = str(tmp_path / 'other.csv')
+    pd.DataFrame({'b': [1]}).to_csv(other_filepath, index=False)
+    cache, calls = DataCache(), []
+    cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))
+    cache.get_or_compute(other_filepath, ('data',), read_counter(other_filepath, calls))
+    cache.invalidate(data_filepath)
+    assert cache.stats()['entries'] == 1
+    cache.get_or_compute(data_filepath, ('data',), read_counter(data_filepath, calls))
+    assert len(calls) == 3
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0 and cache.total_bytes == 0
+
+
+def test_lru_eviction_on_size(data_filepath):
+    arrays = dict((k, np.zeros(1000)) for k in 'abc')
+    cache = DataCache(max_bytes=2 * arrays['a'].nbytes)
+    cache.get_or_compute(data_filepath, 'a', lambda: arrays['a'])
+    cache.get_or_compute(data_filepath, 'b', lambda: arrays['b'])
+    # a was used last: b is evicted first
+    cache.get_or_compute(data_filepath, 'a', lambda: arrays['a'])
+    cache.get_or_compute(data_filepath, 'c', lambda: arrays['c'])
+    assert [k[2] for k in cache.entries] == ['a', 'c']
+    assert cache.stats()['evictions'] == 1
+    assert cache.total_bytes == 2 * arrays['a'].nbytes
+
+
+def test_object_size():
+    df = pd.DataFrame({'a': np.arange(1000), 'b': ['x' * 10] * 1000})
+    assert object_size(df) == df.memory_usage(index=True, deep=True).sum()
+    assert object_size(np.zeros(100)) == 800
+    assert object_size({'frame': df, 'array': np.zeros(100)}) > object_size(df) + 800
+    assert object_size('x' * 10000) > 10000
+
+
+def test_fingerprint_memo(data_filepath):
+    fingerprint = file_fingerprint(data_filepath)
+    assert file_fingerprint(data_filepath) == fingerprint
+    with open(data_filepath, 'a') as file:
+        file.write('4\n')
+    assert file_fingerprint(data_filepath)[2] != fingerprint[2]
+    # the memo keeps the current version of the file only
+    assert goodreads_datacache._hash_memo[os.path.abspath(data_filepath)][1] == os.path.getsize(data_filepath)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the fetch engine and the page parsers against saved HTML fixtures served from
+localhost (serve_directory)
+"""
+
+import json
+import os
+
+import pytest
+
+from goodreads_benchmark import write_book_fixtures
+from goodreads_fetcher import Fetcher, http_page_loader, make_http_session, serve_directory
+from goodreads_parsers import parse_book_genres, parse_book_timeline, parse_review_book_id
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+REVIEW_PAGE = """<html><body>
+<h1>Jane Doe's Reviews &gt; <a href="/book/show/{book_id}.Some_Book">{title}</a></h1>
+<div class="readingTimeline__text">March 1, 2022 – Shelved as: to-read</div>
+<div class="readingTimeline__text">April 2, 2022 –  Started Reading</div>
+<div class="readingTimeline__text">April 20, 2022 –  Finished Reading</div>
+</body></html>"""
+
+
+@pytest.fixture
+def served_fixtures(tmp_path):
+    """ (base url, {book id: genres}) of book pages written from the bundled crawled genres, and one review page"""
+    with open(os.path.join(REPO_DIR, 'books_genre_20220507.txt'), 'r') as file:
+        genre_dict = dict(list(json.loads(file.read()).items())[:30])
+    write_book_fixtures(genre_dict, str(tmp_path), padding_kb=5)
+    os.makedirs(tmp_path / 'review' / 'show')
+    (tmp_path / 'review' / 'show' / '1.html').write_text(REVIEW_PAGE.format(book_id=42, title='Some Book'))
+    server, base_url = serve_directory(str(tmp_path))
+    yield base_url, genre_dict
+    server.shutdown()
+
+
+def make_fetcher(retries=0):
+    # no rate limit: the fixtures are served locally
+    return Fetcher(http_page_loader(make_http_session(pool_size=4)), workers=4, max_per_host=4,
+                   rate=1e6, burst=4, retries=retries, backoff=0.01, name='test')
+
+
+def test_fetch_book_genres(served_fixtures):
+    base_url, genre_dict = served_fixtures
+    urls = {'{}/book/show/{}.html'.format(base_url, b): b for b in genre_dict}
+    results, failures = make_fetcher().fetch_all(urls, parse_book_genres)
+    assert failures == {}
+    assert list(results) == list(urls)
+    assert dict((urls[u], g) for u, g in results.items()) == genre_dict
+
+
+def test_fetch_review_page(served_fixtures):
+    base_url, genre_dict = served_fixtures
+    url = base_url + '/review/show/1.html'
+    results, failures = make_fetcher().fetch_all([url], lambda p: parse_book_timeline(p) + (parse_review_book_id(p),))
+    title, timeline, book_id = results[url]
+    assert title == 'Some Book'
+    assert timeline == ['March 1, 2022 – Shelved as: to-read', 'April 2, 2022 –  Started Reading',
+                        'April 20, 2022 –  Finished Reading']
+    assert book_id == '42'
+
+
+def test_failed_pages_are_reported(served_fixtures):
+    base_url, genre_dict = served_fixtures
+    missing_url = base_url + '/book/show/missing.html'
+    results, failures = make_fetcher(retries=1).fetch_all([missing_url], parse_book_genres)
+    assert results == {}
+    assert '404' in failures[missing_url]
+
+
+def test_scraper_http_backend(served_fixtures):
+    # the default backend of the scraper: no Chrome driver is started
+    from goodreads_scraper import bs_find_all, make_fetcher as make_scraper_fetcher, make_page_loader
+    base_url, genre_dict = served_fixtures
+    param = {'crawl_concurrency': 4, 'crawl_rate_per_sec': 1e6, 'crawl_retries': 0}
+    drivers = []
+    load_page = make_page_loader(param, 'elementList', drivers)
+    assert drivers == []
+    urls = {'{}/book/show/{}.html'.format(base_url, b): b for b in genre_dict}
+    results, failures = make_scraper_fetcher(param, load_page, None, 'test').fetch_all(urls, parse_book_genres)
+    assert failures == {}
+    assert dict((urls[u], g) for u, g in results.items()) == genre_dict
+
+    session = make_http_session(pool_size=4)
+    book_id, genres = next(iter(genre_dict.items()))
+    elements = bs_find_all('{}/book/show/{}.html'.format(base_url, book_id), 'a', {'class': 'bookPageGenreLink'},
+                           session=session)
+    assert [e.text for e in elements] == genres
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the genre membership matrix against filters over the lists of genre strings
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from goodreads_genres import GenreMatrix
+from goodreads_synthetic import make_genre_lists
+
+
+@pytest.fixture(scope='module')
+def genre_lists():
+    # clean genre lists (no duplicates), with books without genre
+    genre_lists = [sorted(set(g), key=g.index) for g in make_genre_lists(range(3000), seed=0, n_genres=60).values()]
+    return genre_lists + [[], [''], np.nan]
+
+
+def as_list(genres):
+    return genres if isinstance(genres, list) else []
+
+
+@pytest.mark.parametrize('genres', [['Fiction'], ['Fantasy', 'History'], ['Genre 3', 'Not A Genre'], []])
+def test_any_of_matches_list_filter(genre_lists, genres):
+    matrix = GenreMatrix.from_lists(genre_lists)
+    expected = [any(g in as_list(l) for g in genres) for l in genre_lists]
+    assert matrix.any_of(genres).tolist() == expected
+    if len(genres) == 1:
+        assert matrix.has_genre(genres[0]).tolist() == expected
+
+
+@pytest.mark.parametrize('genres', [['Fiction', 'Fantasy'], ['Nonfiction', 'History', 'Science'], ['Fiction', 'Not A Genre']])
+def test_all_of_matches_list_filter(genre_lists, genres):
+    matrix = GenreMatrix.from_lists(genre_lists)
+    expected = [all(g in as_list(l) for g in genres) for l in genre_lists]
+    assert matrix.all_of(genres).tolist() == expected
+
+
+def test_counts_match_list_counts(genre_lists):
+    matrix = GenreMatrix.from_lists(genre_lists)
+    mask = np.arange(len(genre_lists)) % 3 == 0
+    expected = pd.Series([g for l, m in zip(genre_lists, mask) if m for g in as_list(l) if g]).value_counts()
+    counts = pd.Series(matrix.counts(mask), index=matrix.genres)
+    pd.testing.assert_series_equal(counts[counts > 0].sort_index(), expected.sort_index(), check_names=False)
+
+
+def test_from_strings_matches_from_lists(genre_lists, tmp_path):
+    matrix = GenreMatrix.from_lists(genre_lists)
+    from_strings = GenreMatrix.from_strings([', '.join(as_list(l)) for l in genre_lists])
+    matrix.save(str(tmp_path / 'genres.npz'))
+    for other in [from_strings, GenreMatrix.load(str(tmp_path / 'genres.npz'))]:
+        assert other.genres.tolist() == matrix.genres.tolist()
+        np.testing.assert_array_equal(other.indptr, matrix.indptr)
+        np.testing.assert_array_equal(other.indices, matrix.indices)
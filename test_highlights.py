@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the highlight term index against tokenizing the highlights again
+"""
+
+from collections import Counter
+
+import pytest
+
+from goodreads_highlights import HighlightIndex, highlight_book_id, tokenize
+from goodreads_synthetic import make_genre_lists, make_highlights
+
+BOOK_IDS = [str(b) for b in range(1, 201)]
+
+
+def term_counts(highlight_dict, book_ids=None):
+    """ Term counts of the highlights of the books (all books if None), tokenized again"""
+    counts = Counter()
+    for url, texts in highlight_dict.items():
+        if book_ids is None or highlight_book_id(url) in book_ids:
+            for text in texts:
+                counts.update(tokenize(text))
+    return counts
+
+
+def top(counts, k):
+    """ k most frequent terms, ties broken by the term (the order of the index)"""
+    return sorted(counts.items(), key=lambda c: (-c[1], c[0]))[:k]
+
+
+def rows(df):
+    return list(zip(df['term'], df['count']))
+
+
+@pytest.fixture
+def highlight_index(tmp_path):
+    highlight_index = HighlightIndex(str(tmp_path / 'highlights.sqlite'))
+    yield highlight_index
+    highlight_index.close()
+
+
+@pytest.fixture(scope='module')
+def highlight_dict():
+    return make_highlights(BOOK_IDS, 2000, seed=0, vocab_size=500)
+
+
+@pytest.fixture(scope='module')
+def genre_dict():
+    return make_genre_lists(BOOK_IDS, seed=0, n_genres=40)
+
+
+def test_top_terms_match_tokenized(highlight_index, highlight_dict):
+    assert highlight_index.add_highlight_dict(highlight_dict, batch_size=30) == sum(len(t) for t in highlight_dict.values())
+    assert rows(highlight_index.top_terms(50)) == top(term_counts(highlight_dict), 50)
+    for book_id in BOOK_IDS[:10]:
+        assert rows(highlight_index.top_terms(1000, book_id=book_id)) == top(term_counts(highlight_dict, {book_id}), 1000)
+
+
+def test_incremental_add(highlight_index, highlight_dict):
+    urls = list(highlight_dict)
+    first = dict((u, highlight_dict[u]) for u in urls[:100])
+    highlight_index.add_highlight_dict(first)
+    # a new crawl: the known highlights are skipped
+    assert highlight_index.add_highlight_dict(highlight_dict) == sum(len(highlight_dict[u]) for u in urls[100:])
+    assert highlight_index.add_highlight_dict(highlight_dict) == 0
+    assert rows(highlight_index.top_terms(50)) == top(term_counts(highlight_dict), 50)
+
+
+def test_genre_terms_follow_genres(highlight_index, highlight_dict, genre_dict):
+    # genres set before and after the highlights are added
+    highlight_index.set_book_genres(dict((b, genre_dict[b]) for b in BOOK_IDS[:100]))
+    highlight_index.add_highlight_dict(highlight_dict)
+    highlight_index.set_book_genres(dict((b, genre_dict[b]) for b in BOOK_IDS[100:]))
+    # the genres of some books change after a new crawl
+    changed = dict((b, genre_dict[BOOK_IDS[-1 - i]]) for i, b in enumerate(BOOK_IDS[:50]))
+    highlight_index.set_book_genres(changed)
+    genre_dict = dict(genre_dict, **changed)
+    for genre in ['Fiction', 'Fantasy', 'History', 'Genre 5']:
+        books = set(b for b, genres in genre_dict.items() if genre in genres)
+        assert rows(highlight_index.top_terms(1000, genre=genre)) == top(term_counts(highlight_dict, books), 1000)
+
+
+def test_term_matrix_matches_tokenized(highlight_index, highlight_dict):
+    highlight_index.add_highlight_dict(highlight_dict)
+    term_matrix = highlight_index.term_matrix()
+    assert rows(term_matrix.top_terms(50)) == top(term_counts(highlight_dict), 50)
+    books = BOOK_IDS[::7] + ['unknown']
+    assert rows(term_matrix.top_terms(50, books)) == top(term_counts(highlight_dict, set(books)), 50)
+    assert rows(term_matrix.top_terms(50, [])) == []
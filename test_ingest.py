@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming consolidation against the in-memory one
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from goodreads_benchmark import csv_roundtrip
+from goodreads_cache import PageCache
+from goodreads_consolidation import clean_genre_table, consolidate
+from goodreads_ingest import cache_genre_index, consolidate_stream, frame_genre_index
+from goodreads_storage import LIST_COLUMNS, read_consolidated
+from goodreads_synthetic import make_genre_lists, make_library_export, make_timelines
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_streamed(filepath, columns):
+    """ Streamed output in the columns of consolidate(), list columns read from Parquet as lists"""
+    df = read_consolidated(filepath, parse_lists=True)
+    for c in LIST_COLUMNS:
+        df[c] = df[c].map(lambda x: None if x is None else list(x))
+    return csv_roundtrip(df[columns])
+
+
+@pytest.mark.parametrize('output_filename', ['consolidated.csv', 'consolidated.parquet'])
+def test_bundled_matches_in_memory(tmp_path, output_filename):
+    export_filepath = os.path.join(REPO_DIR, 'goodreads_library_export.csv')
+    genre_df = pd.read_csv(os.path.join(REPO_DIR, 'book_genre.csv'))
+    with open(os.path.join(REPO_DIR, 'books_timeline.txt'), 'r') as file:
+        timeline = json.loads(file.read())
+    expected = consolidate(pd.read_csv(export_filepath), genre_df, timeline)
+
+    output_filepath = str(tmp_path / output_filename)
+    chunks = []
+    # several chunks, the last one partial
+    rows = consolidate_stream(export_filepath, frame_genre_index(genre_df), timeline, output_filepath,
+                              chunk_rows=50, on_chunk=chunks.append)
+    assert rows == len(expected)
+    assert chunks == [min(50 * (i + 1), rows) for i in range(len(chunks))] and chunks[-1] == rows
+    pd.testing.assert_frame_equal(read_streamed(output_filepath, expected.columns), csv_roundtrip(expected))
+
+
+def test_synthetic_with_page_cache(tmp_path):
+    library = make_library_export(1200, seed=3)
+    export_filepath = str(tmp_path / 'library_export.csv')
+    library.to_csv(export_filepath, index=False)
+    library = pd.read_csv(export_filepath)
+    # genres of most of the books in the page cache
+    genre_dict = make_genre_lists(library['Book Id'].astype(str).iloc[:1000], seed=3)
+    page_cache = PageCache(str(tmp_path / 'pages.sqlite'))
+    page_cache.import_genre_dict(genre_dict)
+    timeline = make_timelines(library, seed=3)
+    expected = consolidate(library, clean_genre_table(genre_dict), timeline)
+
+    output_filepath = str(tmp_path / 'consolidated.parquet')
+    consolidate_stream(export_filepath, cache_genre_index(page_cache), timeline, output_filepath, chunk_rows=500)
+    page_cache.close()
+    pd.testing.assert_frame_equal(read_streamed(output_filepath, expected.columns), csv_roundtrip(expected))
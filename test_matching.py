@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the review page Book Id and of the timeline title matching tiers
+"""
+
+import pandas as pd
+
+from goodreads_matching import TitleIndex
+from goodreads_parsers import parse_review_book_id
+
+REVIEW_PAGE = """<html><body>
+<h1>Jane Doe's Reviews &gt; <a href="/book/show/{heading}">The Heading Book</a></h1>
+<div class="sidebar"><a href="/book/show/999-other-book">Readers also enjoyed</a></div>
+</body></html>"""
+
+
+def test_review_book_id_from_heading():
+    assert parse_review_book_id(REVIEW_PAGE.format(heading='123.The_Heading_Book')) == '123'
+
+
+def test_review_book_id_ignores_other_links():
+    page = REVIEW_PAGE.replace('<a href="/book/show/{heading}">The Heading Book</a>', 'The Heading Book')
+    assert parse_review_book_id(page) is None
+
+
+def test_book_id_tier_before_titles():
+    # the timeline title is far from the library title, only its Book Id joins it
+    index = TitleIndex(['Completely Different Heading', 'Second Book'], [42, None])
+    matches = index.match(pd.Series(['First Book', 'Second Book']), pd.Series([42, 7]))
+    assert matches['book_title'].tolist() == ['Completely Different Heading', 'Second Book']
+    assert matches['match_method'].tolist() == ['book_id', 'exact']
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the stage graph runner: order, skipping of up-to-date stages, reruns when a hash
+changes
+"""
+
+import os
+
+import pytest
+
+from goodreads_pipeline import Pipeline, Stage
+
+
+def write(filepath, text):
+    with open(filepath, 'w') as file:
+        file.write(text)
+
+
+def read(filepath):
+    with open(filepath, 'r') as file:
+        return file.read()
+
+
+@pytest.fixture
+def pipeline_param(tmp_path):
+    param = {'in_filepath': str(tmp_path / 'in.txt'), 'upper_filepath': str(tmp_path / 'upper.txt'),
+             'count_filepath': str(tmp_path / 'count.txt'), 'suffix': '!', 'crawl_state': 'a'}
+    write(param['in_filepath'], 'some text')
+    return param
+
+
+def make_pipeline(tmp_path, calls, fail=()):
+    def upper(param):
+        calls.append('upper')
+        write(param['upper_filepath'], read(param['in_filepath']).upper() + param['suffix'])
+
+    def count(param):
+        calls.append('count')
+        if 'count' in fail:
+            raise RuntimeError('count failed')
+        write(param['count_filepath'], str(len(read(param['upper_filepath']))))
+
+    stages = [
+        # declared out of order: the order follows from the files
+        Stage('count', count, inputs=['upper_filepath'], outputs=['count_filepath']),
+        Stage('upper', upper, inputs=['in_filepath'], outputs=['upper_filepath'], params=['suffix'],
+              sources=['goodreads_pipeline.py'], state=lambda param: param['crawl_state']),
+    ]
+    return Pipeline(stages, str(tmp_path / 'state.json'))
+
+
+def statuses(records):
+    return dict((r['stage'], r['status']) for r in records)
+
+
+def test_skips_up_to_date_stages(tmp_path, pipeline_param):
+    calls = []
+    records = make_pipeline(tmp_path, calls).run(pipeline_param)
+    assert [r['stage'] for r in records] == ['upper', 'count']
+    assert statuses(records) == {'upper': 'ran', 'count': 'ran'}
+    assert calls == ['upper', 'count']
+    assert read(pipeline_param['count_filepath']) == '10'
+
+    # a new pipeline reads the keys back from the state file
+    calls.clear()
+    assert statuses(make_pipeline(tmp_path, calls).run(pipeline_param)) == {'upper': 'skipped', 'count': 'skipped'}
+    # an input written again with the same content
+    write(pipeline_param['in_filepath'], 'some text')
+    assert statuses(make_pipeline(tmp_path, calls).run(pipeline_param)) == {'upper': 'skipped', 'count': 'skipped'}
+    assert calls == []
+
+
+@pytest.mark.parametrize('change, count_status', [('input', 'ran'), ('param', 'ran'), ('state', 'skipped'),
+                                                  ('output', 'skipped')])
+def test_reruns_when_a_hash_changes(tmp_path, pipeline_param, change, count_status):
+    calls = []
+    make_pipeline(tmp_path, calls).run(pipeline_param)
+    calls.clear()
+    if change == 'input':
+        write(pipeline_param['in_filepath'], 'some other text')
+    elif change == 'param':
+        pipeline_param['suffix'] = '?'
+    elif change == 'state':
+        pipeline_param['crawl_state'] = 'b'
+    elif change == 'output':
+        write(pipeline_param['upper_filepath'], 'edited by hand')
+    records = make_pipeline(tmp_path, calls).run(pipeline_param)
+    # count only runs again when upper wrote something else
+    assert statuses(records) == {'upper': 'ran', 'count': count_status}
+    assert read(pipeline_param['upper_filepath']) == read(pipeline_param['in_filepath']).upper() + pipeline_param['suffix']
+    assert read(pipeline_param['count_filepath']) == str(len(read(pipeline_param['upper_filepath'])))
+
+
+def test_force_and_selection(tmp_path, pipeline_param):
+    calls = []
+    make_pipeline(tmp_path, calls).run(pipeline_param)
+    calls.clear()
+    records = make_pipeline(tmp_path, calls).run(pipeline_param, names=['count'], force=['count'])
+    assert statuses(records) == {'count': 'ran'}
+    assert calls == ['count']
+    with pytest.raises(KeyError):
+        make_pipeline(tmp_path, calls).run(pipeline_param, force=['unknown'])
+
+
+def test_failed_stage_runs_again(tmp_path, pipeline_param):
+    calls = []
+    records = make_pipeline(tmp_path, calls, fail=['count']).run(pipeline_param)
+    assert statuses(records) == {'upper': 'ran', 'count': 'failed'}
+    assert 'count failed' in records[1]['error']
+    calls.clear()
+    assert statuses(make_pipeline(tmp_path, calls).run(pipeline_param)) == {'upper': 'skipped', 'count': 'ran'}
+
+
+def test_failed_stage_blocks_the_next(tmp_path, pipeline_param):
+    calls = []
+    os.remove(pipeline_param['in_filepath'])
+    pipeline = make_pipeline(tmp_path, calls)
+    records = pipeline.run(pipeline_param)
+    assert statuses(records) == {'upper': 'failed', 'count': 'blocked'}
+    assert 'missing input in_filepath' in records[0]['error']
+    assert calls == []
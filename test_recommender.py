@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the genre vector recommender against a dense brute-force TF-IDF ranking
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from goodreads_benchmark import synthetic_recommender_books
+from goodreads_recommender import GenreVectors, Recommender, blocked_top_k, split_genres
+
+
+@pytest.fixture(scope='module')
+def books():
+    return synthetic_recommender_books(3000, seed=0)
+
+
+def dense_tfidf(genre_lists, genres):
+    """ books x genres TF-IDF as documented: tf = 1 / log2(position + 2), idf = log((1 + books) /
+    (1 + books with the genre)) + 1, rows of unit norm
+    """
+    column = dict((g, i) for i, g in enumerate(genres))
+    tf = np.zeros((len(genre_lists), len(genres)))
+    for row, genre_list in enumerate(genre_lists):
+        for position, genre in enumerate(genre_list):
+            tf[row, column[genre]] = 1 / np.log2(position + 2)
+    idf = np.log((1 + len(genre_lists)) / (1 + (tf > 0).sum(axis=0))) + 1
+    tfidf = tf * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    return np.divide(tfidf, norms, out=np.zeros_like(tfidf), where=norms > 0)
+
+
+def dense_vectors(vectors):
+    """ books x genres matrix of the normalized CSR vectors"""
+    dense = np.zeros((len(vectors), len(vectors.genres)))
+    rows = np.repeat(np.arange(len(vectors)), np.diff(vectors.indptr))
+    dense[rows, vectors.indices] = vectors.normalized()
+    return dense
+
+
+def test_vectors_match_dense_tfidf(books):
+    vectors = GenreVectors.encode(books['Book Id'], books['clean_genre_list'])
+    expected = dense_tfidf(split_genres(books['clean_genre_list']).tolist(), vectors.genres)
+    np.testing.assert_allclose(dense_vectors(vectors), expected, atol=1e-6)
+
+
+def test_recommend_matches_brute_force(books):
+    recommender = Recommender(GenreVectors.encode(books['Book Id'], books['clean_genre_list']), books)
+    tfidf = dense_vectors(recommender.vectors)
+    my_rating = books['My Rating'].to_numpy(dtype=np.float64)
+    weights = np.where(my_rating > 0, (my_rating - 3) + (my_rating - books['Average Rating'].fillna(0).to_numpy()), 0)
+    profile = weights @ tfidf
+    profile /= np.linalg.norm(profile)
+    scores = tfidf @ profile * books['Average Rating'].fillna(0).to_numpy() / 5
+    to_read = np.flatnonzero(books['Exclusive Shelf'].to_numpy() == 'to-read')
+    expected = to_read[np.argsort(-scores[to_read], kind='stable')[:20]]
+
+    recommended = recommender.recommend(20)
+    np.testing.assert_allclose(recommended['score'], scores[expected], atol=1e-4)
+    assert set(recommended['Book Id']) == set(books['Book Id'].to_numpy()[expected])
+
+
+@pytest.mark.parametrize('block_rows', [7, 1000, 100000])
+def test_blocked_top_k_matches_dense(books, block_rows):
+    vectors = GenreVectors.encode(books['Book Id'], books['clean_genre_list'])
+    data = vectors.normalized()
+    dense = dense_vectors(vectors)
+    queries = np.random.default_rng(0).random((3, len(vectors.genres)))
+    candidates = np.arange(len(vectors)) % 4 != 0
+    rows, scores = blocked_top_k(vectors.indptr, vectors.indices, data, queries, 10, candidates, block_rows)
+    expected = np.where(candidates[:, None], dense @ queries.T, -np.inf)
+    for q in range(len(queries)):
+        np.testing.assert_allclose(scores[q], np.sort(expected[:, q])[::-1][:10], rtol=1e-5)
+        assert candidates[rows[q]].all()
+
+
+def test_update_matches_encode(books):
+    vectors = GenreVectors.encode(books['Book Id'], books['clean_genre_list'])
+    changed = books.copy()
+    changed.loc[:29, 'clean_genre_list'] = synthetic_recommender_books(30, seed=1)['clean_genre_list'].to_numpy()
+    # 30 books changed, 100 removed and 50 added
+    changed = pd.concat([changed.drop(range(200, 300)), synthetic_recommender_books(50, seed=2, first_book=3000)],
+                        ignore_index=True)
+    updated, n_encoded = vectors.update(changed['Book Id'], changed['clean_genre_list'])
+    assert n_encoded == 80
+    encoded = GenreVectors.encode(changed['Book Id'], changed['clean_genre_list'])
+    np.testing.assert_array_equal(updated.book_ids, encoded.book_ids)
+    # the vocabulary of the update keeps the previous codes: compare by genre name
+    updated_dense = pd.DataFrame(dense_vectors(updated), columns=updated.genres)
+    encoded_dense = pd.DataFrame(dense_vectors(encoded), columns=encoded.genres)
+    pd.testing.assert_frame_equal(updated_dense[encoded.genres].loc[:, lambda d: d.any()],
+                                  encoded_dense.loc[:, lambda d: d.any()], atol=1e-6)
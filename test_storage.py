@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Parquet storage of the consolidated dataset against the CSV it replaces
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from goodreads_storage import LIST_COLUMNS, migrate_csv_to_parquet, read_consolidated
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_FILEPATH = os.path.join(REPO_DIR, 'book_data_consolidated_fin.csv')
+
+
+@pytest.fixture(scope='module')
+def parquet_filepath(tmp_path_factory):
+    filepath = str(tmp_path_factory.mktemp('storage') / 'consolidated.parquet')
+    migrate_csv_to_parquet(CSV_FILEPATH, filepath)
+    return filepath
+
+
+def as_lists(df):
+    """ list columns read from Parquet (arrays) as lists, like the parsed CSV ones"""
+    df = df.copy()
+    for c in LIST_COLUMNS:
+        if c in df.columns:
+            df[c] = df[c].map(lambda x: None if x is None else list(x))
+    return df
+
+
+def test_parquet_matches_csv(parquet_filepath):
+    csv_df = read_consolidated(CSV_FILEPATH, parse_lists=True)
+    parquet_df = read_consolidated(parquet_filepath)
+    assert parquet_df.columns.tolist() == csv_df.columns.tolist()
+    for c in ['date_read', 'date_added', 'start_reading_dt']:
+        assert parquet_df[c].dtype.kind == 'M'
+    pd.testing.assert_frame_equal(as_lists(parquet_df), csv_df, check_dtype=False)
+
+
+@pytest.mark.parametrize('columns, filters', [
+    (['Book Id', 'My Rating', 'genre_list_trf'], [('My Rating', '!=', 0)]),
+    (['Book Id', 'Title'], [('is_fiction', '==', 1), ('Exclusive Shelf', 'in', ['read', 'currently-reading'])]),
+    (['Book Id', 'date_read'], [[('is_fiction', '==', 1)], [('is_nonfiction', '==', 1)]]),
+    (None, None),
+])
+def test_filters_match_csv(parquet_filepath, columns, filters):
+    csv_df = read_consolidated(CSV_FILEPATH, columns=columns, filters=filters, parse_lists=True)
+    parquet_df = read_consolidated(parquet_filepath, columns=columns, filters=filters)
+    assert len(csv_df) > 0
+    pd.testing.assert_frame_equal(as_lists(parquet_df), csv_df, check_dtype=False)
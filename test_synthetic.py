@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the synthetic datasets of the benchmark suite
+"""
+
+import json
+import os
+
+import pandas as pd
+
+from goodreads_synthetic import make_genre_lists, make_library_export, write_dataset
+
+
+def read_dataset(param):
+    with open(param['genre_filepath'], 'r') as file:
+        genre_dict = json.loads(file.read())
+    with open(param['timeline_filepath'], 'r') as file:
+        timeline = json.loads(file.read())
+    return pd.read_csv(param['gr_library_export_filepath']), genre_dict, timeline
+
+
+def test_parts_are_consistent(tmp_path):
+    param = write_dataset(str(tmp_path), 250, seed=0, part_rows=100, timeline_books=150, highlight_books=20)
+    library, genre_dict, timeline = read_dataset(param)
+    assert len(library) == 250 and library['Book Id'].is_unique
+    assert list(genre_dict) == library['Book Id'].astype(str).tolist()
+    assert pd.read_csv(param['clean_genre_filepath'])['book_id'].tolist() == library['Book Id'].tolist()
+    assert len(timeline) <= 150
+    with open(os.path.join(str(tmp_path), 'parameters.json'), 'r') as file:
+        assert json.loads(file.read()) == param
+
+
+def test_parts_do_not_repeat(tmp_path):
+    write_dataset(str(tmp_path), 300, seed=0, part_rows=100, timeline_books=0, highlight_books=0)
+    library = pd.read_csv(os.path.join(str(tmp_path), 'goodreads_library_export.csv'))
+    parts = [library.iloc[i:i + 100].drop(columns=['Book Id']).reset_index(drop=True) for i in range(0, 300, 100)]
+    for column in ['Title', 'My Rating', 'Number of Pages', 'Date Added']:
+        assert not parts[0][column].equals(parts[1][column])
+        assert not parts[1][column].equals(parts[2][column])
+
+
+def test_single_part_and_same_seed(tmp_path):
+    # a dataset of one part is the one of its seed, the same seed writes the same files
+    param = write_dataset(str(tmp_path / 'a'), 80, seed=4, part_rows=100, highlight_books=10)
+    library, genre_dict, timeline = read_dataset(param)
+    expected = make_library_export(80, 4)
+    assert library['Title'].tolist() == expected['Title'].tolist()
+    assert genre_dict == make_genre_lists(expected['Book Id'], 4)
+    other = write_dataset(str(tmp_path / 'b'), 80, seed=4, part_rows=100, highlight_books=10)
+    for key in ['gr_library_export_filepath', 'genre_filepath', 'timeline_filepath', 'highlight_filepath']:
+        with open(param[key], 'rb') as a, open(other[key], 'rb') as b:
+            assert a.read() == b.read()
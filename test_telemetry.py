@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the telemetry: spans, counters, progress, the JSONL log and its follower
+"""
+
+import json
+import os
+import urllib.request
+
+import pytest
+
+from goodreads_telemetry import LogFollower, Telemetry, prometheus_text, serve_metrics
+
+
+def read_events(filepath):
+    with open(filepath, 'r') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_spans_and_counters(tmp_path):
+    telemetry = Telemetry(str(tmp_path / 'telemetry.jsonl'))
+    with telemetry.span('parse', source='genres') as labels:
+        labels['status'] = 'ok'
+    with pytest.raises(ValueError):
+        with telemetry.span('parse', source='genres'):
+            raise ValueError('bad page')
+    telemetry.count('pages', source='genres')
+    telemetry.count('pages', 2, source='genres')
+
+    assert telemetry.histograms[('parse', (('source', 'genres'), ('status', 'ok')))].count == 1
+    assert telemetry.histograms[('parse', (('source', 'genres'),))].count == 1
+    assert telemetry.counters[('pages', (('source', 'genres'),))] == 3
+    assert telemetry.counters[('errors', (('error', 'ValueError'), ('source', 'genres'), ('span', 'parse')))] == 1
+    events = read_events(telemetry.log_filepath)
+    assert [e['type'] for e in events] == ['span', 'span']
+    assert events[0]['labels'] == {'source': 'genres', 'status': 'ok'} and 'error' not in events[0]
+    assert events[1]['error'] == 'ValueError'
+
+
+def test_progress_is_throttled(tmp_path):
+    telemetry = Telemetry(str(tmp_path / 'telemetry.jsonl'))
+    with telemetry.track('genres', total=100) as progress:
+        for i in range(100):
+            progress.advance(errors=int(i % 10 == 0))
+    events = [e for e in read_events(telemetry.log_filepath) if e['type'] == 'progress']
+    # the first update, the last one (done == total), and the finish
+    assert len(events) == 3
+    assert events[-1]['done'] == 100 and events[-1]['errors'] == 10 and events[-1]['finished']
+
+
+def test_prometheus_text():
+    telemetry = Telemetry()
+    telemetry.count('pages', source='genres', status='ok')
+    telemetry.observe('fetch', 0.02, source='genres')
+    telemetry.observe('fetch', 3, source='genres')
+    telemetry.track('genres', total=10).advance(4)
+    text = prometheus_text(telemetry)
+    assert 'goodreads_pages_total{source="genres",status="ok"} 1' in text
+    assert 'goodreads_fetch_seconds_bucket{source="genres",le="0.05"} 1' in text
+    assert 'goodreads_fetch_seconds_bucket{source="genres",le="+Inf"} 2' in text
+    assert 'goodreads_fetch_seconds_count{source="genres"} 2' in text
+    assert 'goodreads_progress_done{task="genres"} 4' in text
+    assert text.count('# TYPE goodreads_fetch_seconds histogram') == 1
+
+
+def test_metrics_endpoint():
+    telemetry = Telemetry()
+    telemetry.count('pages', source='genres')
+    server = serve_metrics(telemetry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(port)) as response:
+            assert response.read().decode() == prometheus_text(telemetry)
+    finally:
+        server.shutdown()
+
+
+def test_follower_reads_new_lines_and_survives_rotation(tmp_path):
+    log_filepath = str(tmp_path / 'telemetry.jsonl')
+    telemetry = Telemetry(log_filepath)
+    telemetry.emit({'type': 'stage', 'stage': 'genres', 'status': 'ran'})
+    follower = LogFollower(log_filepath, pid=os.getpid()).poll()
+    assert follower.stages['genres']['status'] == 'ran'
+
+    with telemetry.span('fetch', source='genres'):
+        pass
+    with open(log_filepath, 'a') as file:
+        # another process, and a line still being written
+        file.write(json.dumps({'type': 'stage', 'stage': 'timeline', 'pid': -1}) + '\n{"type": "sp')
+    follower.poll()
+    assert follower.spans['fetch (genres)']['count'] == 1
+    assert 'timeline' not in follower.stages
+
+    # the log is rotated by its owner: the follower reads the new file from its start
+    telemetry.configure(None)
+    os.replace(log_filepath, log_filepath + '.1')
+    telemetry.configure(log_filepath)
+    telemetry.emit({'type': 'progress', 'task': 'genres', 'done': 1, 'total': 2})
+    assert follower.poll().progress['genres']['done'] == 1
+
+
+def test_configure_rotates_only_with_max_bytes(tmp_path):
+    log_filepath = str(tmp_path / 'telemetry.jsonl')
+    with open(log_filepath, 'w') as file:
+        file.write('x' * 1000 + '\n')
+    Telemetry().configure(log_filepath)
+    assert not os.path.exists(log_filepath + '.1')
+    Telemetry().configure(log_filepath, max_log_bytes=100)
+    assert os.path.exists(log_filepath + '.1') and not os.path.exists(log_filepath)
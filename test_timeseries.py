@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the reading velocity series against pandas resamples of the reading days
+(goodreads_benchmark baseline: one row per book, genre and reading day)
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from goodreads_aggregates import ALL_GENRES
+from goodreads_benchmark import reading_days_frame, synthetic_reading_books
+from goodreads_timeseries import ReadingSeries, reading_intervals
+
+
+@pytest.fixture(scope='module')
+def reading_books():
+    df = synthetic_reading_books(3000, seed=0)
+    # clean genre lists, as consolidated (no genre twice in a list)
+    df['genre_list_trf'] = [sorted(set(g), key=g.index) for g in df['genre_list_trf']]
+    return df
+
+
+@pytest.fixture(scope='module')
+def series(reading_books):
+    return ReadingSeries.build(reading_books)
+
+
+def daily_frame(reading_books, genre):
+    """ pages and books read per day of the genre, on every day of the series"""
+    if genre == ALL_GENRES:
+        books, start, finish, pages = reading_intervals(reading_books)
+        n_days = (finish - start).astype(np.int64) + 1
+        days = pd.DataFrame({'day': np.concatenate([np.arange(s, f + 1) for s, f in zip(start, finish)]),
+                             'pages': np.repeat(pages / n_days, n_days)})
+        finished = pd.Series(1.0, index=pd.DatetimeIndex(finish))
+    else:
+        days = reading_days_frame(reading_books)
+        days = days[days['genre'] == genre]
+        books = reading_books[reading_books['date_read'].notna() &
+                              reading_books['genre_list_trf'].map(lambda g: genre in g)].drop_duplicates(subset='Book Id')
+        finished = pd.Series(1.0, index=pd.DatetimeIndex(books['date_read'].dt.normalize()))
+    pages = days.groupby(pd.DatetimeIndex(days['day']))['pages'].sum()
+    every_day = pd.date_range(pages.index.min(), pages.index.max())
+    return pd.DataFrame({'pages': pages, 'books': finished.groupby(level=0).sum()}).reindex(every_day).fillna(0)
+
+
+@pytest.mark.parametrize('genre', [ALL_GENRES, 'Fantasy', 'History'])
+@pytest.mark.parametrize('freq, pandas_freq', [('M', 'MS'), ('Y', 'YS')])
+def test_periods_match_resample(reading_books, series, genre, freq, pandas_freq):
+    daily = daily_frame(reading_books, genre)
+    for measure in ['books', 'pages']:
+        expected = daily[measure].resample(pandas_freq).sum()
+        result = series.series(measure, genre, freq)
+        result = result[(result.index >= expected.index[0]) & (result.index <= expected.index[-1])]
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=1e-6)
+        assert result.index.equals(expected.index)
+
+
+@pytest.mark.parametrize('genre', [ALL_GENRES, 'Fantasy'])
+@pytest.mark.parametrize('window_days', [1, 7, 30])
+def test_rolling_matches_pandas_rolling(reading_books, series, genre, window_days):
+    daily = daily_frame(reading_books, genre)
+    start, end = daily.index[100], daily.index[400]
+    expected = daily['pages'].rolling(window_days, min_periods=1).sum()[start:end]
+    result = series.rolling('pages', genre, window_days, start, end)
+    # the series start on the first reading day of all the genres: the days before the genre have no pages
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=1e-6)
+    assert result.index.equals(expected.index)
+
+
+@pytest.mark.parametrize('genre', [ALL_GENRES, 'History'])
+def test_total_matches_range_sum(reading_books, series, genre):
+    daily = daily_frame(reading_books, genre)
+    for start, end in [(None, None), (daily.index[10], daily.index[200]), (daily.index[0], daily.index[0])]:
+        expected = daily.loc[start:end].sum()
+        for measure in ['books', 'pages']:
+            assert series.total(measure, genre, start, end) == pytest.approx(expected[measure])
+
+
+def test_stored_series(series, tmp_path):
+    series.save(str(tmp_path / 'series.npz'))
+    loaded = ReadingSeries.load(str(tmp_path / 'series.npz'))
+    assert loaded.genres.tolist() == series.genres.tolist()
+    pd.testing.assert_series_equal(loaded.series('pages', 'Fantasy', 'M'), series.series('pages', 'Fantasy', 'M'))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the user partitions and of the upload / consolidation jobs, on synthetic library
+exports
+"""
+
+import os
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+from goodreads_synthetic import make_library_export
+from goodreads_users import UserStore, user_partition
+
+
+@pytest.fixture
+def user_store(tmp_path):
+    store = UserStore(str(tmp_path), workers=1)
+    yield store
+    store.shutdown()
+
+
+def export_bytes(n_books, seed=0):
+    return make_library_export(n_books, seed).to_csv(index=False).encode('utf-8')
+
+
+def test_user_partition_names(tmp_path):
+    partition = os.path.basename(user_partition(str(tmp_path), ' Jane.Doe '))
+    assert partition.startswith('jane-doe-')
+    # ids reduced to the same name get their own partition
+    user_ids = ['jane doe', 'Jane Doe', 'jane-doe', 'jane  doe']
+    assert len(set(user_partition(str(tmp_path), u) for u in user_ids)) == len(user_ids)
+
+
+@pytest.mark.parametrize('user_id', ['', '!!!', '日本'])
+def test_user_partition_rejects_empty_names(tmp_path, user_id):
+    with pytest.raises(ValueError):
+        user_partition(str(tmp_path), user_id)
+
+
+def test_upload_until_ready(user_store):
+    assert user_store.status('jane')['status'] == 'missing'
+    user_store.submit_upload('jane', export_bytes(200))
+    assert user_store.status('jane')['status'] in ('pending', 'running')
+    assert user_store.consolidated_filepath('jane') is None
+    user_store.wait(timeout=120)
+    status = user_store.status('jane')
+    assert status['status'] == 'ready'
+    assert status['books'] == 200
+    assert len(pd.read_parquet(user_store.consolidated_filepath('jane'))) == 200
+    assert user_store.status('john')['status'] == 'missing'
+
+
+def test_upload_refused_while_running(user_store):
+    # a job of the user that is not done yet
+    user_store.jobs[user_partition(user_store.root_dir, 'jane')] = Future()
+    with pytest.raises(RuntimeError):
+        user_store.submit_upload('jane', export_bytes(10))
+    # the other users are not blocked
+    user_store.submit_upload('john', export_bytes(10))
+    user_store.jobs.pop(user_partition(user_store.root_dir, 'jane'))
+    user_store.wait(timeout=120)
+    assert user_store.status('john')['status'] == 'ready'